@@ -33,20 +33,29 @@ in_app_copyright = "2021-2022 GRI ESPCI"
 
 # Define Flask subclass
 class IntraRezApp(flask.Flask):
-    """:class:`flask.Flask` subclass. Only adds anew logger:
+    """:class:`flask.Flask` subclass. Adds new loggers and times views:
 
     Attrs:
         actions_logger (logging.Logger): Child of app logger used to
             report important actions (see :mod:`.tools.loggers`).
+        access_logger (logging.Logger): Child of app logger used to
+            log requests served (see :mod:`.tools.access_log`).
     """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Add rezidents actions logger
         self.actions_logger = self.logger.getChild("actions")
+        # Add access logger
+        self.access_logger = self.logger.getChild("access")
+
+    def dispatch_request(self) -> "typing.RouteReturn":
+        """Call the view function, recording its execution time."""
+        with access_log.phase("view"):
+            return super().dispatch_request()
 
 
 # Imports needing IntraRezApp - don't move!
-from app.tools import loggers, utils, typing
+from app.tools import access_log, loggers, utils, typing
 
 # Load extensions
 db = flask_sqlalchemy.SQLAlchemy()
@@ -101,11 +110,13 @@ def create_app(config_class: type = Config) -> IntraRezApp:
 
     # Configure logging
     loggers.configure_logging(app)
+    access_log.init_app(app)
     app.logger.info("Intrarez startup")
 
     # Set up mail processors building
     # ! Keep import here to avoid circular import issues !
     from app import email
+    email.init_app(app)
     app.before_first_request(email.init_premailer)
     app.before_first_request(email.init_textifier)
 
@@ -126,35 +137,36 @@ def create_app(config_class: type = Config) -> IntraRezApp:
         # Valid URL
         return None
 
+    # Set up devices last seen times buffering
+    # ! Keep import here to avoid circular import issues !
+    from app.tools import last_seen
+    last_seen.init_app(app)
+
+    # Set up DHCP regeneration queue
+    # ! Keep import here to avoid circular import issues !
+    from app.tools import dhcp
+    dhcp.init_app(app)
+
+    # Set up subscription state transitions scheduler
+    # ! Keep import here to avoid circular import issues !
+    from app.tools import scheduler
+    scheduler.init_app(app)
+
     # Set up custom context creation
     # ! Keep import here to avoid circular import issues !
     from app import context
-    app.before_request(context.create_request_context)
+    app.before_request(
+        access_log.timed("context")(context.create_request_context)
+    )
+    context.set_context_level(context.ContextLevel.none, endpoint="static")
 
     # Set up custom logging
     @app.after_request
     def _log_after(response: flask.Response) -> flask.Response:
-        """Add a logging entry describing the response served."""
+        """Add an access log entry describing the response served."""
         if flask.request.endpoint != "static":
-            endpoint = flask.request.endpoint or f"[CP:<{flask.request.url}>]"
-            if response.status_code < 400:          # Success
-                msg = f"Served '{endpoint}'"
-                if response.status_code >= 300:     # Redirect
-                    msg += " [redirecting]"
-            else:                                   # Error
-                msg = f"Served error page ({flask.request}: {response.status})"
-
-            remote_ip = flask.request.headers.get("X-Real-Ip", "<unknown IP>")
-            user = "<anonymous>"
-            try:
-                if flask.g.logged_in:
-                    user = repr(flask.g.logged_in_user)
-                    if flask.g.doas:
-                        user += f" AS {flask.g.rezident!r}"
-            except AttributeError:
-                pass
-            msg += f" to {remote_ip} ({user})"
-            app.logger.info(msg)
+            entry = access_log.build_entry(response)
+            app.access_logger.info(json.dumps(entry))
         return response
 
     # All set!
@@ -1,10 +1,8 @@
 """Intranet de la Rez - Authentication-related Emails"""
 
-import flask
-import flask_babel
-from flask_babel import _
+from flask_babel import lazy_gettext as _l
 
-from app.email import send_email
+from app.email import send_bulk
 from app.models import Rezident
 
 
@@ -14,17 +12,9 @@ def send_account_registered_email(rezident: Rezident) -> None:
     Args:
         rezident: The rezident that just registered.
     """
-    subject = _("Compte créé avec succès !")
-    html_body = flask.render_template(
-        "auth/mails/account_registered.html",
-        rezident=rezident,
-    )
-    send_email(
-        "auth/account_registered",
-        subject=f"[IntraRez] {subject}",
-        recipients={rezident.email: rezident.full_name},
-        html_body=html_body,
-    )
+    send_bulk("auth/account_registered", [rezident],
+              _l("Compte créé avec succès !"), default_locale=None,
+              block=False)
 
 
 def send_password_reset_email(rezident: Rezident) -> None:
@@ -33,18 +23,12 @@ def send_password_reset_email(rezident: Rezident) -> None:
     Args:
         rezident: The rezident to reset password of.
     """
-    with flask_babel.force_locale(rezident.locale or "fr"):
-        # Render mail content in rezident's language (if doas, ...)
-        subject = _("Réinitialisation du mot de passe")
-        html_body = flask.render_template(
-            "auth/mails/reset_password.html",
-            rezident=rezident,
-            token=rezident.get_reset_password_token(),
-        )
-
-    send_email(
-        "auth/reset_password",
-        subject=f"[IntraRez] {subject}",
-        recipients={rezident.email: rezident.full_name},
-        html_body=html_body,
+    send_bulk(
+        "auth/reset_password", [rezident],
+        _l("Réinitialisation du mot de passe"),
+        context=lambda rezident: {
+            "token": rezident.get_reset_password_token()
+        },
+        default_locale="fr",
+        block=False,
     )
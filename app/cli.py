@@ -1,12 +1,16 @@
 """Intranet de la Rez Flask App - custom CLI commands"""
 
+import datetime
 import os
 import subprocess
+import time
 from shutil import which
 
 import click
 
 from app import IntraRezApp
+from app import db
+from app.tools import access_log, benchmarks, dhcp, leases, nftables
 from app.tools.utils import print_progressbar, run_script
 
 
@@ -94,3 +98,175 @@ def register(app: IntraRezApp) -> None:
         for func in app.before_first_request_funcs:
             func()
         run_script(name)
+
+    @app.cli.group()
+    def bench() -> None:
+        """Performance benchmarks."""
+        pass
+
+    @bench.command("context")
+    @click.option("-n", "--number", default=200, show_default=True,
+                  help="Number of requests for each case.")
+    @click.option("--ip", default="127.0.0.1", show_default=True,
+                  help="IP the requests should come from.")
+    def bench_context(number: int, ip: str) -> None:
+        """Measure the cost of the request context creation."""
+        for line in benchmarks.bench_context(app, number, ip):
+            print(line)
+
+    @bench.command("logging")
+    @click.option("-n", "--number", default=200, show_default=True,
+                  help="Number of records / requests for each case.")
+    @click.option("--ip", default="127.0.0.1", show_default=True,
+                  help="IP the requests should come from.")
+    @click.option("-d", "--write-delay", default=0.0, show_default=True,
+                  help="Simulated additional cost of a record write, in "
+                       "seconds.")
+    def bench_logging(number: int, ip: str, write_delay: float) -> None:
+        """Measure the cost of logging, in and out of requests."""
+        for line in benchmarks.bench_logging(app, number, ip, write_delay):
+            print(line)
+
+    @bench.command("indexes")
+    @click.option("-r", "--rezidents", default=10000, show_default=True,
+                  help="Number of rezidents to generate.")
+    @click.option("-n", "--number", default=200, show_default=True,
+                  help="Number of executions of each query.")
+    @click.option("--url", default="sqlite://", show_default=True,
+                  help="URL of an empty scratch database (NOT production!)")
+    def bench_indexes(rezidents: int, number: int, url: str) -> None:
+        """Compare query plans without and with indexes."""
+        try:
+            for line in benchmarks.bench_indexes(url, rezidents, number):
+                print(line)
+        except ValueError as exc:
+            raise click.BadParameter(str(exc), param_hint="--url")
+
+    @bench.command("mails")
+    @click.option("-n", "--number", default=200, show_default=True,
+                  help="Number of mails to send with each strategy.")
+    @click.option("-d", "--connect-delay", default=0.05, show_default=True,
+                  help="Simulated cost of a SMTP connection, in seconds.")
+    def bench_mails(number: int, connect_delay: float) -> None:
+        """Compare mail delivery strategies against a local SMTP sink."""
+        for line in benchmarks.bench_mails(app, number, connect_delay):
+            print(line)
+
+    @bench.command("discord")
+    @click.option("-n", "--number", default=200, show_default=True,
+                  help="Number of records to log with each strategy.")
+    @click.option("-l", "--limit", default=5, show_default=True,
+                  help="Messages accepted per rate limit window.")
+    @click.option("-w", "--window", default=2.0, show_default=True,
+                  help="Duration of a rate limit window, in seconds.")
+    def bench_discord(number: int, limit: int, window: float) -> None:
+        """Compare Discord logging strategies against a local stub."""
+        for line in benchmarks.bench_discord(number, limit, window):
+            print(line)
+
+    @app.cli.group("access-log")
+    def access_log_group() -> None:
+        """Access log analysis commands."""
+        pass
+
+    @access_log_group.command("stats")
+    @click.argument("files", nargs=-1, type=click.Path(exists=True))
+    @click.option("-d", "--days", default=None, type=float,
+                  help="Only consider the requests of the last DAYS days.")
+    @click.option("-l", "--limit", default=30, show_default=True,
+                  help="Maximal number of endpoints shown.")
+    def access_log_stats(files: tuple[str, ...], days: float | None,
+                         limit: int) -> None:
+        """Latency percentiles and phases per endpoint.
+
+        Reads FILES, or the access log and its rotated files.
+        """
+        since = None
+        if days is not None:
+            since = (datetime.datetime.now(datetime.timezone.utc)
+                     - datetime.timedelta(days=days))
+        entries = access_log.read_entries(files or access_log.log_files())
+        stats = access_log.endpoint_stats(entries, since)
+        if not stats:
+            print("Aucune requête trouvée.")
+            return
+        print(f"{'Endpoint (ms)':<36} {'count':>7} {'p50':>8} {'p95':>8} "
+              f"{'p99':>8} | {'context':>8} {'view':>8} {'render':>8} "
+              f"{'sql':>8} {'queries':>7} {'http':>8}")
+        for stat in stats[:limit]:
+            print(f"{stat.endpoint[:36]:<36} {stat.count:7d} "
+                  f"{stat.p50:8.1f} {stat.p95:8.1f} {stat.p99:8.1f} | "
+                  f"{stat.context:8.1f} {stat.view:8.1f} {stat.render:8.1f} "
+                  f"{stat.sql:8.1f} {stat.sql_count:7.1f} {stat.http:8.1f}")
+        if len(stats) > limit:
+            print(f"# {len(stats) - limit} more endpoints")
+
+    @app.cli.group()
+    def bans() -> None:
+        """Bans enforcement commands."""
+        pass
+
+    @bans.command("sync")
+    @click.option("--dry-run", is_flag=True,
+                  help="Only print the nft script, apply nothing.")
+    @click.option("-o", "--output", default=None,
+                  help="Write the nft script to this file instead of "
+                       "applying it.")
+    @click.option("--full", is_flag=True,
+                  help="Rewrite the whole set, even if its state is known.")
+    def bans_sync(dry_run: bool, output: str | None, full: bool) -> None:
+        """Synchronize the nftables banned MAC addresses set."""
+        result = nftables.sync(dry_run=dry_run, output=output, full=full)
+        print(result.script or "# Nothing to do\n", end="")
+        print(f"# {len(result.added)} added, {len(result.removed)} removed"
+              f"{' (full rewrite)' if result.full else ''}")
+
+    @app.cli.group("dhcp")
+    def dhcp_group() -> None:
+        """DHCP hosts file commands."""
+        pass
+
+    @dhcp_group.command("refresh")
+    @click.option("--full", is_flag=True,
+                  help="Re-render the rules of all rezidents.")
+    def dhcp_refresh(full: bool) -> None:
+        """Re-render DHCP rules whose rental or ban ended."""
+        changed = dhcp.rebuild() if full else dhcp.refresh_obsolete()
+        print("Hosts file updated" if changed else "Hosts file unchanged")
+
+    @app.cli.group("leases")
+    def leases_group() -> None:
+        """DHCP leases ingestion commands."""
+        pass
+
+    @leases_group.command("ingest")
+    def leases_ingest() -> None:
+        """Read new DHCP leases once and update devices."""
+        result = leases.get_ingester().ingest()
+        print(f"{result.leases} leases read ({result.read} bytes"
+              f"{', from start' if result.restarted else ''}): "
+              f"{result.devices} devices updated, {result.online} online")
+
+    @leases_group.command("watch")
+    @click.option("-i", "--interval", default=None, type=float,
+                  help="Delay between two reads, in seconds "
+                       "[default: LEASES_POLL_INTERVAL].")
+    def leases_watch(interval: float | None) -> None:
+        """Read new DHCP leases continuously and update devices."""
+        if interval is None:
+            interval = app.config["LEASES_POLL_INTERVAL"]
+        ingester = leases.get_ingester()
+        app.logger.info(f"Watching DHCP leases in {ingester.file}...")
+        while True:
+            try:
+                result = ingester.ingest()
+            except Exception as exc:
+                app.logger.error("DHCP leases ingestion failed",
+                                 exc_info=exc)
+            else:
+                if result.devices:
+                    app.logger.info(f"Leases: {result.devices} devices "
+                                    f"updated, {result.online} online")
+            finally:
+                db.session.remove()
+            time.sleep(interval)
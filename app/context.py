@@ -1,9 +1,8 @@
 """"IntraRez - Custom request context"""
 
 from ipaddress import IPv4Address
+import enum
 import functools
-import re
-import subprocess
 
 import flask
 from flask import g
@@ -11,7 +10,61 @@ from flask_babel import _
 import flask_login
 
 from app.models import Device, Rezident
-from app.tools import utils, typing
+from app.tools import neighbours, utils, typing
+
+
+class ContextLevel(enum.Enum):
+    """How much of the request context an endpoint needs.
+
+    See :func:`.set_context_level`, :func:`.no_context` and
+    :func:`.light_context`.
+    """
+    full = enum.auto()      # All checks (default)
+    light = enum.auto()     # User, doas and maintenance only
+    none = enum.auto()      # Default values only
+
+
+_context_levels: dict[str, ContextLevel] = {}
+_blueprint_context_levels: dict[str, ContextLevel] = {}
+
+
+def set_context_level(level: ContextLevel, *,
+                      endpoint: str | None = None,
+                      blueprint: str | None = None) -> None:
+    """Declare the context level needed by an endpoint or a blueprint.
+
+    Useful for endpoints whose view function cannot be decorated by
+    :func:`.no_context` / :func:`.light_context` (e.g. ``static``).
+
+    Args:
+        level: The context level to use.
+        endpoint: The endpoint (e.g. ``"static"``) to set the level of.
+        blueprint: The blueprint name (e.g. ``"gris"``) to set the level
+            of all endpoints of (unless overridden by endpoint / route).
+    """
+    if endpoint:
+        _context_levels[endpoint] = level
+    if blueprint:
+        _blueprint_context_levels[blueprint] = level
+
+
+def get_context_level() -> ContextLevel:
+    """Get the context level needed by the current request endpoint.
+
+    Looks (in this order) for a level set on the endpoint, on the view
+    function, and on the blueprint; defaults to :attr:`ContextLevel.full`.
+    """
+    endpoint = flask.request.endpoint
+    if not endpoint:
+        return ContextLevel.full
+    if endpoint in _context_levels:
+        return _context_levels[endpoint]
+    view = flask.current_app.view_functions.get(endpoint)
+    level = getattr(view, "context_level", None)
+    if level:
+        return level
+    return _blueprint_context_levels.get(flask.request.blueprint or "",
+                                         ContextLevel.full)
 
 
 def create_request_context() -> typing.RouteReturn | None:
@@ -19,6 +72,10 @@ def create_request_context() -> typing.RouteReturn | None:
 
     Intended to be registered by :func:`before_request`.
 
+    Endpoints with a :attr:`ContextLevel.none` context level only get the
+    default values below; endpoints with a :attr:`ContextLevel.light`
+    context level skip network checks (IP, MAC, device, room...).
+
     Defines:
       * :attr:`flask.g.remote_ip` (default ``None``):
             The caller's IP. Should never be ``None``, except if there is
@@ -83,6 +140,11 @@ def create_request_context() -> typing.RouteReturn | None:
     g.redemption_endpoint = None
     g.redemption_params = {}
 
+    level = get_context_level()
+    if level == ContextLevel.none:
+        # Context-free endpoint (static files...): nothing more to do
+        return None
+
     # Get user
     current_user = typing.cast(
         flask_login.AnonymousUserMixin | Rezident,
@@ -121,6 +183,10 @@ def create_request_context() -> typing.RouteReturn | None:
         else:
             flask.abort(503)    # 503 Service Unavailable
 
+    if level == ContextLevel.light:
+        # Lightweight-context endpoint: skip network checks
+        return None
+
     # Get IP
     g.remote_ip = flask.current_app.config["FORCE_IP"] or _get_remote_ip()
     if not g.remote_ip:
@@ -207,24 +273,20 @@ def _get_remote_ip() -> str | None:
     return flask.request.headers.get("X-Real-Ip")
 
 
-def _get_mac(remote_ip) -> str | None:
-    """Fetch the remote rezident MAC address from the ARP table.
+def _get_mac(remote_ip: str) -> str | None:
+    """Fetch the remote rezident MAC address from the neighbour table.
+
+    Relies on the process-wide :func:`.neighbours.resolver` (ARP table
+    cache or live netlink table), so the kernel table is not read again
+    for each request.
 
     Args:
         remote_ip: The IP of the remote rezident.
 
     Returns:
-        The corresponding MAC address, or ``None`` if not in the list.
+        The corresponding MAC address, or ``None`` if not in the table.
     """
-    output = subprocess.run(["/sbin/arp", "-a"], capture_output=True)
-    # arp -a liste toutes les correspondances IP - mac connues
-    # résultat : lignes "domain (ip) at mac_address ..."
-    match = re.search(rf"^.*? \({remote_ip}\) at ([0-9a-f:]{{17}}).*",
-                      output.stdout.decode(), re.M)
-    if match:
-        return match.group(1)
-    else:
-        return None
+    return neighbours.resolver().get(remote_ip)
 
 
 # Type variables for decoraters below
@@ -328,6 +390,38 @@ def gris_only(route: _Route) -> _Route:
     return new_route
 
 
+def no_context(route: _Route) -> _Route:
+    """Route function decorator to skip request context creation.
+
+    Only the default values of :func:`.create_request_context` are set:
+    no database query or neighbour table lookup is made.
+
+    Args:
+        route: The route function to mark.
+
+    Returns:
+        The same route, marked with a :attr:`ContextLevel.none` level.
+    """
+    route.context_level = ContextLevel.none     # type: ignore
+    return route
+
+
+def light_context(route: _Route) -> _Route:
+    """Route function decorator to create a lightweight request context.
+
+    Only the user / doas / maintenance part of the context is created: no
+    neighbour table lookup, device check or subscription creation is made.
+
+    Args:
+        route: The route function to mark.
+
+    Returns:
+        The same route, marked with a :attr:`ContextLevel.light` level.
+    """
+    route.context_level = ContextLevel.light    # type: ignore
+    return route
+
+
 def _address_in_range(address: str, start: str, stop: str) -> bool:
     return (IPv4Address(start) <= IPv4Address(address) <= IPv4Address(stop))
 
@@ -10,7 +10,7 @@ from flask_babel import _
 from app import db, context
 from app.devices import bp, forms
 from app.models import Device
-from app.tools import utils, typing
+from app.tools import dhcp, utils, typing
 
 
 @bp.route("/register", methods=["GET", "POST"])
@@ -36,7 +36,7 @@ def register() -> typing.RouteReturn:
             utils.log_action(
                 f"Registered {device} ({mac_address}, type '{device.type}')"
             )
-            utils.run_script("gen_dhcp.py")       # Update DHCP rules
+            dhcp.queue.submit(g.rezident)         # Update DHCP rules
             flask.flash(_("Appareil enregistré avec succès !"), "success")
             # OK
             if flask.request.args.get("hello"):
@@ -113,7 +113,7 @@ def transfer() -> typing.RouteReturn:
             utils.log_action(
                 f"Transferred {device}, formerly owned by {old_rezident}"
             )
-            utils.run_script("gen_dhcp.py")       # Update DHCP rules
+            dhcp.queue.submit(g.rezident, old_rezident)     # Update DHCP
             flask.flash(_("Appareil transféré avec succès !"), "success")
             # OK
             if flask.request.args.get("hello"):
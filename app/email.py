@@ -1,14 +1,31 @@
 """Intranet de la Rez Flask App - Emails System"""
 
+import atexit
+import contextlib
+import datetime
+import hashlib
+import html
 import logging
+import os
+import queue
+import re
+import smtplib
 import threading
+import time
+import urllib.parse
 
+import cachetools
 import html2text
 import flask
+import flask_babel
 import flask_mail
 import premailer
+import sqlalchemy as sa
 
-from app import IntraRezApp, mail, typing
+from app import IntraRezApp, db, mail, typing
+from app.enums import MailStatus
+from app.models import OutboxMail, Rezident
+from app.tools import loggers
 
 
 # Set up specific logging for mails
@@ -17,6 +34,7 @@ _mail_handler = logging.FileHandler("logs/mails.log")
 _mail_formatter = logging.Formatter("{asctime} -- {message}", "%x %X", "{")
 _mail_handler.setFormatter(_mail_formatter)
 mail_logger.addHandler(_mail_handler)
+loggers.queue_handlers(mail_logger)         # Written in the background
 
 # Class files used when transforming HTML body (styles inlining)
 class_files = [
@@ -29,50 +47,553 @@ class_files = [
 _premailer = typing.cast(premailer.Premailer, None)
 _textifier = typing.cast(html2text.HTML2Text, None)
 
+# Inlined bodies skeletons (see process_html), built by init_premailer()
+_inlined: cachetools.LRUCache = cachetools.LRUCache(0)
+_inlined_lock = threading.Lock()
+_css_mtimes: tuple[float, ...] = ()
+_base_url = ""
 
-def _send_email(app: IntraRezApp,
-                template: str,
-                msg: flask_mail.Message) -> None:
-    # To be called in a separate tread
-    with app.app_context():
-        try:
-            mail.send(msg)
-        except Exception as exc:
+_TAG_RE = re.compile(
+    r"<(style|script)\b.*?</\1\s*>"      # Raw text elements: kept whole
+    r"|<!--.*?-->|<[!/]?[a-zA-Z][^>]*>",
+    re.DOTALL | re.IGNORECASE,
+)
+_CONTENT_ATTRIBUTE_RE = re.compile(
+    r"""(\s(href|src|alt|title|value)\s*=\s*)("[^"]*"|'[^']*'|[^\s"'>]+)""",
+    re.IGNORECASE,
+)
+_PLACEHOLDER_RE = re.compile(r"@@(\d+)@@")
+
+
+_STOP = object()     # Queued to stop a worker
+
+
+class _Job(typing.NamedTuple):
+    # A mail queued in the dispatcher
+    template: str
+    msg: flask_mail.Message
+    mail_id: int | None         # OutboxMail ID, if stored in the outbox
+    attempts: int               # Delivery attempts already made
+
+
+def _is_permanent(exc: Exception) -> bool:
+    # Whether a delivery error will not be solved by retrying
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return True
+    return (isinstance(exc, smtplib.SMTPResponseException)
+            and 500 <= exc.smtp_code < 600)
+
+
+class MailDispatcher:
+    """Pool of worker threads sending mails over reused SMTP connections.
+
+    Mails are put in a bounded queue (:meth:`submit` blocks when it is
+    full, slowing down the producer instead of piling up threads); each
+    worker opens a connection (:meth:`flask_mail.Mail.connect`) when
+    mails are waiting, sends up to ``batch_size`` mails through it, and
+    closes it once the queue stays empty for ``idle_timeout`` seconds.
+
+    Mails stored in the outbox (see :func:`send_email`) have their
+    delivery recorded: sent, retried later with exponential backoff
+    (``retry_delay * 2 ** (attempts - 1)`` seconds, at most
+    ``retry_max_delay``), or failed after ``max_attempts`` attempts or a
+    permanent error (``5xx`` reply, recipients refused). When idle,
+    workers claim outbox mails due every ``poll_interval`` seconds.
+
+    Workers are started on first submit (so after workers fork).
+
+    Args:
+        workers: The number of worker threads (simultaneous connections).
+        queue_size: The maximal number of mails waiting to be sent.
+        batch_size: The maximal number of mails sent through a connection.
+        idle_timeout: The delay after which an idle connection is closed,
+            in seconds.
+
+    Attrs:
+        submitted (int): Number of mails submitted.
+        sent (int): Number of mails sent.
+        failed (int): Number of mails that could not be sent.
+        connections (int): Number of SMTP connections opened.
+        max_attempts (int): Number of delivery attempts of outbox mails.
+        retry_delay (float): Delay before the first retry, in seconds.
+        retry_max_delay (float): Maximal delay between two attempts.
+        send_timeout (float): Delay after which an outbox mail claimed
+            but not delivered (process killed...) is claimable again.
+        poll_interval (float): Delay between two outbox polls, in
+            seconds (``0``: no polling).
+        retention (int): Number of days sent outbox mails are kept.
+    """
+    def __init__(self, workers: int = 2, queue_size: int = 200,
+                 batch_size: int = 50, idle_timeout: float = 1.0) -> None:
+        """Initializes self."""
+        self.workers = workers
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.connections = 0
+        self.max_attempts = 8
+        self.retry_delay = 60.0
+        self.retry_max_delay = 21600.0
+        self.send_timeout = 600.0
+        self.poll_interval = 0.0
+        self.retention = 30
+        self.app: IntraRezApp | None = None
+        self._queue: queue.Queue = queue.Queue(queue_size)
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def __repr__(self) -> str:
+        """Returns repr(self)."""
+        return (f"<MailDispatcher ({self._queue.qsize()} queued, "
+                f"{self.sent} sent, {self.failed} failed)>")
+
+    def _start(self) -> None:
+        # Start workers not running (first submit / after fork)
+        with self._lock:
+            self._threads = [thread for thread in self._threads
+                             if thread.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._work,
+                                          name=f"mail-worker-{i}",
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, template: str, msg: flask_mail.Message,
+               timeout: float | None = None, *,
+               mail_id: int | None = None, attempts: int = 0) -> None:
+        """Queue a mail to be sent.
+
+        Args:
+            template: The mail template name (for logging).
+            msg: The mail to send.
+            timeout: The maximal time to wait for a place in the queue,
+                in seconds (default: wait as long as needed).
+            mail_id: The ID of the :class:`.models.OutboxMail` of this
+                mail, if stored in the outbox (delivery recorded).
+            attempts: The delivery attempts of this mail already made.
+
+        Raises:
+            queue.Full: If the queue is still full after ``timeout``.
+        """
+        if len(self._threads) < self.workers:
+            self._start()
+        self._queue.put(_Job(template, msg, mail_id, attempts),
+                        timeout=timeout)
+        self.submitted += 1
+
+    def _done(self, job: _Job, exc: Exception | None = None) -> None:
+        # Count (and record in outbox) a delivery attempt
+        if exc is None:
+            self.sent += 1
+        else:
+            self.failed += 1
             mail_logger.error(f"ERROR: {type(exc).__name__}: {exc}")
-            app.logger.error(
-                f"ATTENTION : Échec lors de l'envoi du mail '{template}' "
-                f"à {msg.recipients} :\n{type(exc).__name__}: {exc}"
+            self.app.logger.error(
+                f"ATTENTION : Échec lors de l'envoi du mail '{job.template}' "
+                f"à {job.msg.recipients} :\n{type(exc).__name__}: {exc}"
+            )
+        if job.mail_id is None:
+            return
+        try:
+            _record_attempt(job.mail_id, job.attempts + 1, exc)
+        except Exception as record_exc:
+            self.app.logger.error(
+                f"Could not record delivery of <OutboxMail #{job.mail_id}>",
+                exc_info=record_exc
             )
 
+    def _work(self) -> None:
+        # Worker thread main loop: one connection per batch of mails
+        item = None
+        while True:
+            if item is None:
+                try:
+                    item = self._queue.get(timeout=self.poll_interval or None)
+                except queue.Empty:
+                    self._poll()
+                    continue
+            if item is _STOP:
+                self._queue.task_done()
+                return
+            with self.app.app_context():
+                item = self._send_batch(item)
 
-def send_email(template: str,
-               *,
-               subject: str,
-               recipients: dict[str | None, str],
-               html_body: str,
-               text_body: str | None = None
-    ) -> None:
-    """Send an email using Flask-Mail, asynchronously.
+    def _send_batch(self, job: _Job) -> typing.Any:
+        # Send a mail and those following it through a single connection;
+        # returns the item got from the queue but not processed, if any
+        try:
+            connection = mail.connect()
+            connection.__enter__()
+        except Exception as exc:
+            self._done(job, exc)
+            self._queue.task_done()
+            return None
+        self.connections += 1
+        try:
+            for _ in range(self.batch_size):
+                try:
+                    connection.send(job.msg)
+                except smtplib.SMTPServerDisconnected as exc:
+                    self._done(job, exc)
+                    connection.host = None      # Next mails: new connection
+                    return None
+                except smtplib.SMTPException as exc:
+                    self._done(job, exc)        # E.g. recipient refused
+                except OSError as exc:
+                    self._done(job, exc)
+                    connection.host = None      # Next mails: new connection
+                    return None
+                except Exception as exc:
+                    self._done(job, exc)
+                else:
+                    self._done(job)
+                finally:
+                    self._queue.task_done()
+                try:
+                    job = self._queue.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    return None
+                if job is _STOP:
+                    return job
+            return job      # Batch done: next mail through a new connection
+        finally:
+            with contextlib.suppress(Exception):
+                connection.__exit__(None, None, None)
+
+    def _poll(self) -> None:
+        # Idle worker: queue outbox mails due (one worker at a time)
+        if not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            with self.app.app_context():
+                try:
+                    free = self._queue.maxsize - self._queue.qsize()
+                    for job in claim_due(min(free, self.batch_size)):
+                        # If the queue got full meanwhile, the mail will be
+                        # claimed again once its send timeout expires
+                        self.submit(job.template, job.msg, 0,
+                                    mail_id=job.mail_id,
+                                    attempts=job.attempts)
+                    if time.time() - self._last_purge > 3600:
+                        self._last_purge = time.time()
+                        purge_sent(self.retention)
+                except queue.Full:
+                    pass
+                except Exception as exc:
+                    self.app.logger.error("Mails outbox poll failed",
+                                          exc_info=exc)
+                finally:
+                    db.session.remove()
+        finally:
+            self._poll_lock.release()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until all queued mails are processed.
+
+        Args:
+            timeout: The maximal time to wait, in seconds (default: no
+                limit).
+
+        Returns:
+            Whether the queue was emptied in time.
+        """
+        if not any(thread.is_alive() for thread in self._threads):
+            if self._queue.unfinished_tasks:
+                self._start()
+            else:
+                return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stop(self, timeout: float | None = None) -> bool:
+        """Send all queued mails, then stop workers.
+
+        Args:
+            timeout: The maximal time to wait, in seconds.
+
+        Returns:
+            Whether all mails were processed in time.
+        """
+        flushed = self.flush(timeout)
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        return flushed
+
+
+dispatcher = MailDispatcher()
+
+
+class TemplateStats(typing.NamedTuple):
+    """Delivery metrics of a mail template (see :func:`outbox_stats`).
+
+    Attrs:
+        template: The mail template name.
+        waiting: The number of mails waiting to be sent (pending or
+            being sent).
+        failed: The number of mails that could not be delivered.
+        sent: The number of mails sent during the period.
+        per_hour: The mean number of mails sent per hour.
+        mean_delay: The mean delay between mail creation and delivery,
+            in seconds (``None`` if no mail sent).
+        mean_attempts: The mean number of attempts of mails sent.
+    """
+    template: str
+    waiting: int
+    failed: int
+    sent: int
+    per_hour: float
+    mean_delay: float | None
+    mean_attempts: float | None
+
+
+def _outbox() -> sa.Table:
+    # The outbox table (Core statements: no objects loaded in session)
+    return OutboxMail.__table__
+
+
+def _message(row: typing.Any) -> flask_mail.Message:
+    # Rebuild a mail from its outbox row
+    return flask_mail.Message(
+        subject=row.subject,
+        sender=row.sender,
+        recipients=row.recipients,
+        body=row.body,
+        html=row.html,
+        extra_headers=row.extra_headers or None,
+    )
+
+
+def enqueue(template: str, msg: flask_mail.Message,
+            dedup_key: str | None = None) -> int | None:
+    """Store a mail in the outbox, claimed to be sent now.
+
+    The mail is inserted in its own transaction (independently of the
+    current session).
 
     Args:
         template: The mail template name.
-        subject: The mail subject.
-        sender: The sender address.
-        recipients: The recipients addresses -> names dict.
-        html_body: The mail content to print in HTML mode.
-        text_body: The mail content to print in plain text mode.
-            If not set, it will be constructed from ``html_body`` using
-            :func:`.html_to_plaintext`.
+        msg: The mail to store.
+        dedup_key: If set, the mail is not stored if a mail with the same
+            key already is.
+
+    Returns:
+        The ID of the :class:`.models.OutboxMail` created, or ``None`` if
+        the mail is a duplicate.
+    """
+    table = _outbox()
+    now = datetime.datetime.utcnow()
+    values = {
+        "template": template,
+        "dedup_key": dedup_key,
+        "subject": msg.subject,
+        "sender": msg.sender,
+        "recipients": list(msg.recipients),
+        "body": msg.body or "",
+        "html": msg.html or "",
+        "extra_headers": msg.extra_headers or {},
+        "status": MailStatus.sending,
+        "attempts": 0,
+        "created": now,
+        "next_attempt": now + datetime.timedelta(
+            seconds=dispatcher.send_timeout
+        ),
+    }
+    try:
+        with db.engine.begin() as connection:
+            if dedup_key and connection.execute(
+                sa.select(table.c.id).where(table.c.dedup_key == dedup_key)
+            ).first():
+                return None
+            result = connection.execute(sa.insert(table).values(values))
+    except sa.exc.IntegrityError:
+        return None         # Same key inserted concurrently
+    return result.inserted_primary_key[0]
+
+
+def claim_due(limit: int) -> list[_Job]:
+    """Claim outbox mails due, to send them.
+
+    Mails pending whose next attempt is due, and mails being sent whose
+    send timeout expired (process stopped while sending) are claimed for
+    ``send_timeout`` seconds. Claims are atomic: a mail is claimed by a
+    single process.
+
+    Args:
+        limit: The maximal number of mails to claim.
+
+    Returns:
+        The jobs of the mails claimed.
+    """
+    if limit <= 0:
+        return []
+    table = _outbox()
+    now = datetime.datetime.utcnow()
+    lease = now + datetime.timedelta(seconds=dispatcher.send_timeout)
+    rows = db.session.execute(
+        sa.select(table)
+        .where(table.c.status.in_([MailStatus.pending, MailStatus.sending]))
+        .where(table.c.next_attempt <= now)
+        .order_by(table.c.next_attempt)
+        .limit(limit)
+    ).all()
+    jobs = []
+    for row in rows:
+        result = db.session.execute(
+            sa.update(table)
+            .where(table.c.id == row.id)
+            .where(table.c.status == row.status)
+            .where(table.c.next_attempt == row.next_attempt)
+            .values(status=MailStatus.sending, next_attempt=lease)
+        )
+        if result.rowcount == 1:
+            jobs.append(_Job(row.template, _message(row), row.id,
+                             row.attempts))
+    db.session.commit()
+    return jobs
+
+
+def _record_attempt(mail_id: int, attempts: int,
+                    exc: Exception | None) -> None:
+    # Record the result of a delivery attempt of an outbox mail
+    table = _outbox()
+    now = datetime.datetime.utcnow()
+    if exc is None:
+        values = {"status": MailStatus.sent, "sent": now,
+                  "attempts": attempts, "last_error": None}
+    else:
+        error = f"{type(exc).__name__}: {exc}"[:500]
+        if _is_permanent(exc) or attempts >= dispatcher.max_attempts:
+            values = {"status": MailStatus.failed, "attempts": attempts,
+                      "last_error": error}
+        else:
+            delay = min(dispatcher.retry_delay * 2 ** (attempts - 1),
+                        dispatcher.retry_max_delay)
+            values = {"status": MailStatus.pending, "attempts": attempts,
+                      "last_error": error,
+                      "next_attempt": now + datetime.timedelta(seconds=delay)}
+    with db.engine.begin() as connection:
+        connection.execute(sa.update(table).where(table.c.id == mail_id)
+                           .values(values))
+
+
+def _release(mail_id: int) -> None:
+    # Give back a claimed outbox mail, due now (not attempted)
+    table = _outbox()
+    with db.engine.begin() as connection:
+        connection.execute(sa.update(table).where(table.c.id == mail_id)
+                           .values(status=MailStatus.pending,
+                                   next_attempt=datetime.datetime.utcnow()))
+
+
+def retry(mail_id: int) -> bool:
+    """Schedule a new delivery of a failed outbox mail, now.
+
+    Its attempts counter is reset.
+
+    Args:
+        mail_id: The ID of the :class:`.models.OutboxMail`.
+
+    Returns:
+        Whether the mail was rescheduled (i.e. had failed).
     """
-    # Prepare body
+    table = _outbox()
+    result = db.session.execute(
+        sa.update(table)
+        .where(table.c.id == mail_id)
+        .where(table.c.status == MailStatus.failed)
+        .values(status=MailStatus.pending, attempts=0,
+                next_attempt=datetime.datetime.utcnow())
+    )
+    return result.rowcount == 1
+
+
+def purge_sent(days: int) -> int:
+    """Delete outbox mails sent more than ``days`` days ago.
+
+    Returns:
+        The number of mails deleted.
+    """
+    table = _outbox()
+    limit = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    result = db.session.execute(
+        sa.delete(table)
+        .where(table.c.status == MailStatus.sent)
+        .where(table.c.sent < limit)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def outbox_stats(hours: int = 24) -> list[TemplateStats]:
+    """Per-template delivery metrics of the outbox.
+
+    Args:
+        hours: The period to compute sending metrics on, in hours.
+
+    Returns:
+        The metrics of each template, sorted by template name.
+    """
+    table = _outbox()
+    since = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    counts: dict[str, dict[MailStatus, int]] = {}
+    for template, status, number in db.session.execute(
+        sa.select(table.c.template, table.c.status, sa.func.count())
+        .where(table.c.status != MailStatus.sent)
+        .group_by(table.c.template, table.c.status)
+    ):
+        counts.setdefault(template, {})[status] = number
+    delivered: dict[str, list[tuple[float, int]]] = {}
+    for template, created, sent, attempts in db.session.execute(
+        sa.select(table.c.template, table.c.created, table.c.sent,
+                  table.c.attempts)
+        .where(table.c.status == MailStatus.sent)
+        .where(table.c.sent >= since)
+    ):
+        delivered.setdefault(template, []).append(
+            ((sent - created).total_seconds(), attempts)
+        )
+    stats = []
+    for template in sorted(counts.keys() | delivered.keys()):
+        by_status = counts.get(template, {})
+        sent = delivered.get(template, [])
+        stats.append(TemplateStats(
+            template=template,
+            waiting=(by_status.get(MailStatus.pending, 0)
+                     + by_status.get(MailStatus.sending, 0)),
+            failed=by_status.get(MailStatus.failed, 0),
+            sent=len(sent),
+            per_hour=len(sent) / hours,
+            mean_delay=(sum(delay for delay, _ in sent) / len(sent)
+                        if sent else None),
+            mean_attempts=(sum(attempts for _, attempts in sent) / len(sent)
+                           if sent else None),
+        ))
+    return stats
+
+
+def _build_message(subject: str, recipients: dict[str | None, str],
+                   html_body: str, text_body: str | None = None
+                   ) -> flask_mail.Message:
+    # Prepare body (styles inlining...) and construct mail
     html_body = process_html(html_body)
     if text_body is None:
         text_body = html_to_plaintext(html_body)
 
-    # Construct mail
     recipients_f = {addr: name for addr, name in recipients.items() if addr}
     sender_mail = flask.current_app.config["ADMINS"][0]
-    msg = flask_mail.Message(
+    return flask_mail.Message(
         subject=subject,
         sender=f"IntraRez <{sender_mail}>",
         recipients=[f"{name} <{addr}>" for addr, name in recipients_f.items()],
@@ -84,19 +605,269 @@ def send_email(template: str,
         }
     )
 
-    # Send mail
+
+def _deliver(template: str, msg: flask_mail.Message,
+             dedup_key: str | None, block: bool) -> int | None:
+    # Store mail in outbox, then send it (through the dispatcher workers);
+    # if not block and the dispatcher is full, let the next outbox poll (of
+    # any process) send it
+    mail_id = enqueue(template, msg, dedup_key)
+    if mail_id is None:
+        mail_logger.info(f"Not sending '{template}' to {msg.recipients} "
+                         f"(duplicate of '{dedup_key}')")
+        return None
     mail_logger.info(f"Sending '{template}' to {msg.recipients}")
-    app = typing.cast(IntraRezApp, flask.current_app._get_current_object())
-    threading.Thread(
-        target=_send_email,
-        args=(app, template, msg)
-    ).start()
+    try:
+        dispatcher.submit(template, msg, None if block else 0,
+                          mail_id=mail_id)
+    except queue.Full:
+        _release(mail_id)
+    return mail_id
+
+
+def send_email(template: str,
+               *,
+               subject: str,
+               recipients: dict[str | None, str],
+               html_body: str,
+               text_body: str | None = None,
+               dedup_key: str | None = None,
+    ) -> None:
+    """Send an email using Flask-Mail, asynchronously.
+
+    The mail is stored in the outbox (:class:`.models.OutboxMail`), then
+    queued in :data:`.dispatcher` if it is not full (else, it will be
+    sent at next outbox poll): the request never waits for the SMTP
+    server, and failed deliveries are retried.
+
+    To send a mail to many rezidents, see :func:`send_bulk`.
+
+    Args:
+        template: The mail template name.
+        subject: The mail subject.
+        sender: The sender address.
+        recipients: The recipients addresses -> names dict.
+        html_body: The mail content to print in HTML mode.
+        text_body: The mail content to print in plain text mode.
+            If not set, it will be constructed from ``html_body`` using
+            :func:`.html_to_plaintext`.
+        dedup_key: If set, the mail is not sent if a mail with the same
+            key already was (e.g. ``<template>/<rezident ID>/<date>``).
+    """
+    msg = _build_message(subject, recipients, html_body, text_body)
+    _deliver(template, msg, dedup_key, block=False)
+
+
+class BulkResult(typing.NamedTuple):
+    """Summary of a bulk mailing (see :func:`send_bulk`).
+
+    Attrs:
+        total: The number of rezidents processed.
+        queued: The number of mails stored in the outbox and queued.
+        duplicates: The number of mails not sent, already sent before
+            (same deduplication key).
+        skipped: The number of rezidents without mail address.
+        errors: The number of mails that could not be rendered.
+        sent: The number of mails queued and sent, when returning.
+        failed: The number of mails queued that could not be sent, when
+            returning (pending mails will be retried).
+        duration: The mailing duration, in seconds.
+    """
+    total: int
+    queued: int
+    duplicates: int
+    skipped: int
+    errors: int
+    sent: int
+    failed: int
+    duration: float
+
+
+def render_bulk(template: str, rezidents: typing.Iterable[Rezident],
+                subject: typing.JinjaStr, *,
+                context: typing.Callable[[Rezident], dict] | None = None,
+                default_locale: str | None = "en"
+                ) -> typing.Iterator[tuple[Rezident,
+                                           flask_mail.Message | None]]:
+    """Render a mail template for each rezident, lazily.
+
+    Each mail is rendered in its rezident language, with template
+    ``<blueprint>/mails/<name>.html`` (for ``template`` =
+    ``<blueprint>/<name>``) and variables ``rezident`` and those returned
+    by ``context(rezident)``. Styles inlining of bodies sharing the same
+    structure is only done once (see :func:`process_html`).
+
+    Args:
+        template: The mail template name.
+        rezidents: The rezidents to render the mail for.
+        subject: The mail subject, without the ``[IntraRez]`` prefix
+            (translated in each rezident language if lazy).
+        context: Function returning additional template variables for a
+            rezident.
+        default_locale: The language of rezidents without one (``None``:
+            current language).
+
+    Yields:
+        Each rezident, and its mail (``None`` if the rezident has no
+        address or the mail could not be rendered, logged).
+    """
+    blueprint, name = template.split("/", 1)
+    path = f"{blueprint}/mails/{name}.html"
+    for rezident in rezidents:
+        if not rezident.email:
+            yield rezident, None
+            continue
+        locale = rezident.locale or default_locale
+        try:
+            with (flask_babel.force_locale(locale) if locale
+                  else contextlib.nullcontext()):
+                html_body = flask.render_template(
+                    path, rezident=rezident,
+                    **(context(rezident) if context else {})
+                )
+                msg = _build_message(f"[IntraRez] {subject}",
+                                     {rezident.email: rezident.full_name},
+                                     html_body)
+        except Exception as exc:
+            flask.current_app.logger.error(
+                f"Rendering of mail '{template}' for {rezident} failed",
+                exc_info=exc
+            )
+            msg = None
+        yield rezident, msg
+
+
+def send_bulk(template: str, rezidents: typing.Iterable[Rezident],
+              subject: typing.JinjaStr, *,
+              context: typing.Callable[[Rezident], dict] | None = None,
+              dedup_key: typing.Callable[[Rezident], str | None]
+                         | None = None,
+              default_locale: str | None = "en",
+              rate: float | None = None,
+              block: bool = True,
+              wait: float | None = None,
+              progress: typing.Callable[[int, int | None], None]
+                        | None = None,
+    ) -> BulkResult:
+    """Send a mail to many rezidents.
+
+    Mails are rendered while being sent (see :func:`render_bulk`),
+    stored in the outbox and queued in :data:`.dispatcher`, whose
+    workers send them over a few persistent SMTP connections. Mails are
+    queued at most at ``rate`` mails per second; when the dispatcher
+    queue is full, this function waits (unless ``block`` is ``False``).
+
+    Args:
+        template: The mail template name (``<blueprint>/<name>``).
+        rezidents: The rezidents to send the mail to (may be a
+            generator).
+        subject: The mail subject, without the ``[IntraRez]`` prefix
+            (lazy string, translated in each rezident language).
+        context: Function returning additional template variables for a
+            rezident.
+        dedup_key: Function returning the deduplication key of the mail
+            of a rezident, if any (see :func:`send_email`).
+        default_locale: The language of rezidents without one (``None``:
+            current language).
+        rate: The maximal number of mails queued per second (default:
+            ``MAIL_BULK_RATE`` application config value, ``0``: no
+            limit).
+        block: Whether to wait for a place in the dispatcher queue when
+            it is full (else, mails are sent at next outbox poll).
+        wait: If set, wait at most this time (in seconds) for the mails
+            to be sent, to report their status.
+        progress: Function called after each rezident processed, with
+            the number of rezidents processed and their total number (if
+            ``rezidents`` has a length, else ``None``).
+
+    Returns:
+        The mailing summary.
+    """
+    if rate is None:
+        rate = flask.current_app.config["MAIL_BULK_RATE"]
+    total = len(rezidents) if isinstance(rezidents, typing.Sized) else None
+    start = time.monotonic()
+    mail_ids = []
+    done = duplicates = skipped = errors = 0
+    for rezident, msg in render_bulk(template, rezidents, subject,
+                                     context=context,
+                                     default_locale=default_locale):
+        done += 1
+        if msg is None:
+            if rezident.email:
+                errors += 1
+            else:
+                skipped += 1
+        else:
+            if rate:
+                # Pace mails queued (first mail immediately)
+                delay = start + len(mail_ids) / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            key = dedup_key(rezident) if dedup_key else None
+            mail_id = _deliver(template, msg, key, block)
+            if mail_id is None:
+                duplicates += 1
+            else:
+                mail_ids.append(mail_id)
+        if progress:
+            progress(done, total)
+
+    statuses: dict[MailStatus, int] = {}
+    if wait is not None and mail_ids:
+        dispatcher.flush(wait)
+        table = _outbox()
+        statuses = dict(db.session.execute(
+            sa.select(table.c.status, sa.func.count())
+            .where(table.c.id.in_(mail_ids)).group_by(table.c.status)
+        ).all())
+    return BulkResult(
+        total=done, queued=len(mail_ids), duplicates=duplicates,
+        skipped=skipped, errors=errors,
+        sent=statuses.get(MailStatus.sent, 0),
+        failed=statuses.get(MailStatus.failed, 0),
+        duration=time.monotonic() - start,
+    )
+
+
+def init_app(app: IntraRezApp) -> None:
+    """Configure :data:`.dispatcher` for an app.
+
+    Uses ``MAIL_WORKERS``, ``MAIL_QUEUE_SIZE``, ``MAIL_BATCH_SIZE``,
+    ``MAIL_FLUSH_TIMEOUT``, ``MAIL_MAX_ATTEMPTS``, ``MAIL_RETRY_DELAY``,
+    ``MAIL_RETRY_MAX_DELAY``, ``MAIL_SEND_TIMEOUT``,
+    ``MAIL_OUTBOX_POLL_INTERVAL`` and ``MAIL_OUTBOX_RETENTION``
+    application config values. Queued mails are sent at exit (waiting at
+    most ``MAIL_FLUSH_TIMEOUT`` seconds). Workers are started at the first
+    request served, to deliver outbox mails due.
+    """
+    dispatcher.app = app
+    dispatcher.workers = app.config["MAIL_WORKERS"]
+    dispatcher.batch_size = app.config["MAIL_BATCH_SIZE"]
+    dispatcher._queue.maxsize = app.config["MAIL_QUEUE_SIZE"]
+    dispatcher.max_attempts = app.config["MAIL_MAX_ATTEMPTS"]
+    dispatcher.retry_delay = app.config["MAIL_RETRY_DELAY"]
+    dispatcher.retry_max_delay = app.config["MAIL_RETRY_MAX_DELAY"]
+    dispatcher.send_timeout = app.config["MAIL_SEND_TIMEOUT"]
+    dispatcher.poll_interval = app.config["MAIL_OUTBOX_POLL_INTERVAL"]
+    dispatcher.retention = app.config["MAIL_OUTBOX_RETENTION"]
+    atexit.register(dispatcher.stop, app.config["MAIL_FLUSH_TIMEOUT"])
+
+    @app.before_first_request
+    def _start_dispatcher() -> None:
+        if dispatcher.poll_interval and flask.has_request_context():
+            dispatcher._start()
 
 
 def init_premailer() -> None:
     """Construct the :class:`premailer.Premailer` object used to prepare
-    mails HTML body."""
-    global _premailer
+    mails HTML body.
+
+    Also empties the inlined skeletons cache (see :func:`process_html`).
+    Uses the ``MAIL_INLINE_CACHE_SIZE`` application config value (``0``
+    disables the cache).
+    """
+    global _premailer, _base_url, _css_mtimes, _inlined
 
     class_files_contents = []
     for file in class_files:
@@ -106,15 +877,22 @@ def init_premailer() -> None:
     scheme = flask.current_app.config["PREFERRED_URL_SCHEME"]
     server = flask.current_app.config["SERVER_NAME"]
     root = flask.current_app.config["APPLICATION_ROOT"]
+    _base_url = f"{scheme}://{server}{root}"
 
     _premailer = premailer.Premailer(
-        base_url=f"{scheme}://{server}{root}",
+        base_url=_base_url,
+        disable_link_rewrites=True,     # Done on substitution
         remove_classes=True,
         css_text="\n".join(class_files_contents),
         disable_validation=True,
         disable_leftover_css=True,
         cssutils_logging_level=logging.CRITICAL,
     )
+    with _inlined_lock:
+        _css_mtimes = _class_files_mtimes()
+        _inlined = cachetools.LRUCache(
+            flask.current_app.config["MAIL_INLINE_CACHE_SIZE"]
+        )
 
 
 def init_textifier() -> None:
@@ -130,19 +908,87 @@ def init_textifier() -> None:
     _textifier.emphasis_mark = "*"
 
 
+def _class_files_mtimes() -> tuple[float, ...]:
+    return tuple(os.stat(file).st_mtime for file in class_files)
+
+
+def _skeleton(body: str) -> tuple[str, list[tuple[str | None, str]]]:
+    # Replace body texts and content attributes values by placeholders;
+    # returns the skeleton and the (attribute name / None, raw value) list
+    values = []
+
+    def placeholder(kind: str | None, raw: str) -> str:
+        values.append((kind, raw))
+        return f"@@{len(values) - 1}@@"
+
+    def attribute(match: re.Match) -> str:
+        name, value = match[2].lower(), match[3]
+        if value[0] in "'\"":
+            value = value[1:-1].replace('"', "&quot;")
+        return f'{match[1]}"{placeholder(name, value)}"'
+
+    parts = []
+    position = 0
+    for match in _TAG_RE.finditer(body):
+        text = body[position:match.start()]
+        # Keep blanks, that can change HTML structure (e.g. in <head>)
+        parts.append(placeholder(None, text) if text.strip() else text)
+        tag = match[0]
+        if not match[1] and tag[1] not in "!/":     # Opening tag
+            tag = _CONTENT_ATTRIBUTE_RE.sub(attribute, tag)
+        parts.append(tag)
+        position = match.end()
+    text = body[position:]
+    parts.append(placeholder(None, text) if text.strip() else text)
+    return "".join(parts), values
+
+
+def _fill(kind: str | None, raw: str) -> str:
+    # Value of a placeholder, with links made absolute (as premailer does)
+    if kind not in ("href", "src"):
+        return raw
+    url = html.unescape(raw)
+    if not (url.startswith("tel:") or (kind == "src"
+                                       and url.startswith("cid:"))):
+        url = urllib.parse.urljoin(_base_url, url)
+    # Same escaping as lxml (non-ASCII characters, spaces...)
+    url = urllib.parse.quote(url, safe="!#$%&'()*+,-./:;=?@[]_~")
+    return html.escape(url)
+
+
 def process_html(body):
     """Transform a screen-optimized HTML body to a mail-optimized one.
 
     Relies on :class:`premailer.Premailer` to include styles in HTML body
     and optimize content.
 
+    Inlining styles (matching the whole Bootstrap CSS against the body)
+    is costly, but only depends on the body structure: texts and
+    content attributes (``href``, ``src``, ``alt``, ``title``,
+    ``value``) of the body are replaced by placeholders, and the
+    resulting skeleton is only inlined once (then kept in a LRU cache,
+    emptied when :attr:`class_files` are modified); the mail is then
+    built by substituting the placeholders.
+
     Args:
         body (str): The HTML string to process.
 
     Returns:
         :class:`str`: The processed HTML mail body.
     """
-    return _premailer.transform(body)
+    if _premailer is None or _class_files_mtimes() != _css_mtimes:
+        init_premailer()
+    skeleton, values = _skeleton(body)
+    key = hashlib.blake2b(skeleton.encode(), digest_size=16).digest()
+    with _inlined_lock:
+        inlined = _inlined.get(key)
+    if inlined is None:
+        inlined = _premailer.transform(skeleton)
+        with _inlined_lock:
+            if _inlined.maxsize:        # 0: caching disabled
+                _inlined[key] = inlined
+    return _PLACEHOLDER_RE.sub(lambda match: _fill(*values[int(match[1])]),
+                               inlined)
 
 
 def html_to_plaintext(body):
@@ -157,4 +1003,6 @@ def html_to_plaintext(body):
     Returns:
         :class:`str`: The processed plain text mail body.
     """
+    if _textifier is None:
+        init_textifier()
     return _textifier.handle(body)
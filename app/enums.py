@@ -3,7 +3,7 @@
 import enum
 
 
-__all__ = ["SubState", "PaymentStatus"]
+__all__ = ["SubState", "PaymentStatus", "MailStatus"]
 
 
 class SubState(enum.Enum):
@@ -22,3 +22,11 @@ class PaymentStatus(enum.Enum):
     refused = enum.auto()
     cancelled = enum.auto()
     error = enum.auto()
+
+
+class MailStatus(enum.Enum):
+    """"The delivery status of an OutboxMail."""
+    pending = enum.auto()
+    sending = enum.auto()
+    sent = enum.auto()
+    failed = enum.auto()
@@ -10,7 +10,8 @@ from flask_babel import lazy_gettext as _l
 from flask_wtf import FlaskForm
 
 from app.tools.validators import (DataRequired, Optional, Length,
-                                  ValidRezidentID, ValidBanID)
+                                  ValidRezidentID, ValidBanID,
+                                  ValidOutboxMailID)
 
 
 def scripts_list() -> list[tuple[str, str]]:
@@ -78,3 +79,11 @@ class BanForm(FlaskForm):
                 days=int(self.days.data or 0),
                 months=int(self.months.data or 0),
             )
+
+
+class OutboxMailForm(FlaskForm):
+    """WTForm used to retry or delete a mail of the outbox."""
+    mail_id = wtforms.HiddenField("", validators=[DataRequired(),
+                                                  ValidOutboxMailID()])
+    retry = wtforms.SubmitField(_l("Renvoyer"))
+    delete = wtforms.SubmitField(_l("Supprimer"))
@@ -9,10 +9,11 @@ import sys
 import flask
 from flask_babel import _
 
-from app import context, db
+from app import context, db, email
+from app.enums import MailStatus
 from app.gris import bp, forms
-from app.models import Rezident, Ban
-from app.tools import utils, typing
+from app.models import Rezident, Ban, OutboxMail
+from app.tools import dhcp, utils, typing
 
 
 @bp.route("/rezidents", methods=["GET", "POST"])
@@ -23,6 +24,7 @@ def rezidents() -> typing.RouteReturn:
     if form.validate_on_submit():
         if form.ban_id.data:
             ban = Ban.query.get(int(form.ban_id.data))
+            rezident = ban.rezident
             if form.unban.data:
                 # Terminate existing ban
                 ban.end = datetime.datetime.utcnow()
@@ -49,13 +51,59 @@ def rezidents() -> typing.RouteReturn:
                 utils.log_action(f"Added {ban}: {ban.end} / {ban.reason}")
                 flask.flash(_("Le mécréant a bien été banni."), "success")
         db.session.commit()
-        utils.run_script("gen_dhcp.py")       # Update DHCP rules
+        dhcp_job = dhcp.queue.submit(rezident)    # Update DHCP rules
+    else:
+        dhcp_job = None
 
     return flask.render_template("gris/rezidents.html", form=form,
                                  rezidents=Rezident.query.all(),
+                                 dhcp_job=dhcp_job,
                                  title=_("Gestion des Rezidents"))
 
 
+@bp.route("/dhcp_job/<job_id>")
+@context.gris_only
+def dhcp_job(job_id: str) -> typing.RouteReturn:
+    """Status of a DHCP regeneration job (JSON, polled by GRI pages)."""
+    status = dhcp.job_status(job_id)
+    if status is None:
+        return {"id": job_id, "state": "unknown"}, 404
+    return dict(status)
+
+
+@bp.route("/mails", methods=["GET", "POST"])
+@context.gris_only
+def mails() -> typing.RouteReturn:
+    """Mails outbox page: delivery metrics, pending and failed mails."""
+    form = forms.OutboxMailForm()
+    if form.validate_on_submit():
+        outbox_mail = OutboxMail.query.get(int(form.mail_id.data))
+        if outbox_mail is None:
+            # Deleted since form validation (purge, other GRI...)
+            flask.flash(_("Ce mail n'existe plus !"), "danger")
+        elif form.delete.data:
+            db.session.delete(outbox_mail)
+            utils.log_action(f"Deleted {outbox_mail}")
+            flask.flash(_("Le mail a été supprimé."), "success")
+        elif email.retry(outbox_mail.id):
+            utils.log_action(f"Rescheduled {outbox_mail}")
+            flask.flash(_("Le mail sera renvoyé sous peu."), "success")
+        else:
+            flask.flash(_("Ce mail n'est pas en échec !"), "danger")
+        db.session.commit()
+        return flask.redirect(flask.url_for("gris.mails"))
+
+    outbox = (
+        OutboxMail.query
+        .filter(OutboxMail.status != MailStatus.sent)
+        .order_by(OutboxMail.status.desc(), OutboxMail.next_attempt)
+        .limit(200).all()
+    )
+    return flask.render_template("gris/mails.html", form=form,
+                                 stats=email.outbox_stats(), outbox=outbox,
+                                 title=_("Mails envoyés"))
+
+
 @bp.route("/run_script", methods=["GET", "POST"])
 @context.gris_only
 def run_script() -> typing.RouteReturn:
@@ -1,16 +1,18 @@
 """Intranet de la Rez - Main Pages Routes"""
 
+import contextlib
 import datetime
 import json
 
 import flask
 from flask_babel import _
 from discord_webhook import DiscordWebhook
+import sqlalchemy as sa
 
-from app import context
+from app import context, db, __version__
 from app.main import bp, forms
 from app.models import Ban
-from app.tools import captcha, utils, typing
+from app.tools import access_log, captcha, dhcp, neighbours, utils, typing
 
 
 @bp.route("/")
@@ -49,7 +51,8 @@ def contact() -> typing.RouteReturn:
                 content=f"<@&{role_id}> Nouveau message !",
             )
             webhook.add_embed(form.create_embed())
-            rep = webhook.execute()
+            with access_log.phase("http"):
+                rep = webhook.execute()
             if rep:
                 flask.flash(_("Message transmis !"), "success")
                 return utils.ensure_safe_redirect("main.index")
@@ -80,6 +83,25 @@ def changelog() -> typing.RouteReturn:
                                  datetime=datetime)
 
 
+@bp.route("/health")
+@context.no_context
+def health() -> typing.RouteReturn:
+    """Health check endpoint, for monitoring (no request context)."""
+    try:
+        db.session.execute(sa.text("SELECT 1"))
+    except sa.exc.SQLAlchemyError as exc:
+        return {"status": "error", "version": __version__,
+                "error": f"{type(exc).__name__}: {exc}"}, 503
+    return {"status": "ok", "version": __version__}
+
+
+@bp.route("/favicon.ico")
+@context.no_context
+def favicon() -> typing.RouteReturn:
+    """Default favicon, for clients not reading the page ``<link>``."""
+    return flask.current_app.send_static_file("favicon.png")
+
+
 @bp.route("/connect_check")
 @context.internal_only
 def connect_check() -> typing.RouteReturn:
@@ -125,6 +147,9 @@ def test() -> typing.RouteReturn:
     pt = {}
     pt["BRF"] = flask.current_app.before_request_funcs
     pt["ARF"] = flask.current_app.after_request_funcs
+    pt["ARP"] = neighbours.resolver().stats()
+    with contextlib.suppress(FileNotFoundError):
+        pt["DHCP watcher"] = dhcp.watcher_stats()
     for name in dir(flask.request):
         if name.startswith("_"):
             continue
@@ -11,14 +11,21 @@ import flask
 import flask_babel
 import flask_login
 import sqlalchemy as sa
+from sqlalchemy.ext import hybrid
 from werkzeug import security as wzs
 
 from app import db
-from app.enums import PaymentStatus, SubState
+from app.enums import MailStatus, PaymentStatus, SubState
 from app.tools import typing, utils
+from app.tools.caching import cached, request_cached, invalidate_on_change
+from app.tools.last_seen import buffer as last_seen_buffer
 from app.tools.columns import (column, one_to_many, many_to_one, my_enum,
                                Column, Relationship)
 
+if typing.TYPE_CHECKING:
+    # ! Imports models: not at runtime to avoid circular import issues !
+    from app.tools.ip_pool import RoomPool
+
 
 Model = typing.cast(type[type], db.Model)   # type checking hack
 Enum = my_enum                              # type checking hack
@@ -78,14 +85,19 @@ class Rezident(flask_login.UserMixin, Model):
             return datetime.datetime.utcnow()
         return min(device.registered for device in self.devices)
 
-    @property
+    @request_cached
     def current_device(self) -> Device | None:
-        """The rezidents's last seen device, or ``None``."""
+        """The rezidents's last seen device, or ``None``.
+
+        Devices currently online on the network (see
+        :attr:`.Device.is_online`) are preferred.
+        """
         if not self.devices:
             return None
-        return max(self.devices, key=lambda device: device.last_seen_time)
+        return max(self.devices, key=lambda device: (device.is_online,
+                                                     device.last_seen_time))
 
-    @property
+    @request_cached
     def last_seen(self) -> datetime.datetime | None:
         """The last time the rezident logged in, or ``None``."""
         if not self.current_device:
@@ -111,7 +123,7 @@ class Rezident(flask_login.UserMixin, Model):
             # Connected from outside/an other device: include it
             return all
 
-    @property
+    @request_cached
     def current_rental(self) -> Rental | None:
         """The rezidents's current rental, or ``None``."""
         try:
@@ -124,18 +136,27 @@ class Rezident(flask_login.UserMixin, Model):
         """The rezidents's non-current rentals."""
         return [rental for rental in self.rentals if not rental.is_current]
 
-    @property
+    @request_cached
     def current_room(self) -> Room | None:
         """The rezidents's current room, or ``None``."""
         current_rental = self.current_rental
         return current_rental.room if current_rental else None
 
-    @property
+    @hybrid.hybrid_property
+    @cached
     def has_a_room(self) -> bool:
-        """Whether the rezident has currently a room rented."""
+        """Whether the rezident has currently a room rented.
+
+        Also usable in queries (``EXISTS`` a current rental).
+        """
         return (self.current_rental is not None)
 
-    @property
+    @has_a_room.expression
+    def has_a_room(cls) -> sa.sql.ColumnElement:
+        return (sa.exists().where(Rental._rezident_id == cls.id)
+                .where(Rental.is_current))
+
+    @request_cached
     def current_subscription(self) -> Subscription | None:
         """:class:`Subscription`: The rezidents's current subscription, or
         ``None``."""
@@ -157,7 +178,8 @@ class Rezident(flask_login.UserMixin, Model):
 
         Theoretically returns :attr:`~Rezident.sub_state`, but computed
         from :attr:`~Rezident.subscriptions`: it will differ the first
-        minutes of the day of state change, before the daily scheduled
+        minutes of the day of state change, before the transitions
+        scheduler (see :mod:`.tools.scheduler`) or the daily scheduled
         script ``update_sub_states`` changes it.
 
         Returns:
@@ -195,7 +217,7 @@ class Rezident(flask_login.UserMixin, Model):
             f"granting Internet access for {start} – {start + offer.delay}"
         )
 
-    @property
+    @request_cached
     def current_ban(self) -> Ban | None:
         """The rezident's current ban, or ``None``."""
         try:
@@ -203,11 +225,19 @@ class Rezident(flask_login.UserMixin, Model):
         except StopIteration:
             return None
 
-    @property
+    @hybrid.hybrid_property
+    @cached
     def is_banned(self) -> bool:
-        """Whether the rezident is currently under a ban."""
+        """Whether the rezident is currently under a ban.
+
+        Also usable in queries (``EXISTS`` an active ban).
+        """
         return (self.current_ban is not None)
 
+    @is_banned.expression
+    def is_banned(cls) -> sa.sql.ColumnElement:
+        return sa.exists().where(Ban._rezident_id == cls.id).where(Ban.is_active)
+
     def set_password(self, password: str) -> None:
         """Save or modify rezident password.
 
@@ -278,7 +308,7 @@ class Device(Model):
     """A device of a Rezident."""
     id: Column[int] = column(sa.Integer(), primary_key=True)
     _rezident_id: Column[int] = column(sa.ForeignKey("rezident.id"),
-                                       nullable=False)
+                                       nullable=False, index=True)
     rezident: Relationship[Rezident] = many_to_one("Rezident.devices")
     mac_address: Column[str] = column(sa.String(17), nullable=False,
                                       unique=True)
@@ -287,6 +317,8 @@ class Device(Model):
     registered: Column[datetime.datetime] = column(sa.DateTime(),
                                                    nullable=False)
     last_seen: Column[datetime.datetime | None] = column(sa.DateTime())
+    online_until: Column[datetime.datetime | None] = column(sa.DateTime(),
+                                                            nullable=True)
 
     allocations: Relationship[list[Allocation]] = one_to_many(
         "Allocation.device"
@@ -305,38 +337,96 @@ class Device(Model):
         """
         return self.last_seen or datetime.datetime(1, 1, 1)
 
+    @hybrid.hybrid_property
+    def is_online(self) -> bool:
+        """Whether the device currently holds an active DHCP lease.
+
+        Set from the DHCP server leases file (see :mod:`.tools.leases`).
+        Also usable in queries.
+        """
+        return bool(self.online_until
+                    and self.online_until > datetime.datetime.utcnow())
+
+    @is_online.expression
+    def is_online(cls) -> sa.sql.ColumnElement:
+        return sa.and_(cls.online_until.isnot(None),
+                       cls.online_until > datetime.datetime.utcnow())
+
     def update_last_seen(self) -> None:
-        """Change :attr:`.Device.last_seen` timestamp to now."""
-        self.last_seen = datetime.datetime.utcnow()
-        db.session.commit()
+        """Change :attr:`.Device.last_seen` timestamp to now.
 
-    def allocate_ip_for(self, room: Room) -> str:
+        The change is not written immediately, but recorded in
+        :data:`.tools.last_seen.buffer` and flushed in bulk later, with
+        a precision of ``LAST_SEEN_PRECISION`` seconds.
+        """
+        last_seen_buffer.record(self.id, datetime.datetime.utcnow(),
+                                current=self.last_seen)
+
+    def allocate_ip_for(self, room: Room, *,
+                        allocations: dict[tuple[int, int], str] | None = None,
+                        pools: dict[int, RoomPool] | None = None,
+                        commit: bool = True,
+                        ignore_ban: bool = False) -> str:
         """Get the specific IP to use this device in a given room.
 
-        Create the :class`.Allocation` instance if it does not exist.
+        Create the :class`.Allocation` instance if it does not exist,
+        taking a free IP in the room pool (see :class:`.ip_pool.RoomPool`),
+        or reusing the IP of a device that left the room.
 
         Args:
             room: The room to allocate / get allocation for.
+            allocations: If set, the existing allocations IPs mapped to
+                ``(device ID, room number)``, used instead of querying the
+                database (and updated if a new allocation is created).
+            pools: If set, the rooms pools already loaded, mapped to rooms
+                numbers (loaded and added if needed). Must be given to
+                create several allocations in the same room before commit.
+            commit: Whether to commit a new allocation; if ``False``, it
+                is only added to the session (allowing to commit several
+                allocations at once).
+            ignore_ban: If ``True``, allocate a normal IP even if the
+                rezident is banned (ban enforced by other means).
 
         Returns:
             The allocated IP.
+
+        Raises:
+            .ip_pool.IPPoolExhausted: If no IP is available in the room.
         """
-        if self.rezident.is_banned:
+        # ! Keep import here to avoid circular import issues !
+        from app.tools.ip_pool import RoomPool
+
+        if not ignore_ban and self.rezident.is_banned:
             # Rezident banned: IP in 10.0.8-255.0-255 (encoding ban ID)
             # (i.e. a range of 126975 bans)
             ban = self.rezident.current_ban
             return f"10.0.{8 + (ban.id // 256)}.{ban.id % 256}"
 
-        alloc = Allocation.query.filter_by(device=self, room=room).first()
-        if alloc:
+        if allocations is not None:
+            ip = allocations.get((self.id, room.num))
+        else:
+            alloc = Allocation.query.filter_by(device=self, room=room).first()
+            ip = alloc.ip if alloc else None
+        if ip:
             # Already allocated
-            return alloc.ip
+            return ip
         # Create allocation
-        ip = f"10.{room.ips_allocated % 256}.{room.base_ip}"
+        if pools is None:
+            pools = {}
+        if room.num not in pools:
+            pools[room.num] = RoomPool.load(room)
+        slot, stale_id = pools[room.num].take()
+        if stale_id:
+            # Device that left the room: reuse its IP
+            db.session.delete(Allocation.query.get(stale_id))
+        ip = pools[room.num].ip(slot)
         alloc = Allocation(device=self, room=room, ip=ip)
         db.session.add(alloc)
         room.ips_allocated += 1
-        db.session.commit()
+        if allocations is not None:
+            allocations[self.id, room.num] = ip
+        if commit:
+            db.session.commit()
         return ip
 
     @property
@@ -362,15 +452,25 @@ class Rental(Model):
     start: Column[datetime.date] = column(sa.Date(), nullable=False)
     end: Column[datetime.date | None] = column(sa.Date())
 
+    __table_args__ = (
+        # Current rental of a rezident / a room
+        sa.Index("ix_rental_rezident_end", _rezident_id, end),
+        sa.Index("ix_rental_room_end", _room_num, end),
+    )
+
     def __repr__(self) -> str:
         """Returns repr(self)."""
         return f"<Rental #{self.id} of {self.room} by {self.rezident}>"
 
-    @property
+    @hybrid.hybrid_property
     def is_current(self) -> bool:
-        """Whether the rental is current."""
+        """Whether the rental is current. Also usable in queries."""
         return (self.end is None) or (self.end > datetime.date.today())
 
+    @is_current.expression
+    def is_current(cls) -> sa.sql.ColumnElement:
+        return sa.or_(cls.end.is_(None), cls.end > datetime.date.today())
+
 
 class Room(Model):
     """A Rezidence room."""
@@ -431,6 +531,12 @@ class Allocation(Model):
     room: Relationship[Room] = many_to_one("Room.allocations")
     ip: Column[str] = column(sa.String(16), nullable=False)
 
+    __table_args__ = (
+        # One allocation per device and room (also used for lookups)
+        sa.UniqueConstraint(_device_id, _room_num,
+                            name="uq_allocation_device_room"),
+    )
+
     def __repr__(self) -> str:
         """Returns repr(self)."""
         return f"<Allocation #{self.id}: {self.ip} to {self.device}>"
@@ -452,6 +558,11 @@ class Subscription(Model):
     start: Column[datetime.date] = column(sa.Date(), nullable=False)
     end: Column[datetime.date] = column(sa.Date(), nullable=False)
 
+    __table_args__ = (
+        # Active / trial subscriptions of a rezident
+        sa.Index("ix_subscription_rezident_end", _rezident_id, end),
+    )
+
     def __repr__(self) -> str:
         """Returns repr(self)."""
         return f"<Subscription #{self.id} of {self.rezident}>"
@@ -459,7 +570,38 @@ class Subscription(Model):
     @property
     def cut_day(self) -> datetime.date:
         """The day Internet access is cut if no other subscription is made."""
-        return self.end + relativedelta.relativedelta(months=1, days=1)
+        return self.cut_day_for(self.end)
+
+    @staticmethod
+    def cut_day_for(end: datetime.date) -> datetime.date:
+        """The cut day of a subscription ending at a given date.
+
+        Args:
+            end: The subscription :attr:`~Subscription.end`.
+        """
+        return end + relativedelta.relativedelta(months=1, days=1)
+
+    @classmethod
+    def first_active_end(cls, day: datetime.date | None = None
+                         ) -> datetime.date:
+        """The earliest end date of subscriptions active on a given day.
+
+        Since :meth:`cut_day_for` is non-decreasing, a subscription is
+        active on ``day`` if and only if it ends on this date or later:
+        this allows to express :attr:`is_active` as a simple comparison
+        on :attr:`~Subscription.end` in queries.
+
+        Args:
+            day: The day to consider (default: today).
+        """
+        day = day or datetime.date.today()
+        end = day - relativedelta.relativedelta(months=1, days=1)
+        # Month lengths differences: adjust to the exact limit
+        while cls.cut_day_for(end) > day:
+            end -= datetime.timedelta(days=1)
+        while cls.cut_day_for(end) <= day:
+            end += datetime.timedelta(days=1)
+        return end
 
     @property
     def renew_day(self) -> datetime.date:
@@ -472,22 +614,37 @@ class Subscription(Model):
         else:
             return datetime.date.today()
 
-    @property
+    @hybrid.hybrid_property
     def is_active(self) -> bool:
-        """Whether the subscription is active or in trial period."""
+        """Whether the subscription is active or in trial period.
+
+        Also usable in queries.
+        """
         return datetime.date.today() < self.cut_day
 
-    @property
+    @is_active.expression
+    def is_active(cls) -> sa.sql.ColumnElement:
+        return cls.end >= cls.first_active_end()
+
+    @hybrid.hybrid_property
     def is_trial(self) -> bool:
-        """Whether the subscription is in trial period."""
+        """Whether the subscription is in trial period.
+
+        Also usable in queries.
+        """
         return self.end <= datetime.date.today() < self.cut_day
 
+    @is_trial.expression
+    def is_trial(cls) -> sa.sql.ColumnElement:
+        return sa.and_(cls.end <= datetime.date.today(),
+                       cls.end >= cls.first_active_end())
+
 
 class Payment(Model):
     """An payment made by a Rezident."""
     id: Column[int] = column(sa.Integer(), primary_key=True)
     _rezident_id: Column[int] = column(sa.ForeignKey("rezident.id"),
-                                       nullable=False)
+                                       nullable=False, index=True)
     rezident: Relationship[Rezident] = many_to_one("Rezident.payments",
                                                    foreign_keys=_rezident_id)
     amount: Column[float] = column(sa.Numeric(6, 2, asdecimal=False),
@@ -497,7 +654,7 @@ class Payment(Model):
     status: Column[PaymentStatus] = column(
         Enum(PaymentStatus), nullable=False, default=PaymentStatus.creating
     )
-    lydia_uuid: Column[str | None] = column(sa.String(32))
+    lydia_uuid: Column[str | None] = column(sa.String(32), index=True)
     lydia_transaction_id: Column[str | None] = column(sa.String(32))
     _gri_id: Column[int | None] = column(sa.ForeignKey("rezident.id"))
     gri: Relationship[Rezident] = many_to_one("Rezident.payments_created",
@@ -614,6 +771,14 @@ class Ban(Model):
     reason: Column[str | None] = column(sa.String(32), nullable=False)
     message: Column[str | None] = column(sa.String(2000))
 
+    __table_args__ = (
+        # Active bans (of a rezident), mostly open-ended bans
+        sa.Index("ix_ban_rezident_end", _rezident_id, end),
+        sa.Index("ix_ban_open", _rezident_id,
+                 postgresql_where=end.is_(None),
+                 sqlite_where=end.is_(None)),
+    )
+
     def __repr__(self) -> str:
         """Returns repr(self)."""
         return f"<Ban #{self.id} of {self.rezident} (-> {self.end})>"
@@ -626,8 +791,58 @@ class Ban(Model):
         else:
             return None
 
-    @property
+    @hybrid.hybrid_property
     def is_active(self) -> bool:
-        """Whether the ban is currently active."""
+        """Whether the ban is currently active. Also usable in queries."""
         now = datetime.datetime.utcnow()
         return (self.start <= now) and ((not self.end) or now < self.end)
+
+    @is_active.expression
+    def is_active(cls) -> sa.sql.ColumnElement:
+        now = datetime.datetime.utcnow()
+        return sa.and_(cls.start <= now,
+                       sa.or_(cls.end.is_(None), cls.end > now))
+
+
+# Invalidate Rezident request-cached properties when their sources change
+invalidate_on_change(
+    Rezident.devices, Rezident.rentals, Rezident.subscriptions, Rezident.bans,
+    Device.rezident, Device.last_seen, Device.online_until,
+    Rental.rezident, Rental.room, Rental.start, Rental.end,
+    Subscription.rezident, Subscription.start, Subscription.end,
+    Ban.rezident, Ban.start, Ban.end,
+)
+
+
+class OutboxMail(Model):
+    """A mail to send, kept until delivered (see :mod:`app.email`)."""
+    id: Column[int] = column(sa.Integer(), primary_key=True)
+    template: Column[str] = column(sa.String(64), nullable=False)
+    dedup_key: Column[str | None] = column(sa.String(128), nullable=True,
+                                           unique=True)
+    subject: Column[str] = column(sa.String(256), nullable=False)
+    sender: Column[str] = column(sa.String(256), nullable=False)
+    recipients: Column[list[str]] = column(sa.JSON(), nullable=False)
+    body: Column[str] = column(sa.Text(), nullable=False)
+    html: Column[str] = column(sa.Text(), nullable=False)
+    extra_headers: Column[dict[str, str]] = column(sa.JSON(), nullable=False)
+    status: Column[MailStatus] = column(Enum(MailStatus), nullable=False,
+                                        default=MailStatus.pending)
+    attempts: Column[int] = column(sa.Integer(), nullable=False, default=0)
+    created: Column[datetime.datetime] = column(sa.DateTime(),
+                                                nullable=False)
+    next_attempt: Column[datetime.datetime] = column(sa.DateTime(),
+                                                     nullable=False)
+    sent: Column[datetime.datetime | None] = column(sa.DateTime(),
+                                                    nullable=True)
+    last_error: Column[str | None] = column(sa.String(500), nullable=True)
+
+    __table_args__ = (
+        # Mails due (pending, or being sent but lease expired)
+        sa.Index("ix_outbox_mail_status_next", status, next_attempt),
+    )
+
+    def __repr__(self) -> str:
+        """Returns repr(self)."""
+        return (f"<OutboxMail #{self.id} '{self.template}' "
+                f"({self.status.name})>")
@@ -1,11 +1,49 @@
 """Intranet de la Rez - Payments-related emails"""
 
-import flask
-import flask_babel
-from flask_babel import _
+from flask_babel import lazy_gettext as _l
 
-from app.email import send_email
+from app.email import BulkResult, send_bulk
 from app.models import Rezident, SubState
+from app.tools import typing
+
+
+# Subscription state -> (mail template name, subject)
+_STATE_MAILS = {
+    SubState.subscribed: ("new_subscription", _l("Paiement validé !")),
+    SubState.trial: ("subscription_expired", _l("Paiement nécessaire")),
+    SubState.outlaw: ("internet_cut", _l("Votre accès Internet a été coupé")),
+}
+
+
+def _sub_context(rezident: Rezident) -> dict[str, typing.Any]:
+    return {"sub": rezident.current_subscription}
+
+
+def send_state_change_emails(rezidents: typing.Iterable[Rezident],
+                             sub_state: SubState,
+                             **kwargs: typing.Any) -> BulkResult:
+    """Send an email informing Rezidents of a subscription state change.
+
+    Each mail is only sent once per subscription end.
+
+    Args:
+        rezidents: The Rezidents in question.
+        sub_state: The new Rezidents subscription state.
+        **kwargs: Passed to :func:`.email.send_bulk`.
+
+    Returns:
+        The mailing summary.
+    """
+    template_name, subject = _STATE_MAILS[sub_state]
+
+    def dedup_key(rezident: Rezident) -> str | None:
+        # Once per subscription end (state change detected several times)
+        sub = rezident.current_subscription
+        return (f"payments/{template_name}/{rezident.id}/{sub.end}"
+                if sub else None)
+
+    return send_bulk(f"payments/{template_name}", rezidents, subject,
+                     context=_sub_context, dedup_key=dedup_key, **kwargs)
 
 
 def send_state_change_email(rezident: Rezident, sub_state: SubState) -> None:
@@ -15,29 +53,32 @@ def send_state_change_email(rezident: Rezident, sub_state: SubState) -> None:
         rezident: The Rezident in question.
         sub_state: The new Rezident subscription state.
     """
-    with flask_babel.force_locale(rezident.locale or "en"):
-        # Render mail content in rezident's language
-        if sub_state == SubState.subscribed:
-            subject = _("Paiement validé !")
-            template_name = "new_subscription"
-        elif sub_state == SubState.trial:
-            subject = _("Paiement nécessaire")
-            template_name = "subscription_expired"
-        else:
-            subject = _("Votre accès Internet a été coupé")
-            template_name = "internet_cut"
-
-        html_body = flask.render_template(
-            f"payments/mails/{template_name}.html",
-            rezident=rezident,
-            sub=rezident.current_subscription
-        )
-
-    send_email(
-        f"payments/{template_name}",
-        subject=f"[IntraRez] {subject}",
-        recipients={rezident.email: rezident.full_name},
-        html_body=html_body,
+    send_state_change_emails([rezident], sub_state, block=False)
+
+
+def send_reminder_emails(rezidents: typing.Iterable[Rezident],
+                         **kwargs: typing.Any) -> BulkResult:
+    """Send an email informing Rezidents their access will be cut soon.
+
+    Each mail is only sent once per cut day (e.g. by the transitions
+    scheduler and the ``update_sub_states`` script).
+
+    Args:
+        rezidents: The Rezidents in question.
+        **kwargs: Passed to :func:`.email.send_bulk`.
+
+    Returns:
+        The mailing summary.
+    """
+    def dedup_key(rezident: Rezident) -> str | None:
+        sub = rezident.current_subscription
+        return (f"payments/renew_reminder/{rezident.id}/{sub.cut_day}"
+                if sub else None)
+
+    return send_bulk(
+        "payments/renew_reminder", rezidents,
+        _l("IMPORTANT - Votre accès Internet va bientôt couper !"),
+        context=_sub_context, dedup_key=dedup_key, **kwargs
     )
 
 
@@ -47,18 +88,20 @@ def send_reminder_email(rezident: Rezident) -> None:
     Args:
         rezident: The Rezident in question.
     """
-    with flask_babel.force_locale(rezident.locale or "en"):
-        # Render mail content in rezident's language
-        subject = _("IMPORTANT - Votre accès Internet va bientôt couper !")
-        html_body = flask.render_template(
-            "payments/mails/renew_reminder.html",
-            rezident=rezident,
-            sub=rezident.current_subscription,
-        )
-
-    send_email(
-        "payments/renew_reminder",
-        subject=f"[IntraRez] {subject}",
-        recipients={rezident.email: rezident.full_name},
-        html_body=html_body,
-    )
+    send_reminder_emails([rezident], block=False)
+
+
+def send_on_setup_emails(rezidents: typing.Iterable[Rezident],
+                         **kwargs: typing.Any) -> BulkResult:
+    """Send an email informing Rezidents of the payments setup.
+
+    Args:
+        rezidents: The Rezidents in question.
+        **kwargs: Passed to :func:`.email.send_bulk`.
+
+    Returns:
+        The mailing summary.
+    """
+    return send_bulk("payments/on_setup", rezidents,
+                     _l("IMPORTANT - Paiement d'Internet"),
+                     context=_sub_context, default_locale="fr", **kwargs)
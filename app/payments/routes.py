@@ -9,7 +9,7 @@ from app import context, db
 from app.payments import bp, email, forms
 from app.enums import PaymentStatus, SubState
 from app.models import Offer, Payment, Rezident, Subscription
-from app.tools import lydia, utils, typing
+from app.tools import dhcp, lydia, utils, typing
 
 
 def add_subscription(rezident: Rezident, offer: Offer,
@@ -58,7 +58,7 @@ def add_subscription(rezident: Rezident, offer: Offer,
             f"{rezident} subscribed, terminated {rezident.current_ban}"
         )
         db.session.commit()
-        utils.run_script("gen_dhcp.py")       # Update DHCP rules
+        dhcp.queue.submit(rezident)           # Update DHCP rules
 
     # Send mail
     email.send_state_change_email(rezident, rezident.sub_state)
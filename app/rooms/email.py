@@ -1,10 +1,8 @@
 """Intranet de la Rez - Rooms-related Emails"""
 
-import flask
-import flask_babel
-from flask_babel import _
+from flask_babel import lazy_gettext as _l
 
-from app.email import send_email
+from app.email import send_bulk
 from app.models import Rezident
 
 
@@ -14,17 +12,6 @@ def send_room_transferred_email(rezident: Rezident) -> None:
     Args:
         rezident (models.Rezident): the rezident that lost its room.
     """
-    with flask_babel.force_locale(rezident.locale or "en"):
-        # Render mail content in rezident's language
-        subject = _("Attention : Chambre transférée, Internet coupé")
-        html_body = flask.render_template(
-            "rooms/mails/room_transferred.html",
-            rezident=rezident,
-        )
-
-    send_email(
-        "rooms/room_transferred",
-        subject=f"[IntraRez] {subject}",
-        recipients={rezident.email: rezident.full_name},
-        html_body=html_body,
-    )
+    send_bulk("rooms/room_transferred", [rezident],
+              _l("Attention : Chambre transférée, Internet coupé"),
+              block=False)
@@ -6,9 +6,9 @@ import flask
 from flask_babel import _
 
 from app import context, db
-from app.models import Room, Rental
+from app.models import Rezident, Room, Rental
 from app.rooms import bp, email, forms
-from app.tools import utils, typing
+from app.tools import dhcp, utils, typing
 
 
 @bp.before_app_first_request
@@ -37,7 +37,7 @@ def register() -> typing.RouteReturn:
         room = Room.query.get(form.room.data)
         room = typing.cast(Room, room)  # type check only
 
-        def _register_room() -> typing.RouteReturn:
+        def _register_room(*others: Rezident) -> typing.RouteReturn:
             start = form.start.data
             end = form.end.data
             rental = Rental(rezident=flask.g.rezident, room=room,
@@ -47,7 +47,7 @@ def register() -> typing.RouteReturn:
             utils.log_action(
                 f"Added {rental} for period {start} – {end}"
             )
-            utils.run_script("gen_dhcp.py")       # Update DHCP rules
+            dhcp.queue.submit(flask.g.rezident, *others)    # DHCP rules
             flask.flash(_("Chambre enregistrée avec succès !"), "success")
             # OK
             return utils.redirect_to_next()
@@ -67,7 +67,7 @@ def register() -> typing.RouteReturn:
                 warning=True
             )
             email.send_room_transferred_email(old_rezident)
-            return _register_room()
+            return _register_room(old_rezident)
 
         # Else: Do not validate form, but put a warning message
         already_rented = room.num
@@ -0,0 +1,33 @@
+/* Poll DHCP regeneration job status every second until finished (at most
+   max_attempts times: the job may stay pending if its worker died) */
+var max_attempts = 60;
+
+async function poll_dhcp_job() {
+    var alert_div = document.getElementById("dhcp-job");
+    var job = null;
+    for (var attempt = 0; attempt < max_attempts; attempt++) {
+        await new Promise(r => setTimeout(r, 1000));
+        try {
+            var response = await fetch(alert_div.dataset.url);
+            job = await response.json();
+        } catch (err) {
+            console.log(err);
+            continue;
+        }
+        if (job.state == "done") {
+            alert_div.classList.replace("alert-secondary", "alert-success");
+            alert_div.textContent = alert_div.dataset.done;
+            return;
+        } else if (job.state == "error" || job.state == "unknown") {
+            alert_div.classList.replace("alert-secondary", "alert-danger");
+            alert_div.textContent = alert_div.dataset.error + " "
+                                    + (job.error || job.state);
+            return;
+        }
+    }
+    alert_div.classList.replace("alert-secondary", "alert-danger");
+    alert_div.textContent = alert_div.dataset.error + " "
+                            + alert_div.dataset.timeout;
+}
+
+poll_dhcp_job();
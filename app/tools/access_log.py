@@ -0,0 +1,306 @@
+"""Intranet de la Rez - Structured Access Log
+
+Each request served (static files apart) is logged in
+``logs/access.log`` (see :func:`.loggers.configure_logging`), rotated
+daily, as a JSON object on a single line. Field names are stable:
+
+  * ``time``: ISO 8601 UTC time of the end of the request;
+  * ``method``, ``path``, ``endpoint`` (``null`` if no route matched),
+    ``status``: the request and response;
+  * ``remote_ip``, ``user``, ``doas``: the caller IP, logged-in rezident
+    username, and username of the rezident the request is made as (GRI
+    using doas), or ``null``;
+  * ``total_ms``: total duration of the request processing;
+  * ``context_ms``: request context creation (network checks, ARP
+    lookup, rezident...: see :func:`.context.create_request_context`);
+  * ``view_ms``: view function execution;
+  * ``render_ms``: templates rendering;
+  * ``sql_ms``, ``sql_count``: database queries;
+  * ``http_ms``, ``http_count``: requests to external services (Lydia,
+    reCAPTCHA, Discord...).
+
+Rendering, SQL and HTTP times are included in the context / view times
+during which they occur. Durations are in milliseconds.
+
+:func:`endpoint_stats` summarizes logs (also rotated ones) per endpoint:
+see the ``flask access-log stats`` command.
+"""
+
+import contextlib
+import datetime
+import functools
+import glob
+import gzip
+import json
+import time
+
+import flask
+import sqlalchemy as sa
+
+from app import IntraRezApp
+from app.tools import typing
+
+
+ACCESS_LOG_FILE = "logs/access.log"
+
+PHASES = ("context", "view", "render", "sql", "http")
+
+
+class RequestTimings:
+    """Time spent in each phase of a request.
+
+    Stored in :attr:`flask.g.timings` at request start.
+
+    Attrs:
+        start (float): The request start (:func:`time.perf_counter`).
+        durations (dict[str, float]): Time spent in each phase (see
+            :data:`PHASES`), in seconds.
+        counts (dict[str, int]): Number of times each phase occurred.
+    """
+    def __init__(self) -> None:
+        """Initializes self."""
+        self.start = time.perf_counter()
+        self.durations = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(PHASES, 0)
+        self._render_starts: list[float] = []
+
+    def add(self, phase: str, duration: float) -> None:
+        """Record an occurrence of a phase.
+
+        Args:
+            phase: The phase (see :data:`PHASES`).
+            duration: Its duration, in seconds.
+        """
+        self.durations[phase] += duration
+        self.counts[phase] += 1
+
+
+def current() -> RequestTimings | None:
+    """The timings of the current request, if any."""
+    if not flask.has_app_context():
+        return None
+    return flask.g.get("timings")
+
+
+@contextlib.contextmanager
+def phase(name: str) -> typing.Iterator[None]:
+    """Context manager recording a phase of the current request.
+
+    Does nothing outside requests (CLI, background threads...).
+
+    Args:
+        name: The phase (see :data:`PHASES`), e.g. ``"http"`` around
+            requests to external services.
+    """
+    timings = current()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def timed(name: str) -> typing.Callable[[typing.Callable], typing.Callable]:
+    """Decorator recording the calls of a function as a phase.
+
+    See :func:`phase`.
+
+    Args:
+        name: The phase (see :data:`PHASES`).
+    """
+    def decorator(func: typing.Callable) -> typing.Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs) -> typing.Any:
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _start_request(_app: IntraRezApp, **_extra) -> None:
+    # request_started signal: start timing
+    flask.g.timings = RequestTimings()
+
+
+def _before_render(_app: IntraRezApp, **_extra) -> None:
+    # before_render_template signal
+    if timings := current():
+        timings._render_starts.append(time.perf_counter())
+
+
+def _after_render(_app: IntraRezApp, **_extra) -> None:
+    # template_rendered signal
+    if (timings := current()) and timings._render_starts:
+        start = timings._render_starts.pop()
+        if not timings._render_starts:      # Do not count nested twice
+            timings.add("render", time.perf_counter() - start)
+
+
+def _before_query(_conn: sa.engine.Connection, _cursor: typing.Any,
+                  _statement: str, _parameters: typing.Any,
+                  context: typing.Any, _executemany: bool) -> None:
+    # before_cursor_execute engine event
+    if current():
+        context._access_log_start = time.perf_counter()
+
+
+def _after_query(_conn: sa.engine.Connection, _cursor: typing.Any,
+                 _statement: str, _parameters: typing.Any,
+                 context: typing.Any, _executemany: bool) -> None:
+    # after_cursor_execute engine event
+    start = getattr(context, "_access_log_start", None)
+    if start is not None and (timings := current()):
+        timings.add("sql", time.perf_counter() - start)
+
+
+sa.event.listen(sa.engine.Engine, "before_cursor_execute", _before_query)
+sa.event.listen(sa.engine.Engine, "after_cursor_execute", _after_query)
+
+
+def init_app(app: IntraRezApp) -> None:
+    """Start recording requests timings for an app.
+
+    Requests views are timed by :meth:`.IntraRezApp.dispatch_request`,
+    context creation by :func:`.context.create_request_context`
+    (decorated in :func:`.create_app`) and external requests by
+    :func:`phase` blocks.
+    """
+    flask.request_started.connect(_start_request, app)
+    flask.before_render_template.connect(_before_render, app)
+    flask.template_rendered.connect(_after_render, app)
+
+
+def _ms(seconds: float) -> float:
+    # Duration in milliseconds, rounded to the microsecond
+    return round(1000 * seconds, 3)
+
+
+def build_entry(response: flask.Response) -> dict[str, typing.Any]:
+    """Build the access log entry of the current request.
+
+    Args:
+        response: The response served.
+
+    Returns:
+        The entry (see module docstring for fields).
+    """
+    timings = current() or RequestTimings()
+    user = doas = None
+    try:
+        if flask.g.logged_in:
+            user = flask.g.logged_in_user.username
+            if flask.g.doas:
+                doas = flask.g.rezident.username
+    except AttributeError:
+        pass
+    return {
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(
+            timespec="milliseconds"
+        ),
+        "method": flask.request.method,
+        "path": flask.request.path,
+        "endpoint": flask.request.endpoint,
+        "status": response.status_code,
+        "remote_ip": flask.request.headers.get("X-Real-Ip"),
+        "user": user,
+        "doas": doas,
+        "total_ms": _ms(time.perf_counter() - timings.start),
+        "context_ms": _ms(timings.durations["context"]),
+        "view_ms": _ms(timings.durations["view"]),
+        "render_ms": _ms(timings.durations["render"]),
+        "sql_ms": _ms(timings.durations["sql"]),
+        "sql_count": timings.counts["sql"],
+        "http_ms": _ms(timings.durations["http"]),
+        "http_count": timings.counts["http"],
+    }
+
+
+class EndpointStats(typing.NamedTuple):
+    """Access log statistics of an endpoint.
+
+    Durations are in milliseconds: percentiles of ``total_ms``, and mean
+    time spent in each phase.
+    """
+    endpoint: str
+    count: int
+    p50: float
+    p95: float
+    p99: float
+    context: float
+    view: float
+    render: float
+    sql: float
+    sql_count: float
+    http: float
+
+
+def log_files(base: str = ACCESS_LOG_FILE) -> list[str]:
+    """The access log files, rotated ones first (chronological order).
+
+    Args:
+        base: The current log file (rotated ones are ``<base>.<date>``,
+            possibly gzipped).
+    """
+    return [*sorted(glob.glob(f"{base}.*")), *glob.glob(base)]
+
+
+def read_entries(files: typing.Iterable[str]
+                 ) -> typing.Iterator[dict[str, typing.Any]]:
+    """Read access log entries (invalid lines are skipped).
+
+    Args:
+        files: The log files to read (``.gz`` files are decompressed).
+    """
+    for file in files:
+        opener = gzip.open if file.endswith(".gz") else open
+        with opener(file, "rt", encoding="utf-8") as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict) and "total_ms" in entry:
+                    yield entry
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    # Nearest-rank percentile of sorted values
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def endpoint_stats(entries: typing.Iterable[dict[str, typing.Any]],
+                   since: datetime.datetime | None = None
+                   ) -> list[EndpointStats]:
+    """Compute latency statistics per endpoint.
+
+    Args:
+        entries: The access log entries (see :func:`read_entries`).
+        since: If set, only consider requests served from this (aware)
+            datetime.
+
+    Returns:
+        The statistics, endpoints taking the most time in total first.
+        Requests not matching a route are grouped as ``"<no endpoint>"``.
+    """
+    groups: dict[str, list[dict[str, typing.Any]]] = {}
+    for entry in entries:
+        if since and datetime.datetime.fromisoformat(entry["time"]) < since:
+            continue
+        groups.setdefault(entry["endpoint"] or "<no endpoint>",
+                          []).append(entry)
+
+    stats = []
+    for endpoint, group in groups.items():
+        totals = sorted(entry["total_ms"] for entry in group)
+        mean = lambda field: sum(entry[field] for entry in group) / len(group)
+        stats.append((sum(totals), EndpointStats(
+            endpoint, len(group), _percentile(totals, 0.50),
+            _percentile(totals, 0.95), _percentile(totals, 0.99),
+            mean("context_ms"), mean("view_ms"), mean("render_ms"),
+            mean("sql_ms"), mean("sql_count"), mean("http_ms"),
+        )))
+    stats.sort(key=lambda item: item[0], reverse=True)
+    return [stat for _, stat in stats]
@@ -0,0 +1,668 @@
+"""Intranet de la Rez - Performance Benchmarks
+
+Functions called by the ``flask bench`` command group (see :mod:`app.cli`).
+"""
+
+import collections
+import contextlib
+import datetime
+import http.server
+import json
+import logging
+import random
+import socketserver
+import statistics
+import threading
+import time
+
+import flask_mail
+import requests
+import sqlalchemy as sa
+
+from app import IntraRezApp, context, db, mail
+from app.enums import PaymentStatus, SubState
+from app.models import Room
+from app.tools import typing
+
+
+def time_requests(app: IntraRezApp, url: str, number: int,
+                  headers: dict[str, str] | None = None) -> dict[str, float]:
+    """Time requests made to the application through a test client.
+
+    Args:
+        app: The application to query.
+        url: The URL to request (e.g. ``"/static/favicon.png"``).
+        number: The number of requests to make.
+        headers: Headers to add to each request.
+
+    Returns:
+        The mean, median and 95th percentile durations, in milliseconds.
+    """
+    client = app.test_client()
+    client.get(url, headers=headers)        # Warm-up (first request...)
+    durations = []
+    for _ in range(number):
+        start = time.perf_counter()
+        client.get(url, headers=headers)
+        durations.append(1000 * (time.perf_counter() - start))
+    durations.sort()
+    return {
+        "mean": statistics.fmean(durations),
+        "p50": durations[len(durations) // 2],
+        "p95": durations[int(len(durations) * 0.95)],
+    }
+
+
+def format_timings(name: str, timings: dict[str, float]) -> str:
+    """Format timings returned by :func:`.time_requests` in a table row."""
+    return (f"{name:<40} {timings['mean']:8.3f} {timings['p50']:8.3f} "
+            f"{timings['p95']:8.3f}")
+
+
+@contextlib.contextmanager
+def _forced_context_level(endpoint: str,
+                          level: context.ContextLevel) -> typing.Iterator[None]:
+    # Temporarily override the context level declared for an endpoint
+    previous = context._context_levels.get(endpoint)
+    context.set_context_level(level, endpoint=endpoint)
+    try:
+        yield
+    finally:
+        if previous:
+            context.set_context_level(previous, endpoint=endpoint)
+        else:
+            del context._context_levels[endpoint]
+
+
+def bench_context(app: IntraRezApp, number: int,
+                  remote_ip: str) -> typing.Iterator[str]:
+    """Compare requests durations with and without request context.
+
+    Requests are made to context-free endpoints (static file, health
+    check) with their normal context level, then forcing a full context,
+    and to a normal page for reference.
+
+    Args:
+        app: The application to query.
+        number: The number of requests to make for each case.
+        remote_ip: The IP the requests should come from.
+
+    Yields:
+        The lines of the results table.
+    """
+    headers = {"X-Real-Ip": remote_ip}
+    yield f"{'Request (ms)':<40} {'mean':>8} {'p50':>8} {'p95':>8}"
+    for name, url, endpoint in (
+        ("static", "/static/favicon.png", "static"),
+        ("health", "/health", "main.health"),
+    ):
+        timings = time_requests(app, url, number, headers)
+        yield format_timings(f"{name} (context-free)", timings)
+        with _forced_context_level(endpoint, context.ContextLevel.full):
+            timings = time_requests(app, url, number, headers)
+        yield format_timings(f"{name} (full context)", timings)
+    timings = time_requests(app, "/legal", number, headers)
+    yield format_timings("legal page (full context)", timings)
+
+
+class _SlowHandler(logging.Handler):
+    # Handler simulating the cost of writing a record (slow disk...)
+    def __init__(self, delay: float) -> None:
+        super().__init__()
+        self.delay = delay
+
+    def emit(self, record: logging.LogRecord) -> None:
+        time.sleep(self.delay)
+
+
+@contextlib.contextmanager
+def _direct_handlers(logger: logging.Logger,
+                     delay: float) -> typing.Iterator[None]:
+    # Temporarily call the handlers of a logger in the logging thread,
+    # with a simulated write cost
+    # ! Keep import here to avoid circular import issues !
+    from app.tools.loggers import BackgroundHandler
+
+    previous = list(logger.handlers)
+    handlers = [wrapped for handler in previous
+                if isinstance(handler, BackgroundHandler)
+                for wrapped in handler.handlers]
+    logger.handlers = [*handlers, _SlowHandler(delay)]
+    try:
+        yield
+    finally:
+        logger.handlers = previous
+
+
+@contextlib.contextmanager
+def _background_handlers(logger: logging.Logger,
+                         delay: float) -> typing.Iterator[None]:
+    # Temporarily add a simulated write cost to background handlers
+    # ! Keep import here to avoid circular import issues !
+    from app.tools.loggers import BackgroundHandler
+
+    background = [handler for handler in logger.handlers
+                  if isinstance(handler, BackgroundHandler)]
+    slow_handler = _SlowHandler(delay)
+    for handler in background:
+        handler.handlers.append(slow_handler)
+    try:
+        yield
+    finally:
+        for handler in background:
+            handler.handlers.remove(slow_handler)
+
+
+def bench_logging(app: IntraRezApp, number: int, remote_ip: str,
+                  write_delay: float) -> typing.Iterator[str]:
+    """Compare requests durations with direct and background logging.
+
+    Records are logged, then requests (each logged in the access log)
+    are made, with the log handlers called in the logging thread (the
+    previous behavior), then in the background (see
+    :class:`.loggers.BackgroundHandler`).
+
+    Args:
+        app: The application to query.
+        number: The number of records / requests for each case.
+        remote_ip: The IP the requests should come from.
+        write_delay: The simulated additional cost of a record write
+            (slow disk, file rotation...), in seconds.
+
+    Yields:
+        The lines of the results table.
+    """
+    # ! Keep import here to avoid circular import issues !
+    from app.tools import loggers
+
+    headers = {"X-Real-Ip": remote_ip}
+    yield f"Simulated write cost {1000 * write_delay:.1f} ms"
+    yield f"{'Request (ms)':<40} {'mean':>8} {'p50':>8} {'p95':>8}"
+    for variant, handlers in (("direct", _direct_handlers),
+                              ("background", _background_handlers)):
+        with handlers(app.logger, write_delay), \
+             handlers(app.access_logger, write_delay):
+            start = time.perf_counter()
+            for i in range(number):
+                app.logger.info(f"Benchmark record {i}")
+            duration = 1000 * (time.perf_counter() - start) / number
+            yield f"{f'log record ({variant} handlers)':<40} {duration:8.3f}"
+            loggers.flush_background()
+            for name, url in (("health", "/health"),
+                              ("legal page", "/legal")):
+                timings = time_requests(app, url, number, headers)
+                yield format_timings(f"{name} ({variant} handlers)", timings)
+
+
+def _populate(engine: sa.engine.Engine, metadata: sa.MetaData,
+              rezidents: int) -> None:
+    # Fill a database with a synthetic (but realistic) dataset
+    random.seed(137)
+    today = datetime.date.today()
+    now = datetime.datetime.utcnow()
+    rooms = [room.num for room in Room.create_rez_rooms()]
+    rows = collections.defaultdict(list)
+    rows["room"] = [{"num": num, "floor": num // 100, "base_ip": "1.1",
+                     "ips_allocated": 0} for num in rooms]
+    rows["offer"] = [{"slug": "_first", "name_fr": "-", "name_en": "-",
+                      "months": 0, "days": 0, "visible": False,
+                      "active": True}]
+    device_id = rental_id = sub_id = payment_id = ban_id = alloc_id = 0
+    for rez_id in range(1, rezidents + 1):
+        rows["rezident"].append({
+            "id": rez_id, "username": f"rez{rez_id}", "nom": "Nom",
+            "prenom": "Prénom", "promo": "140", "email": f"{rez_id}@rez",
+            "locale": "fr", "is_gri": False, "sub_state": SubState.trial,
+        })
+        start = today - datetime.timedelta(days=random.randrange(1, 2000))
+        room = random.choice(rooms)
+        rental_id += 1
+        rows["rental"].append({
+            "id": rental_id, "_rezident_id": rez_id, "_room_num": room,
+            "start": start,
+            "end": (None if random.random() < 0.02
+                    else start + datetime.timedelta(days=300)),
+        })
+        for _ in range(random.randint(1, 3)):
+            device_id += 1
+            rows["device"].append({
+                "id": device_id, "_rezident_id": rez_id,
+                "mac_address": f"{device_id:012x}", "registered": now,
+                "last_seen": now,
+            })
+            alloc_id += 1
+            rows["allocation"].append({
+                "id": alloc_id, "_device_id": device_id, "_room_num": room,
+                "ip": f"10.{alloc_id % 256}.1.1",
+            })
+        for _ in range(random.randint(1, 4)):
+            payment_id += 1
+            rows["payment"].append({
+                "id": payment_id, "_rezident_id": rez_id, "amount": 4.0,
+                "created": now, "status": PaymentStatus.accepted,
+                "lydia_uuid": f"{payment_id:032x}",
+            })
+            sub_id += 1
+            rows["subscription"].append({
+                "id": sub_id, "_rezident_id": rez_id, "_offer_slug": "_first",
+                "_payment_id": payment_id, "start": start, "end": start,
+            })
+        if random.random() < 0.1:
+            ban_id += 1
+            rows["ban"].append({
+                "id": ban_id, "_rezident_id": rez_id, "start": now,
+                "end": None if random.random() < 0.5 else now, "reason": "-",
+            })
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if rows[table.name]:
+                connection.execute(table.insert(), rows[table.name])
+
+
+def _lookup_queries(metadata: sa.MetaData, rezidents: int
+                    ) -> dict[str, typing.Callable[[], sa.sql.Select]]:
+    # Representative queries (relationship loads and lookups)
+    tables = metadata.tables
+    device, rental, subscription, payment, ban, allocation = (
+        tables[name] for name in ("device", "rental", "subscription",
+                                  "payment", "ban", "allocation")
+    )
+    rez = lambda: random.randint(1, rezidents)
+    now = datetime.datetime.utcnow()
+    return {
+        "Rezident.devices": lambda: sa.select(device).where(
+            device.c._rezident_id == rez()),
+        "Rezident.rentals": lambda: sa.select(rental).where(
+            rental.c._rezident_id == rez()),
+        "Rezident.subscriptions": lambda: sa.select(subscription).where(
+            subscription.c._rezident_id == rez()),
+        "Rezident.payments": lambda: sa.select(payment).where(
+            payment.c._rezident_id == rez()),
+        "Rezident.bans": lambda: sa.select(ban).where(
+            ban.c._rezident_id == rez()),
+        "Room.current_rental": lambda: sa.select(rental).where(
+            rental.c._room_num == 101,
+            sa.or_(rental.c.end.is_(None),
+                   rental.c.end > datetime.date.today())),
+        "Allocation (device, room)": lambda: sa.select(allocation).where(
+            allocation.c._device_id == rez(), allocation.c._room_num == 101),
+        "Payment by Lydia UUID": lambda: sa.select(payment).where(
+            payment.c.lydia_uuid == f"{rez():032x}"),
+        "Active bans": lambda: sa.select(ban).where(
+            ban.c.start <= now, sa.or_(ban.c.end.is_(None), ban.c.end > now)),
+    }
+
+
+def bench_indexes(url: str, rezidents: int,
+                  number: int) -> typing.Iterator[str]:
+    """Compare query plans and durations without and with indexes.
+
+    A synthetic dataset is generated in two fresh databases (one with
+    the tables only, one with all indexes and constraints declared by
+    the models), then representative lookups are explained and timed.
+
+    Args:
+        url: The SQLAlchemy URL of an empty scratch database, or
+            ``"sqlite://"`` to use in-memory SQLite databases.
+            The tables are dropped at the end. NEVER use production DB!
+        rezidents: The number of rezidents to generate.
+        number: The number of times each query is executed.
+
+    Yields:
+        The lines of the results report.
+
+    Raises:
+        ValueError: If the database is not empty (nothing is done).
+    """
+    results = {}
+    for variant in ("without indexes", "with indexes"):
+        metadata = sa.MetaData()
+        for table in db.metadata.sorted_tables:
+            copy = table.to_metadata(metadata)
+            for col in copy.columns:
+                # Models do not always reflect nullability (see migrations)
+                col.nullable = not col.primary_key
+            if variant == "without indexes":
+                copy.indexes.clear()
+                for constraint in list(copy.constraints):
+                    if isinstance(constraint, sa.UniqueConstraint):
+                        copy.constraints.remove(constraint)
+        engine = sa.create_engine(url)
+        if tables := sa.inspect(engine).get_table_names():
+            # create_all would skip them, then drop_all drop them
+            engine.dispose()
+            raise ValueError(f"Database {engine.url!r} is not empty "
+                             f"(tables {', '.join(tables)}): use an empty "
+                             "scratch database")
+        metadata.create_all(engine)
+        try:
+            _populate(engine, metadata, rezidents)
+            explain = ("EXPLAIN QUERY PLAN" if engine.name == "sqlite"
+                       else "EXPLAIN")
+            with engine.connect() as connection:
+                for name, query in _lookup_queries(metadata,
+                                                   rezidents).items():
+                    compiled = query().compile(
+                        engine, compile_kwargs={"literal_binds": True}
+                    )
+                    plan = connection.execute(
+                        sa.text(f"{explain} {compiled}")
+                    ).fetchall()
+                    start = time.perf_counter()
+                    for _ in range(number):
+                        connection.execute(query()).fetchall()
+                    duration = 1e6 * (time.perf_counter() - start) / number
+                    results.setdefault(name, {})[variant] = (plan, duration)
+        finally:
+            metadata.drop_all(engine)
+            engine.dispose()
+
+    yield f"{rezidents} rezidents, {number} executions per query"
+    for name, variants in results.items():
+        yield ""
+        yield f"=== {name}"
+        for variant, (plan, duration) in variants.items():
+            yield f"  {variant}: {duration:.1f} µs / query"
+            for row in plan:
+                yield f"      {' | '.join(str(field) for field in row)}"
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """A local SMTP server accepting and discarding all mails.
+
+    Speaks just enough SMTP for :mod:`smtplib` (no TLS, no auth). Usable
+    as a context manager (starts serving in a background thread, on a
+    free port).
+
+    Args:
+        connect_delay: Delay before greeting a new connection, in seconds
+            (simulates the cost of a real connection: TCP / TLS
+            handshakes, authentication...).
+
+    Attrs:
+        port (int): The port the server listens on.
+        connections (int): Number of connections received.
+        messages (int): Number of mails received.
+    """
+    daemon_threads = True
+    request_queue_size = 128            # Many concurrent connections
+    allow_reuse_address = True
+
+    def __init__(self, connect_delay: float = 0.0) -> None:
+        """Initializes self."""
+        super().__init__(("127.0.0.1", 0), _SMTPSinkHandler)
+        self.port = self.server_address[1]
+        self.connect_delay = connect_delay
+        self.connections = 0
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "SMTPSink":
+        """Start serving."""
+        threading.Thread(target=self.serve_forever, name="smtp-sink",
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *_exc_info) -> None:
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
+
+    def count(self, attribute: str) -> None:
+        """Increment a counter (thread-safe)."""
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+
+class _SMTPSinkHandler(socketserver.StreamRequestHandler):
+    # One connection to SMTPSink
+    server: SMTPSink
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self) -> None:
+        self.server.count("connections")
+        time.sleep(self.server.connect_delay)
+        self.reply("220 localhost IntraRez SMTP sink")
+        while line := self.rfile.readline():
+            command = line.decode(errors="replace").strip().upper()
+            if command.startswith("EHLO"):
+                self.reply("250-localhost")
+                self.reply("250 8BITMIME")
+            elif command.startswith("DATA"):
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while (line := self.rfile.readline()) not in (b".\r\n",
+                                                                b""):
+                    pass
+                self.server.count("messages")
+                self.reply("250 OK")
+            elif command.startswith("QUIT"):
+                self.reply("221 Bye")
+                return
+            else:       # HELO, MAIL, RCPT, RSET, NOOP...
+                self.reply("250 OK")
+
+
+def _bench_message(i: int) -> flask_mail.Message:
+    # A small mail to send in benchmarks
+    return flask_mail.Message(
+        subject=f"Benchmark {i}",
+        sender="IntraRez <bench@localhost>",
+        recipients=[f"Rezident {i} <rezident{i}@localhost>"],
+        body="Benchmark mail.\n" * 20,
+        html="<p>Benchmark mail.</p>" * 20,
+    )
+
+
+def bench_mails(app: IntraRezApp, number: int,
+                connect_delay: float) -> typing.Iterator[str]:
+    """Compare mail delivery strategies against a local SMTP sink.
+
+    Sends ``number`` mails with one thread and connection per mail (the
+    previous strategy), then through a :class:`.email.MailDispatcher`.
+
+    Args:
+        app: The application (its mail configuration is temporarily
+            replaced to target the sink).
+        number: The number of mails to send with each strategy.
+        connect_delay: The simulated cost of a SMTP connection, in
+            seconds (see :class:`SMTPSink`).
+
+    Yields:
+        The lines of the results table.
+    """
+    # ! Keep import here to avoid circular import issues !
+    from app.email import MailDispatcher
+
+    yield (f"{number} mails, connection cost {1000 * connect_delay:.0f} ms")
+    yield f"{'Strategy':<36} {'time (s)':>9} {'mails/s':>9} {'conns':>6}"
+    previous_state = app.extensions["mail"]
+    try:
+        for name in ("thread + connection per mail", "dispatcher"):
+            with SMTPSink(connect_delay) as sink, app.app_context():
+                app.extensions["mail"] = mail.init_mail({
+                    "MAIL_SERVER": "127.0.0.1", "MAIL_PORT": sink.port,
+                    "MAIL_SUPPRESS_SEND": False,
+                })
+                messages = [_bench_message(i) for i in range(number)]
+                start = time.perf_counter()
+                if name == "dispatcher":
+                    dispatcher = MailDispatcher(
+                        app.config["MAIL_WORKERS"],
+                        app.config["MAIL_QUEUE_SIZE"],
+                        app.config["MAIL_BATCH_SIZE"],
+                    )
+                    dispatcher.app = app
+                    for msg in messages:
+                        dispatcher.submit("bench", msg)
+                    dispatcher.stop()
+                else:
+                    def _send(msg: flask_mail.Message) -> None:
+                        with app.app_context():
+                            mail.send(msg)
+                    threads = [threading.Thread(target=_send, args=(msg,))
+                               for msg in messages]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                duration = time.perf_counter() - start
+                yield (f"{name:<36} {duration:9.3f} "
+                       f"{sink.messages / duration:9.1f} "
+                       f"{sink.connections:6d}")
+    finally:
+        app.extensions["mail"] = previous_state
+
+
+class WebhookStub(http.server.ThreadingHTTPServer):
+    """A local Discord webhook accepting messages, with rate limits.
+
+    Each POST carries a JSON ``{"content": ...}`` message. Like Discord,
+    at most ``limit`` messages are accepted per ``window`` seconds (rate
+    limit headers ``X-RateLimit-Remaining`` and
+    ``X-RateLimit-Reset-After``); other ones are rejected with a ``429``
+    reply and a ``Retry-After`` header. Usable as a context manager
+    (starts serving in a background thread, on a free port).
+
+    Args:
+        limit: The number of messages accepted per window.
+        window: The duration of a rate limit window, in seconds.
+
+    Attrs:
+        url (str): The webhook URL.
+        requests (int): Number of requests received.
+        rate_limited (int): Number of requests rejected (``429``).
+        contents (list[str]): The contents of the messages accepted.
+    """
+    daemon_threads = True
+    request_queue_size = 128            # Many concurrent connections
+    allow_reuse_address = True
+
+    def __init__(self, limit: int = 5, window: float = 2.0) -> None:
+        """Initializes self."""
+        super().__init__(("127.0.0.1", 0), _WebhookStubHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/webhook"
+        self.limit = limit
+        self.window = window
+        self.requests = 0
+        self.rate_limited = 0
+        self.contents: list[str] = []
+        self._window_start = 0.0
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "WebhookStub":
+        """Start serving."""
+        threading.Thread(target=self.serve_forever, name="webhook-stub",
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *_exc_info) -> None:
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
+
+    def accept(self, content: str) -> tuple[bool, int, float]:
+        """Apply the rate limit to a message (thread-safe).
+
+        Returns:
+            Whether the message is accepted, the remaining number of
+            messages in the window, and the delay before its end.
+        """
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            if now - self._window_start >= self.window:
+                self._window_start = now
+                self._window_count = 0
+            reset_after = self._window_start + self.window - now
+            if self._window_count >= self.limit:
+                self.rate_limited += 1
+                return False, 0, reset_after
+            self._window_count += 1
+            self.contents.append(content)
+            return True, self.limit - self._window_count, reset_after
+
+
+class _WebhookStubHandler(http.server.BaseHTTPRequestHandler):
+    # One request to WebhookStub
+    server: WebhookStub
+
+    def log_message(self, *_args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        content = json.loads(self.rfile.read(length))["content"]
+        accepted, remaining, reset_after = self.server.accept(content)
+        if accepted:
+            self.send_response(204)
+            self.send_header("X-RateLimit-Remaining", str(remaining))
+            self.send_header("X-RateLimit-Reset-After", f"{reset_after:.3f}")
+            self.end_headers()
+        else:
+            body = json.dumps({"retry_after": reset_after,
+                               "global": False}).encode()
+            self.send_response(429)
+            self.send_header("Retry-After", f"{reset_after:.3f}")
+            self.send_header("X-RateLimit-Remaining", "0")
+            self.send_header("X-RateLimit-Reset-After", f"{reset_after:.3f}")
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+def bench_discord(number: int, limit: int,
+                  window: float) -> typing.Iterator[str]:
+    """Compare Discord logging strategies against a local webhook stub.
+
+    Logs ``number`` records with one thread and request per record (the
+    previous strategy), then through a :class:`.loggers.DiscordHandler`,
+    and waits for them to be delivered.
+
+    Args:
+        number: The number of records to log with each strategy.
+        limit, window: The stub rate limit (see :class:`WebhookStub`).
+
+    Yields:
+        The lines of the results table.
+    """
+    # ! Keep import here to avoid circular import issues !
+    from app.tools.loggers import DiscordHandler
+
+    yield f"{number} records, rate limit {limit} messages / {window} s"
+    yield (f"{'Strategy':<30} {'emit (µs)':>10} {'time (s)':>9} "
+           f"{'records':>8} {'reqs':>6} {'429':>6}")
+    for name in ("thread + request per record", "queued shipper"):
+        with WebhookStub(limit, window) as stub:
+            logger = logging.Logger(f"bench-{name}")
+            if name == "queued shipper":
+                handler = DiscordHandler(stub.url, flush_delay=0.2)
+                logger.addHandler(handler)
+                log = logger.info
+            else:
+                threads = []
+                def log(msg: str) -> None:
+                    thread = threading.Thread(
+                        target=requests.post, args=(stub.url,),
+                        kwargs={"json": {"content": msg}, "timeout": 10},
+                    )
+                    thread.start()
+                    threads.append(thread)
+            start = time.perf_counter()
+            for i in range(number):
+                log(f"`rez{i}: Benchmark action {i}`")
+            emit = 1e6 * (time.perf_counter() - start) / number
+            if name == "queued shipper":
+                handler.flush(timeout=600)
+            else:
+                for thread in threads:
+                    thread.join()
+            duration = time.perf_counter() - start
+            records = sum(len(content.splitlines())
+                          for content in stub.contents)
+            yield (f"{name:<30} {emit:10.1f} {duration:9.3f} "
+                   f"{records:8d} {stub.requests:6d} "
+                   f"{stub.rate_limited:6d}")
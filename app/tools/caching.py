@@ -0,0 +1,89 @@
+"""Intranet de la Rez - Request-scoped Caching of Models Properties"""
+
+import functools
+
+import flask
+import sqlalchemy as sa
+
+from app.tools import typing
+
+
+_T = typing.TypeVar("_T")
+
+
+def cached(func: typing.Callable[[typing.Any], _T]
+           ) -> typing.Callable[[typing.Any], _T]:
+    """Decorator caching a model method result for the request duration.
+
+    The value is computed once per instance and per request, then stored
+    in ``flask.g`` until the end of the request or until invalidated (see
+    :func:`.invalidate` and :func:`.invalidate_on_change`). Outside of a
+    request context, the value is computed at each call.
+
+    Args:
+        func: The method computing the value (taking no argument).
+
+    Returns:
+        The caching method.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def getter(self) -> _T:
+        if not flask.has_request_context():
+            return func(self)
+        cache = flask.g.setdefault("_models_cache", {})
+        key = (self, name)      # Keeps a reference to self: key is unique
+        try:
+            return cache[key]
+        except KeyError:
+            value = cache[key] = func(self)
+            return value
+
+    return getter
+
+
+def request_cached(func: typing.Callable[[typing.Any], _T]) -> property:
+    """Decorator making a model method a request-cached property.
+
+    Shorthand for ``property(cached(func))``, see :func:`.cached`.
+
+    Args:
+        func: The method computing the property value.
+
+    Returns:
+        The property.
+    """
+    return property(cached(func))
+
+
+def invalidate(*_args, **_kwargs) -> None:
+    """Drop all values cached by :func:`.request_cached` properties.
+
+    Accepts (and ignores) any argument, so it can be used directly as
+    a SQLAlchemy event listener.
+    """
+    if flask.has_request_context():
+        flask.g.pop("_models_cache", None)
+
+
+def invalidate_on_change(*attributes: sa.orm.attributes.QueryableAttribute
+                         ) -> None:
+    """Invalidate cached properties when one of the given attributes change.
+
+    Columns changes are detected on set; relationships changes on set,
+    append or remove.
+
+    Args:
+        *attributes: The model attributes (e.g. ``Rental.end``) to watch.
+    """
+    for attribute in attributes:
+        sa.event.listen(attribute, "set", invalidate)
+        if getattr(attribute.property, "uselist", False):
+            sa.event.listen(attribute, "append", invalidate)
+            sa.event.listen(attribute, "remove", invalidate)
+
+
+# Any flush / rollback may change relationships and data in the session
+sa.event.listen(sa.orm.Session, "after_flush", invalidate)
+sa.event.listen(sa.orm.Session, "after_soft_rollback", invalidate)
@@ -3,6 +3,8 @@
 import flask
 import requests
 
+from app.tools import access_log
+
 
 def verify_captcha() -> bool:
     """Query Google reCAPTCHA v2 API to verify just posted captcha.
@@ -22,8 +24,9 @@ def verify_captcha() -> bool:
     verify_endpoint = "https://www.google.com/recaptcha/api/siteverify"
     secret = flask.current_app.config["GOOGLE_RECAPTCHA_SECRET"]
 
-    res = requests.post(verify_endpoint,
-                        data=dict(secret=secret, response=response))
+    with access_log.phase("http"):
+        res = requests.post(verify_endpoint,
+                            data=dict(secret=secret, response=response))
     if not res:
         return False
 
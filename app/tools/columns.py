@@ -25,6 +25,7 @@ def column(sa_type: sqlalchemy.types.TypeEngine[_Q],
            nullable: bool,
            default: _Q | None = None,
            unique: bool = False,
+           index: bool = False,
     ) -> Column: # [_Q]:
     ...
 @typing.overload        # Nullable column
@@ -32,28 +33,33 @@ def column(sa_type: sqlalchemy.types.TypeEngine[_Q],
            *,
            default: _Q | None = None,
            unique: bool = False,
+           index: bool = False,
     ) -> Column: # [_Q | None]:
     ...
 @typing.overload        # Non-nullable foreign column
 def column(sa_type: sqlalchemy.ForeignKey,
            *,
            nullable: bool,
+           index: bool = False,
     ) -> Column: # [typing.Any]:
     ...
 @typing.overload        # Nullable foreign column
-def column(sa_type: sqlalchemy.ForeignKey) -> Column: # [typing.Any]:
+def column(sa_type: sqlalchemy.ForeignKey,
+           *,
+           index: bool = False,
+    ) -> Column: # [typing.Any]:
     ...
 def column(sa_type, *, primary_key=False, nullable=False, default=None,
-           unique=False):
+           unique=False, index=False):
     """Constructs a SQLAlchemy column.
 
     Args:
         sa_type: The SQLAlchemy type of the column.
-        primary_key, nullable, default, unique: Passed to
+        primary_key, nullable, default, unique, index: Passed to
             :class:`sqlalchemy.Column`.
     """
     column = Column(sa_type, primary_key=primary_key, nullable=nullable,
-                    default=default, unique=unique)
+                    default=default, unique=unique, index=index)
     if isinstance(sa_type, sqlalchemy.ForeignKey):
         return typing.cast(Column # [object]
                            , column)
@@ -0,0 +1,644 @@
+"""Intranet de la Rez - Incremental DHCP Hosts File Generation
+
+The DHCP hosts file is made of one group of host rules per rezident
+currently renting a room. These groups are kept in an index (JSON file
+next to the hosts file), so a change affecting a rezident (device,
+rental or ban) only re-renders this rezident's rules; the hosts file is
+then rewritten only if its content actually changed.
+
+Routes do not regenerate the file themselves, but submit a job to the
+process :data:`.queue`: requests made within a short window are
+coalesced in a single regeneration, done by a background thread.
+
+With ``DHCP_BACKEND = "omapi"``, hosts changes are also applied on the
+running DHCP server through OMAPI (see :mod:`.tools.omapi`); if it
+succeeds, the hash of the new file is written in ``<file>.applied`` so
+the watcher (``watch_dhcp_hosts.py``) does not restart the server. The
+restart stays the fallback if the live update fails.
+
+The file format (ISC ``host`` declarations or Kea JSON reservations) is
+chosen by ``DHCP_FORMAT`` (see :mod:`.tools.dhcp_formats`). With
+``DHCP_BACKEND = "kea"``, the Kea server is asked to reload its
+configuration through its control socket (see :mod:`.tools.kea`) once
+the file is written, without losing leases; the watcher restart is also
+the fallback if the reload fails.
+
+Rules of a rezident whose rental or ban ended are re-rendered along the
+next change, or by :func:`refresh_obsolete`: run ``flask dhcp refresh``
+periodically (e.g. every 5 minutes by cron) so they expire on time.
+"""
+
+import atexit
+import base64
+import contextlib
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import flask
+import sqlalchemy as sa
+
+from app import IntraRezApp, db
+from app.models import Allocation, Rental, Rezident
+from app.tools import kea, nftables, omapi, typing
+from app.tools.dhcp_formats import get_format
+from app.tools.ip_pool import IPPoolExhausted, RoomPool
+
+
+_INDEX_VERSION = 3
+
+
+class HostsEntry(typing.TypedDict):
+    """Index entry: the rendered hosts of a rezident.
+
+    Attrs:
+        room: The number of the room rented by the rezident (used to
+            order hosts in the hosts file).
+        hosts: The ``[name, MAC address, IP]`` of the rezident devices
+            (rendered in the hosts file format, see
+            :mod:`.tools.dhcp_formats`).
+        rental_end: The end date of the rezident current rental (ISO
+            format), if any: the rules become obsolete at this date.
+        ban_end: The end time of the rezident current ban (ISO format,
+            naive UTC), if any: the rules become obsolete at this time.
+    """
+    room: int
+    hosts: list[list[str]]
+    rental_end: str | None
+    ban_end: str | None
+
+
+def hosts_file() -> str:
+    """The path of the DHCP hosts file (``DHCP_HOSTS_FILE`` config value).
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+    """
+    file = flask.current_app.config["DHCP_HOSTS_FILE"] or ""
+    if not os.path.isfile(file):
+        raise FileNotFoundError(f"Le ficher d'hôtes DHCP '{file}' n'existe "
+                                "pas (variable d'environment DHCP_HOSTS_FILE)")
+    return file
+
+
+@contextlib.contextmanager
+def _locked(file: str) -> typing.Iterator[None]:
+    # Exclusive lock on the hosts file generation (between processes)
+    with open(f"{file}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def load_current_rentals(rezident_ids: typing.Iterable[int] | None = None
+                          ) -> tuple[list[Rental], dict[tuple[int, int], str]]:
+    """Load everything needed to render DHCP rules, in bulk.
+
+    Current rentals are loaded with their room, rezident, rezident
+    devices and bans, and existing allocations of these devices, in a
+    constant number of queries (whatever the number of rentals).
+
+    Args:
+        rezident_ids: If set, only load the rentals of these rezidents.
+
+    Returns:
+        The current rentals (ordered by room), and the existing
+        allocations IPs mapped to ``(device ID, room number)``.
+    """
+    query = (
+        Rental.query.filter(Rental.is_current)
+        .options(
+            sa.orm.joinedload(Rental.room),
+            sa.orm.joinedload(Rental.rezident)
+            .selectinload(Rezident.devices),
+            sa.orm.joinedload(Rental.rezident)
+            .selectinload(Rezident.bans),
+        )
+        .order_by(Rental._room_num)
+    )
+    if rezident_ids is not None:
+        query = query.filter(Rental._rezident_id.in_(list(rezident_ids)))
+    rentals = query.all()
+    device_ids = [device.id for rental in rentals
+                  for device in rental.rezident.devices]
+    allocations = {}
+    if device_ids:
+        allocations = {
+            (device_id, room_num): ip
+            for device_id, room_num, ip in db.session.query(
+                Allocation._device_id, Allocation._room_num, Allocation.ip
+            ).filter(Allocation._device_id.in_(device_ids))
+        }
+    return rentals, allocations
+
+
+def render_rental(rental: Rental, allocations: dict[tuple[int, int], str],
+                  pools: dict[int, RoomPool] | None = None) -> HostsEntry:
+    """Render the DHCP rules of the devices of a room occupant.
+
+    IPs are allocated if necessary (see
+    :meth:`.models.Device.allocate_ip_for`), but not committed. Devices
+    that can not get an IP (room pool exhausted) are skipped. Bans are
+    ignored if enforced through nftables (see :mod:`.tools.nftables`).
+
+    Args:
+        rental: The current rental of the rezident to render rules for.
+        allocations: The existing allocations, as returned by
+            :func:`.load_current_rentals` (updated with new ones).
+        pools: The rooms IP pools already loaded (updated with new ones).
+
+    Returns:
+        The index entry of the rezident.
+    """
+    rezident = rental.rezident
+    room = rental.room
+    ignore_ban = nftables.enabled()     # Bans not enforced by DHCP rules
+    ban = None if ignore_ban else rezident.current_ban
+    hosts = []
+    for device in rezident.devices:
+        try:
+            ip = device.allocate_ip_for(room, allocations=allocations,
+                                        pools=pools, commit=False,
+                                        ignore_ban=ignore_ban)
+        except IPPoolExhausted as exc:
+            flask.current_app.logger.error(f"{device} not allocated: {exc}")
+            continue
+        name = f"{rezident.username}-{room.num}-{device.id}"
+        hosts.append([name, device.mac_address, ip])
+    return HostsEntry(
+        room=room.num,
+        hosts=hosts,
+        rental_end=rental.end.isoformat() if rental.end else None,
+        ban_end=ban.end.isoformat() if (ban and ban.end) else None,
+    )
+
+
+def render_entries(rezident_ids: typing.Iterable[int] | None = None
+                   ) -> dict[str, HostsEntry]:
+    """Render the index entries of current occupants.
+
+    New allocations are committed all at once.
+
+    Args:
+        rezident_ids: If set, only render the entries of these rezidents.
+
+    Returns:
+        The entries, mapped to rezidents IDs (as strings, JSON keys).
+    """
+    rentals, allocations = load_current_rentals(rezident_ids)
+    pools = {}
+    entries = {str(rental._rezident_id): render_rental(rental, allocations,
+                                                       pools)
+               for rental in rentals}
+    db.session.commit()
+    return entries
+
+
+def _is_obsolete(entry: HostsEntry) -> bool:
+    # Whether the entry rental or ban ended since its rendering
+    if entry["rental_end"] and (datetime.date.fromisoformat(
+        entry["rental_end"]) <= datetime.date.today()
+    ):
+        return True
+    if entry["ban_end"] and (datetime.datetime.fromisoformat(
+        entry["ban_end"]) <= datetime.datetime.utcnow()
+    ):
+        return True
+    return False
+
+
+def _load_index(file: str) -> dict[str, typing.Any] | None:
+    # Load the index of the hosts file, if it exists and is up to date
+    try:
+        with open(f"{file}.index.json") as fp:
+            index = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != _INDEX_VERSION:
+        return None
+    with open(file) as fp:
+        if _hash(fp.read()) != index.get("hash"):
+            # File modified by something else: index can not be trusted
+            return None
+    return index
+
+
+def hosts_diff(previous: dict[str, HostsEntry],
+               entries: dict[str, HostsEntry]
+               ) -> tuple[set[tuple[str, str, str]], set[tuple[str, str, str]]]:
+    """Compute the hosts changes between two versions of the index.
+
+    Args:
+        previous: The previous index entries.
+        entries: The new index entries.
+
+    Returns:
+        The ``(name, MAC address, IP)`` of the hosts to remove, and of
+        the hosts to add (a modified host is removed then added).
+    """
+    before = {tuple(host) for entry in previous.values()
+              for host in entry["hosts"]}
+    after = {tuple(host) for entry in entries.values()
+             for host in entry["hosts"]}
+    return before - after, after - before
+
+
+def apply_live(removed: set[tuple[str, str, str]],
+               added: set[tuple[str, str, str]]) -> bool:
+    """Apply hosts changes on the running DHCP server, through OMAPI.
+
+    Uses ``OMAPI_*`` application config values.
+
+    Args:
+        removed: The hosts to remove (see :func:`.hosts_diff`).
+        added: The hosts to add (see :func:`.hosts_diff`).
+
+    Returns:
+        Whether all changes were applied (if not, the server should be
+        restarted to load the new hosts file).
+    """
+    config = flask.current_app.config
+    key = config["OMAPI_KEY"]
+    client = omapi.Client(config["OMAPI_HOST"], config["OMAPI_PORT"],
+                          config["OMAPI_KEY_NAME"],
+                          base64.b64decode(key) if key else None)
+    try:
+        with client:
+            for name, _mac, _ip in removed:
+                client.delete_host(name)
+            for name, mac, ip in added:
+                client.add_host(name, mac, ip)
+    except omapi.OmapiError as exc:
+        flask.current_app.logger.warning(
+            f"DHCP live update failed, falling back to restart: {exc}"
+        )
+        return False
+    return True
+
+
+def reload_kea() -> bool:
+    """Make the Kea server reload its configuration (and the hosts file).
+
+    Uses the ``KEA_CONTROL_SOCKET`` application config value.
+
+    Returns:
+        Whether the reload succeeded (if not, the server should be
+        restarted to load the new hosts file).
+    """
+    client = kea.ControlClient(flask.current_app.config["KEA_CONTROL_SOCKET"])
+    try:
+        client.config_reload()
+    except kea.KeaError as exc:
+        flask.current_app.logger.warning(
+            f"Kea reload failed, falling back to restart: {exc}"
+        )
+        return False
+    return True
+
+
+def _write(file: str, entries: dict[str, HostsEntry],
+           previous_hash: str | None,
+           previous: dict[str, HostsEntry] | None = None) -> bool:
+    # Assemble and write the hosts file (if changed) and its index
+    ordered = sorted(entries.items(),
+                     key=lambda item: (item[1]["room"], int(item[0])))
+    content = get_format().render(tuple(host) for _, entry in ordered
+                                  for host in entry["hosts"])
+    content_hash = _hash(content)
+    changed = (content_hash != previous_hash)
+    if changed:
+        backend = flask.current_app.config["DHCP_BACKEND"]
+        applied = (backend == "kea") or (
+            backend == "omapi" and previous is not None
+            and apply_live(*hosts_diff(previous, entries))
+        )
+        if applied:
+            # Tell the watcher not to restart the server (written before
+            # the file, so it is up to date when notified)
+            with open(f"{file}.applied", "w") as fp:
+                fp.write(content_hash)
+        with open(file, "w") as fp:
+            fp.write(content)
+        if backend == "kea" and not reload_kea():
+            # Fallback: cancel the watcher skip and notify it again
+            os.remove(f"{file}.applied")
+            with open(file, "w") as fp:
+                fp.write(content)
+    index = {"version": _INDEX_VERSION, "hash": content_hash,
+             "hosts": entries}
+    with open(f"{file}.index.json.tmp", "w") as fp:
+        json.dump(index, fp)
+    os.replace(f"{file}.index.json.tmp", f"{file}.index.json")
+    return changed
+
+
+def _rebuild_locked(file: str) -> bool:
+    # Full rebuild, lock already acquired
+    index = _load_index(file)
+    entries = render_entries()
+    if index:
+        return _write(file, entries, index["hash"], index["hosts"])
+    previous_hash = None
+    with contextlib.suppress(OSError):
+        with open(file) as fp:
+            previous_hash = _hash(fp.read())
+    return _write(file, entries, previous_hash)
+
+
+def rebuild() -> bool:
+    """Re-render the rules of all current occupants.
+
+    Returns:
+        Whether the hosts file content changed.
+    """
+    file = hosts_file()
+    with _locked(file):
+        return _rebuild_locked(file)
+
+
+def refresh_rezidents(*rezidents: Rezident | int) -> bool:
+    """Re-render the rules of some rezidents only.
+
+    Rules of other rezidents whose rental or ban ended since they were
+    rendered are also refreshed. If the index is missing or does not
+    match the current hosts file, all rules are re-rendered
+    (see :func:`.rebuild`).
+
+    Args:
+        *rezidents: The rezidents (or their IDs) whose devices, rental
+            or ban changed.
+
+    Returns:
+        Whether the hosts file content changed.
+    """
+    file = hosts_file()
+    with _locked(file):
+        index = _load_index(file)
+        if index is None:
+            return _rebuild_locked(file)
+        previous: dict[str, HostsEntry] = index["hosts"]
+        entries = previous.copy()
+        ids = {rezident if isinstance(rezident, int) else rezident.id
+               for rezident in rezidents}
+        ids.update(int(id) for id, entry in entries.items()
+                   if _is_obsolete(entry))
+        for id in ids:
+            entries.pop(str(id), None)
+        entries.update(render_entries(ids))
+        return _write(file, entries, index["hash"], previous)
+
+
+def refresh_obsolete() -> bool:
+    """Re-render the rules of rezidents whose rental or ban ended.
+
+    See :func:`.refresh_rezidents` (called without rezidents).
+
+    Returns:
+        Whether the hosts file content changed.
+    """
+    return refresh_rezidents()
+
+
+class JobStatus(typing.TypedDict):
+    """Status of a regeneration job, as returned by :func:`.job_status`.
+
+    Attrs:
+        id: The job ID.
+        state: ``"pending"``, ``"running"``, ``"done"`` or ``"error"``.
+        submitted: The time the job was submitted (ISO format, naive UTC).
+        finished: The time the job was finished (ISO format, naive UTC),
+            if done / failed.
+        changed: Whether the regeneration changed the hosts file, if done.
+        error: A description of the error that occurred, if failed.
+    """
+    id: str
+    state: str
+    submitted: str
+    finished: str | None
+    changed: bool | None
+    error: str | None
+
+
+class RegenerationQueue:
+    """Coalescing queue of DHCP hosts file regeneration requests.
+
+    Requests (:meth:`submit`) are accumulated during ``delay`` seconds
+    after the first one, then processed all together in a single call to
+    :func:`.refresh_rezidents` by a background thread (started on first
+    request, so after workers fork).
+
+    Jobs status is stored in files (in ``DHCP_JOBS_DIR``), so that any
+    application process can answer a status request.
+
+    Args:
+        delay: The coalescing window, in seconds.
+
+    Attrs:
+        submitted (int): Number of jobs submitted.
+        regenerations (int): Number of regenerations done.
+    """
+    def __init__(self, delay: float = 1.0) -> None:
+        """Initializes self."""
+        self.delay = delay
+        self.submitted = 0
+        self.regenerations = 0
+        self.app: IntraRezApp | None = None
+        self._pending_ids: set[int] = set()
+        self._pending_jobs: list[JobStatus] = []
+        self._full = False
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __repr__(self) -> str:
+        """Returns repr(self)."""
+        return f"<RegenerationQueue ({len(self._pending_jobs)} pending)>"
+
+    def submit(self, *rezidents: Rezident) -> str:
+        """Request a regeneration of the DHCP rules of some rezidents.
+
+        Args:
+            *rezidents: The rezidents whose devices, rental or ban
+                changed. If none, all rules are regenerated.
+
+        Returns:
+            The job ID, to use with :func:`.job_status`. If the job can
+            not be submitted (hosts file missing...), the error is logged
+            and the job is marked failed.
+        """
+        job = JobStatus(
+            id=uuid.uuid4().hex,
+            state="pending",
+            submitted=datetime.datetime.utcnow().isoformat(),
+            finished=None, changed=None, error=None,
+        )
+        try:
+            hosts_file()
+            _save_job(job)
+        except OSError as exc:
+            # Do not fail the request (changes are already committed)
+            self.app.logger.error(f"DHCP regeneration not submitted: {exc}")
+            job.update(state="error",
+                       finished=datetime.datetime.utcnow().isoformat(),
+                       error=f"{type(exc).__name__}: {exc}")
+            with contextlib.suppress(OSError):
+                _save_job(job)
+            return job["id"]
+        with self._lock:
+            if rezidents:
+                self._pending_ids.update(rez.id for rez in rezidents)
+            else:
+                self._full = True
+            self._pending_jobs.append(job)
+            self.submitted += 1
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run,
+                                                name="dhcp-regeneration",
+                                                daemon=True)
+                self._thread.start()
+        self._event.set()
+        return job["id"]
+
+    def _run(self) -> None:
+        # Background thread main loop
+        while True:
+            self._event.wait()
+            time.sleep(self.delay)      # Wait for other requests
+            self.process()
+
+    def process(self) -> None:
+        """Process all pending requests at once (in the current thread)."""
+        with self._run_lock:
+            with self._lock:
+                self._event.clear()
+                ids, self._pending_ids = self._pending_ids, set()
+                jobs, self._pending_jobs = self._pending_jobs, []
+                full, self._full = self._full, False
+            if not jobs:
+                return
+            with self.app.app_context():
+                self._regenerate(jobs, ids, full)
+
+    def _regenerate(self, jobs: list[JobStatus], ids: set[int],
+                    full: bool) -> None:
+        # Regenerate rules and update jobs status (in app context)
+        for job in jobs:
+            job["state"] = "running"
+            _save_job(job)
+        try:
+            if full:
+                changed = rebuild()
+            else:
+                changed = refresh_rezidents(*ids)
+            if nftables.enabled():
+                nftables.sync()
+        except Exception as exc:
+            self.app.logger.error(
+                f"DHCP regeneration failed ({len(jobs)} jobs)", exc_info=exc
+            )
+            state, changed = "error", None
+            error = f"{type(exc).__name__}: {exc}"
+        else:
+            state, error = "done", None
+        finally:
+            # Do not keep objects loaded in this thread session
+            db.session.remove()
+        self.regenerations += 1
+        finished = datetime.datetime.utcnow().isoformat()
+        for job in jobs:
+            job.update(state=state, finished=finished, changed=changed,
+                       error=error)
+            _save_job(job)
+        clean_jobs()
+
+queue = RegenerationQueue()
+
+
+def _jobs_dir() -> str:
+    # Directory in which jobs status are stored
+    directory = flask.current_app.config["DHCP_JOBS_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _save_job(job: JobStatus) -> None:
+    # Write a job status (atomically)
+    file = os.path.join(_jobs_dir(), f"{job['id']}.json")
+    with open(f"{file}.tmp", "w") as fp:
+        json.dump(job, fp)
+    os.replace(f"{file}.tmp", file)
+
+
+def job_status(job_id: str) -> JobStatus | None:
+    """Get the status of a regeneration job.
+
+    Args:
+        job_id: The ID returned by :meth:`.RegenerationQueue.submit`.
+
+    Returns:
+        The job status, or ``None`` if the job is unknown (or too old).
+    """
+    if not job_id.isalnum():
+        return None
+    try:
+        with open(os.path.join(_jobs_dir(), f"{job_id}.json")) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def clean_jobs(max_age: float = 3600.0) -> int:
+    """Delete status files of old jobs.
+
+    Args:
+        max_age: The age (in seconds) after which a job file is deleted.
+
+    Returns:
+        The number of files deleted.
+    """
+    directory = _jobs_dir()
+    deleted = 0
+    limit = time.time() - max_age
+    for name in os.listdir(directory):
+        file = os.path.join(directory, name)
+        with contextlib.suppress(OSError):
+            if os.path.getmtime(file) < limit:
+                os.remove(file)
+                deleted += 1
+    return deleted
+
+
+def watcher_stats() -> dict[str, typing.Any] | None:
+    """Restart statistics of the DHCP hosts file watcher, if available.
+
+    See ``watch_dhcp_hosts.py`` (at repository root).
+    """
+    try:
+        with open(f"{hosts_file()}.watcher.json") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def init_app(app: IntraRezApp) -> None:
+    """Configure :data:`.queue` for an app.
+
+    Uses the ``DHCP_COALESCE_DELAY`` application config value (and
+    ``DHCP_JOBS_DIR`` for jobs status). Pending requests are processed at
+    exit.
+    """
+    queue.app = app
+    queue.delay = app.config["DHCP_COALESCE_DELAY"]
+    atexit.register(queue.process)
@@ -0,0 +1,101 @@
+"""Intranet de la Rez - DHCP Hosts File Output Formats
+
+A format renders the full content of the hosts file from the list of
+hosts ``(name, MAC address, IP)`` (see :mod:`.tools.dhcp`). The format
+used is chosen by the ``DHCP_FORMAT`` application config value.
+"""
+
+import json
+
+import flask
+
+from app.tools import typing
+
+
+Host = tuple[str, str, str]
+
+
+class HostsFormat:
+    """Base class of hosts file formats.
+
+    Attrs:
+        name (str): The name of the format (``DHCP_FORMAT`` value).
+    """
+    name = ""
+
+    def render(self, hosts: typing.Iterable[Host]) -> str:
+        """Render the hosts file content.
+
+        Args:
+            hosts: The ``(name, MAC address, IP)`` of the hosts, ordered.
+
+        Returns:
+            The file content.
+        """
+        raise NotImplementedError
+
+
+class IscFormat(HostsFormat):
+    """ISC DHCP server format: ``host`` declarations, included in
+    ``dhcpd.conf`` (``include "<file>";``)."""
+    name = "isc"
+
+    def header(self) -> str:
+        """The comment at the beginning of the file."""
+        return (
+            "# Ce fichier est généré automatiquement par l'IntraRez\n"
+            f"# ({__file__}).\n"
+            "# Ne PAS le modifier à la main, ce serait écrasé !\n#\n"
+            "#   * Pour ajouter un appareil à un Rezident,\n"
+            "#       - utiliser l'interface en ligne \n"
+            f"#         ({flask.url_for('gris.rezidents')})\n"
+            "#       - OU utiliser `flask shell` pour l'ajouter en base,\n"
+            "#         puis régénérer avec `flask script gen_dhcp.py`\n"
+            "#         (flask = /home/intrarez/intrarez/env/bin/flask)\n#\n"
+            "#   * Pour ajouter toute autre règle, modifier directement\n"
+            "#     /env/dhcp/dhcpd.conv\n#\n"
+        )
+
+    def render(self, hosts: typing.Iterable[Host]) -> str:
+        """Render the hosts file content (see :meth:`HostsFormat.render`)."""
+        return self.header() + "".join(
+            f"host {name} {{\n"
+            f"\thardware ethernet {mac};\n"
+            f"\tfixed-address {ip};\n"
+            "}\n"
+            for name, mac, ip in hosts
+        )
+
+
+class KeaFormat(HostsFormat):
+    """Kea DHCPv4 server format: JSON list of host reservations, included
+    in the subnet configuration of ``kea-dhcp4.conf``
+    (``"reservations": <?include "<file>"?>``)."""
+    name = "kea"
+
+    def render(self, hosts: typing.Iterable[Host]) -> str:
+        """Render the hosts file content (see :meth:`HostsFormat.render`)."""
+        reservations = [
+            {"hostname": name, "hw-address": mac, "ip-address": ip}
+            for name, mac, ip in hosts
+        ]
+        return json.dumps(reservations, indent=4) + "\n"
+
+
+formats: dict[str, HostsFormat] = {
+    fmt.name: fmt for fmt in (IscFormat(), KeaFormat())
+}
+
+
+def get_format() -> HostsFormat:
+    """The format to use (``DHCP_FORMAT`` application config value).
+
+    Raises:
+        ValueError: If the configured format does not exist.
+    """
+    name = flask.current_app.config["DHCP_FORMAT"]
+    try:
+        return formats[name]
+    except KeyError:
+        raise ValueError(f"Unknown DHCP_FORMAT '{name}' (should be one of "
+                         f"{', '.join(formats)})") from None
@@ -0,0 +1,161 @@
+"""Intranet de la Rez - Rooms IP Addresses Pools
+
+Each room owns 256 IP addresses ``10.<slot>.<room.base_ip>``, ``slot``
+being in ``0 – 255``. A :class:`RoomPool` tracks used slots in a bitmap
+(a 256-bit integer), so finding a free one takes constant time.
+
+Allocations of devices whose owner does not rent the room anymore are
+*stale*: their slots are reused when all other slots are taken.
+"""
+
+import sqlalchemy as sa
+
+from app import db
+from app.models import Allocation, Device, Rental, Room
+from app.tools import typing
+
+
+POOL_SIZE = 256
+
+
+class IPPoolExhausted(RuntimeError):
+    """No more IP address can be allocated in a room."""
+    pass
+
+
+def slot_of(ip: str) -> int | None:
+    """Get the slot of an allocated IP (its second byte).
+
+    Args:
+        ip: The IP, as ``"10.<slot>.x.y"``.
+
+    Returns:
+        The slot, or ``None`` if the IP is malformed.
+    """
+    try:
+        slot = int(ip.split(".")[1])
+    except (IndexError, ValueError):
+        return None
+    return slot if 0 <= slot < POOL_SIZE else None
+
+
+class RoomPool:
+    """The IP addresses pool of a room.
+
+    Args:
+        room: The room.
+        used: The used slots, mapped to the ID of the allocation using
+            them and whether this allocation is stale.
+
+    Attrs:
+        room (.models.Room): The room.
+        used (int): Bitmap of used slots (bit ``n`` set if slot ``n`` used).
+        stale (dict[int, int]): IDs of stale allocations, mapped to their
+            slot (oldest allocations first).
+    """
+    def __init__(self, room: Room,
+                 used: typing.Iterable[tuple[int, int, bool]] = ()) -> None:
+        """Initializes self."""
+        self.room = room
+        self.used = 0
+        self.stale: dict[int, int] = {}
+        for slot, allocation_id, stale in sorted(used, key=lambda u: u[1]):
+            self.used |= 1 << slot
+            if stale:
+                self.stale[allocation_id] = slot
+
+    def __repr__(self) -> str:
+        """Returns repr(self)."""
+        return (f"<RoomPool {self.room.num}: {self.used.bit_count()} used, "
+                f"{len(self.stale)} stale>")
+
+    @classmethod
+    def load(cls, room: Room) -> "RoomPool":
+        """Build the pool of a room from its existing allocations.
+
+        Args:
+            room: The room.
+
+        Returns:
+            The pool (built with a single query).
+        """
+        current_rezident = (
+            sa.select(Rental._rezident_id)
+            .where(Rental._room_num == room.num, Rental.is_current)
+            .scalar_subquery()
+        )
+        rows = db.session.query(
+            Allocation.id, Allocation.ip,
+            sa.func.coalesce(Device._rezident_id != current_rezident, True),
+        ).join(Allocation.device).filter(Allocation._room_num == room.num)
+        used = []
+        for allocation_id, ip, stale in rows:
+            slot = slot_of(ip)
+            if slot is not None:
+                used.append((slot, allocation_id, bool(stale)))
+        return cls(room, used)
+
+    def ip(self, slot: int) -> str:
+        """The IP address corresponding to a slot of this room."""
+        return f"10.{slot}.{self.room.base_ip}"
+
+    def take(self) -> tuple[int, int | None]:
+        """Reserve a slot: a free one, else the oldest stale one.
+
+        Returns:
+            The slot, and the ID of the stale allocation to delete
+            (``None`` if the slot was free).
+
+        Raises:
+            IPPoolExhausted: If all slots are used by non-stale allocations.
+        """
+        free = ~self.used & (self.used + 1)     # Lowest unset bit
+        slot = free.bit_length() - 1
+        if slot < POOL_SIZE:
+            self.used |= free
+            return slot, None
+        if self.stale:
+            allocation_id = next(iter(self.stale))
+            return self.stale.pop(allocation_id), allocation_id
+        raise IPPoolExhausted(
+            f"No more IP address available in {self.room} "
+            f"({POOL_SIZE} allocations to current occupant devices)"
+        )
+
+
+class Collision(typing.NamedTuple):
+    """IP address allocated several times (see :func:`check_allocations`).
+
+    Attrs:
+        ip: The IP address.
+        allocations: The allocations having this IP.
+    """
+    ip: str
+    allocations: list[Allocation]
+
+
+def check_allocations() -> tuple[list[Collision], list[Allocation]]:
+    """Scan the ``allocation`` table for inconsistencies.
+
+    Returns:
+        The IP addresses allocated more than once, and the allocations
+        whose IP does not belong to their room pool.
+    """
+    duplicated = (
+        db.session.query(Allocation.ip)
+        .group_by(Allocation.ip)
+        .having(sa.func.count(Allocation.id) > 1)
+    )
+    collisions: dict[str, list[Allocation]] = {}
+    for alloc in (Allocation.query.filter(Allocation.ip.in_(duplicated))
+                  .order_by(Allocation.ip, Allocation.id)):
+        collisions.setdefault(alloc.ip, []).append(alloc)
+
+    malformed = []
+    for alloc in Allocation.query.join(Allocation.room).order_by(Allocation.id):
+        slot = slot_of(alloc.ip)
+        if slot is None or alloc.ip != f"10.{slot}.{alloc.room.base_ip}":
+            malformed.append(alloc)
+
+    return ([Collision(ip, allocs) for ip, allocs in collisions.items()],
+            malformed)
@@ -0,0 +1,175 @@
+"""Intranet de la Rez - Kea DHCP Server Control Socket Client
+
+Kea servers accept JSON commands on a Unix socket (``control-socket`` in
+``kea-dhcp4.conf``). The IntraRez uses ``config-reload`` to make the
+server re-read its configuration (including the host reservations
+generated by :mod:`.tools.dhcp`) without restarting nor losing leases.
+
+:class:`FakeControlSocket` is a minimal stand-in for this socket, used to
+test the client (and the DHCP backend) offline.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import threading
+
+from app.tools import typing
+
+
+class KeaError(RuntimeError):
+    """A Kea command failed (connection error or error result)."""
+    pass
+
+
+class ControlClient:
+    """A client of a Kea server control socket.
+
+    Args:
+        path: The path of the Unix control socket.
+        timeout: Socket timeout, in seconds.
+    """
+    def __init__(self, path: str, timeout: float = 10.0) -> None:
+        """Initializes self."""
+        self.path = path
+        self.timeout = timeout
+
+    def command(self, command: str,
+                arguments: dict[str, typing.Any] | None = None
+                ) -> dict[str, typing.Any]:
+        """Send a command to the server.
+
+        Args:
+            command: The command name (e.g. ``"config-reload"``).
+            arguments: The command arguments, if any.
+
+        Returns:
+            The server response (``result`` is ``0``).
+
+        Raises:
+            KeaError: If the server could not be reached, or the command
+                failed.
+        """
+        request = {"command": command}
+        if arguments is not None:
+            request["arguments"] = arguments
+        data = b""
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+                sock.sendall(json.dumps(request).encode())
+                while True:
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        break
+                    data += chunk
+                    try:
+                        response = json.loads(data)
+                    except ValueError:
+                        continue        # Incomplete response
+                    break
+        except OSError as exc:
+            raise KeaError(f"Could not send '{command}' to {self.path}: "
+                           f"{exc}") from exc
+        try:
+            response = json.loads(data)
+        except ValueError:
+            raise KeaError(f"Invalid response to '{command}': "
+                           f"{data[:200]!r}") from None
+        if isinstance(response, list):      # Responses from several servers
+            response = response[0]
+        if response.get("result") != 0:
+            raise KeaError(f"'{command}' failed: {response.get('text')} "
+                           f"(result {response.get('result')})")
+        return response
+
+    def config_reload(self) -> dict[str, typing.Any]:
+        """Make the server reload its configuration.
+
+        Raises:
+            KeaError: If the reload failed.
+        """
+        return self.command("config-reload")
+
+
+class FakeControlSocket(socketserver.ThreadingUnixStreamServer):
+    """A minimal in-process Kea control socket, for offline tests.
+
+    Answers ``config-reload`` (checking that the reservations file, if
+    given, is a valid JSON list) and ``list-commands``. Usable as a
+    context manager (starts serving in a background thread).
+
+    Args:
+        path: The path of the Unix socket to create.
+        reservations_file: The file ``config-reload`` should check.
+
+    Attrs:
+        commands (list[dict]): The commands received.
+        reservations (list[dict]): The reservations loaded last.
+    """
+    daemon_threads = True
+
+    def __init__(self, path: str,
+                 reservations_file: str | None = None) -> None:
+        """Initializes self."""
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, _FakeControlHandler)
+        self.path = path
+        self.reservations_file = reservations_file
+        self.commands: list[dict[str, typing.Any]] = []
+        self.reservations: list[dict[str, typing.Any]] = []
+
+    def __enter__(self) -> "FakeControlSocket":
+        """Start serving."""
+        threading.Thread(target=self.serve_forever, name="fake-kea",
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *_exc_info) -> None:
+        """Stop serving and remove the socket."""
+        self.shutdown()
+        self.server_close()
+        os.remove(self.path)
+
+    def answer(self, request: dict[str, typing.Any]) -> dict[str, typing.Any]:
+        """Process a command and build the response."""
+        self.commands.append(request)
+        command = request.get("command")
+        if command == "list-commands":
+            return {"result": 0, "arguments": ["config-reload",
+                                               "list-commands"]}
+        if command != "config-reload":
+            return {"result": 2, "text": f"'{command}' command not supported."}
+        if self.reservations_file:
+            try:
+                with open(self.reservations_file) as fp:
+                    reservations = json.load(fp)
+                if not isinstance(reservations, list):
+                    raise ValueError("reservations should be a list")
+            except (OSError, ValueError) as exc:
+                return {"result": 1, "text": f"Config reload failed: {exc}"}
+            self.reservations = reservations
+        return {"result": 0, "text": "Configuration successful."}
+
+
+class _FakeControlHandler(socketserver.StreamRequestHandler):
+    # One command sent to FakeControlSocket
+    server: FakeControlSocket
+
+    def handle(self) -> None:
+        data = b""
+        while True:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return
+            data += chunk
+            try:
+                request = json.loads(data)
+            except ValueError:
+                continue
+            break
+        response = self.server.answer(request)
+        self.request.sendall(json.dumps(response).encode())
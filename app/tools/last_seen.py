@@ -0,0 +1,177 @@
+"""Intranet de la Rez - Write-behind Buffer for Devices Last Seen Times"""
+
+import atexit
+import datetime
+import threading
+import time
+
+import flask
+import sqlalchemy as sa
+
+from app import IntraRezApp, db
+
+
+class LastSeenBuffer:
+    """In-memory buffer of :attr:`.models.Device.last_seen` timestamps.
+
+    Timestamps are rounded down to ``precision`` seconds, and written in
+    a single bulk ``UPDATE`` at most once every ``flush_interval`` seconds
+    (and at exit), instead of one transaction per request. Flushes are
+    done after requests, and by a background thread (started on first
+    record, so after workers fork) so an idle process does not keep
+    timestamps indefinitely. Timestamps that could not be written are
+    kept for the next flush.
+
+    Args:
+        precision: The persisted precision of timestamps, in seconds.
+        flush_interval: The minimal delay between two flushes, in seconds.
+
+    Attrs:
+        recorded (int): Number of timestamps recorded (not ignored).
+        flushed (int): Number of timestamps written to the database.
+    """
+    def __init__(self, precision: float = 60.0,
+                 flush_interval: float = 30.0) -> None:
+        """Initializes self."""
+        self.precision = precision
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self.flushed = 0
+        self._pending: dict[int, datetime.datetime] = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self.app: IntraRezApp | None = None
+
+    def __repr__(self) -> str:
+        """Returns repr(self)."""
+        return f"<LastSeenBuffer ({len(self._pending)} pending)>"
+
+    def round(self, when: datetime.datetime) -> datetime.datetime:
+        """Round a timestamp down to the buffer precision.
+
+        Args:
+            when: The timestamp to round.
+
+        Returns:
+            The rounded timestamp.
+        """
+        seconds = (when - datetime.datetime.min).total_seconds()
+        return when - datetime.timedelta(seconds=seconds % self.precision)
+
+    def record(self, device_id: int, when: datetime.datetime,
+               current: datetime.datetime | None = None) -> None:
+        """Record that a device has been seen.
+
+        Args:
+            device_id: The ID of the :class:`~.models.Device` seen.
+            when: The (naive UTC) time the device was seen.
+            current: The device last seen time currently in database, if
+                known: nothing is recorded if it will not change.
+        """
+        when = self.round(when)
+        if current and current >= when:
+            return
+        with self._lock:
+            pending = self._pending.get(device_id)
+            if pending is None or pending < when:
+                self._pending[device_id] = when
+                self.recorded += 1
+            if self.app and not (self._thread and self._thread.is_alive()):
+                # First record / after fork
+                self._thread = threading.Thread(target=self._run,
+                                                name="last-seen-flusher",
+                                                daemon=True)
+                self._thread.start()
+
+    def _merge_back(self, pending: dict[int, datetime.datetime]) -> None:
+        # Put back timestamps not written (keeping the latest ones)
+        with self._lock:
+            for device_id, when in pending.items():
+                current = self._pending.get(device_id)
+                if current is None or current < when:
+                    self._pending[device_id] = when
+
+    def flush(self) -> int:
+        """Write pending timestamps to the database in a bulk ``UPDATE``.
+
+        Uses its own connection and transaction, so it does not commit
+        anything pending in the current session. Timestamps never move
+        backwards (another process may have written a later one).
+
+        Returns:
+            The number of timestamps written.
+
+        Raises:
+            sqlalchemy.exc.SQLAlchemyError: If the write failed (the
+                timestamps are kept for the next flush).
+        """
+        # ! Keep import here to avoid circular import issues !
+        from app.models import Device
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        table = Device.__table__
+        statement = (
+            sa.update(table)
+            .where(table.c.id == sa.bindparam("_id"))
+            .where(sa.or_(table.c.last_seen.is_(None),
+                          table.c.last_seen < sa.bindparam("_last_seen")))
+            .values(last_seen=sa.bindparam("_last_seen"))
+        )
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(statement, [
+                    {"_id": device_id, "_last_seen": when}
+                    for device_id, when in pending.items()
+                ])
+        except Exception:
+            self._merge_back(pending)
+            raise
+        self.flushed += len(pending)
+        return len(pending)
+
+    def flush_if_due(self, _exc: BaseException | None = None) -> None:
+        """Flush pending timestamps if the last flush is old enough.
+
+        Intended to be registered by :func:`teardown_request`: errors
+        are logged, not raised. Must be called in an application context.
+        """
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            try:
+                self.flush()
+            except Exception as exc:
+                flask.current_app.logger.error(
+                    "Last seen times flush failed", exc_info=exc
+                )
+
+    def _run(self) -> None:
+        # Background thread: flush periodically (idle process)
+        while True:
+            time.sleep(self.flush_interval)
+            with self.app.app_context():
+                self.flush_if_due()
+
+
+buffer = LastSeenBuffer()
+
+
+def init_app(app: IntraRezApp) -> None:
+    """Configure :data:`.buffer` and register its flushes for an app.
+
+    Uses ``LAST_SEEN_PRECISION`` and ``LAST_SEEN_FLUSH_INTERVAL``
+    application config values.
+    """
+    buffer.app = app
+    buffer.precision = app.config["LAST_SEEN_PRECISION"]
+    buffer.flush_interval = app.config["LAST_SEEN_FLUSH_INTERVAL"]
+    app.teardown_request(buffer.flush_if_due)
+
+    @atexit.register
+    def _flush_at_exit() -> None:
+        with app.app_context():
+            buffer.flush()
@@ -0,0 +1,265 @@
+"""Intranet de la Rez - DHCP Leases Ingestion
+
+The ISC DHCP server appends a ``lease`` block to its leases file
+(``DHCP_LEASES_FILE``, usually ``/var/lib/dhcp/dhcpd.leases``) each time a
+lease changes. :class:`LeasesIngester` reads this file incrementally
+(from the byte offset reached last, saved in ``LEASES_STATE_FILE`` with
+the file inode), and for the devices of the leases read:
+
+  * updates :attr:`.models.Device.last_seen` (client last transaction
+    time) through :data:`.tools.last_seen.buffer`, in a bulk ``UPDATE``;
+  * sets :attr:`.models.Device.online_until` to the lease end time if the
+    lease is active, to ``None`` if it was released / expired, also in a
+    bulk ``UPDATE``.
+
+The server periodically rewrites the whole file (new inode); it is then
+read from the beginning (it contains all current leases).
+
+Run by ``flask leases watch`` (supervisor task, see
+``.conf_models/supervisor.conf``), or once with ``flask leases ingest``.
+"""
+
+import datetime
+import json
+import os
+import re
+
+import flask
+import sqlalchemy as sa
+
+from app import db
+from app.models import Device
+from app.tools import typing
+from app.tools.last_seen import buffer as last_seen_buffer
+
+
+#: ``online_until`` of devices with an infinite lease (``ends never``).
+NEVER = datetime.datetime(9999, 12, 31)
+
+_TIME_RE = re.compile(
+    r"^(?:starts|ends|cltt) (?:\d (\d{4}/\d\d/\d\d \d\d:\d\d:\d\d)"
+    r"|epoch (\d+)|(never))"
+)
+
+
+class Lease(typing.NamedTuple):
+    """A lease read from the leases file.
+
+    Attrs:
+        ip: The IP leased.
+        mac: The client MAC address (lower case), if known.
+        state: The binding state (``"active"``, ``"free"``...).
+        starts: The lease start time (naive UTC), if known.
+        ends: The lease end time (naive UTC), ``None`` if never ends.
+        cltt: The client last transaction time (naive UTC), if known.
+    """
+    ip: str
+    mac: str | None
+    state: str | None
+    starts: datetime.datetime | None
+    ends: datetime.datetime | None
+    cltt: datetime.datetime | None
+
+    @property
+    def is_active(self) -> bool:
+        """Whether the lease is currently bound to its client."""
+        return self.state == "active" and (
+            self.ends is None or self.ends > datetime.datetime.utcnow()
+        )
+
+
+class IngestResult(typing.NamedTuple):
+    """Result of a leases ingestion (see :meth:`LeasesIngester.ingest`).
+
+    Attrs:
+        read: The number of bytes read.
+        leases: The number of lease blocks parsed.
+        devices: The number of registered devices updated.
+        online: The number of these devices with an active lease.
+        restarted: Whether the file was read from its beginning (new or
+            rewritten file).
+    """
+    read: int
+    leases: int
+    devices: int
+    online: int
+    restarted: bool
+
+
+def _parse_time(match: re.Match) -> datetime.datetime | None:
+    # Lease time statement (dhcpd writes UTC times, or epoch if local)
+    date, epoch, _never = match.groups()
+    if date:
+        return datetime.datetime.strptime(date, "%Y/%m/%d %H:%M:%S")
+    if epoch:
+        return datetime.datetime.utcfromtimestamp(int(epoch))
+    return None
+
+
+def parse_leases(data: bytes) -> tuple[list[Lease], int]:
+    """Parse the complete lease blocks of a leases file chunk.
+
+    Args:
+        data: The chunk read, starting at a top-level statement.
+
+    Returns:
+        The leases parsed (in file order), and the number of bytes
+        consumed: the chunk is only consumed up to the last complete
+        top-level statement or block (the file may be being written).
+    """
+    leases = []
+    consumed = position = depth = 0
+    current: dict[str, typing.Any] | None = None
+    for line in data.splitlines(keepends=True):
+        position += len(line)
+        if not line.endswith(b"\n"):
+            break                           # Incomplete line
+        text = line.decode(errors="replace").strip().rstrip(";")
+        if not text or text.startswith("#"):
+            if depth == 0:
+                consumed = position
+            continue
+        if text.endswith("{"):
+            if depth == 0 and text.startswith("lease "):
+                current = {"ip": text.split()[1], "mac": None, "state": None,
+                           "starts": None, "ends": None, "cltt": None}
+            depth += 1
+            continue
+        if text == "}":
+            depth -= 1
+            if depth == 0:
+                if current:
+                    leases.append(Lease(**current))
+                current = None
+                consumed = position
+            continue
+        if depth == 0:
+            consumed = position             # Top-level statement
+            continue
+        if current is None or depth != 1:
+            continue
+        key = text.split(" ", 1)[0]
+        if key in ("starts", "ends", "cltt"):
+            if match := _TIME_RE.match(text):
+                current[key] = _parse_time(match)
+        elif key == "binding":
+            current["state"] = text.rsplit(" ", 1)[-1]
+        elif key == "hardware":
+            current["mac"] = text.rsplit(" ", 1)[-1].lower()
+    return leases, consumed
+
+
+class LeasesIngester:
+    """Incremental reader of the DHCP server leases file.
+
+    Args:
+        file: The path of the leases file.
+        state_file: The path of the file in which the position reached
+            (inode and byte offset) is saved.
+
+    Attrs:
+        inode (int | None): The inode of the file being read.
+        offset (int): The byte offset reached in this file.
+    """
+    def __init__(self, file: str, state_file: str) -> None:
+        """Initializes self."""
+        self.file = file
+        self.state_file = state_file
+        self.inode: int | None = None
+        self.offset = 0
+        try:
+            with open(state_file) as fp:
+                state = json.load(fp)
+            self.inode, self.offset = state["inode"], state["offset"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def __repr__(self) -> str:
+        """Returns repr(self)."""
+        return f"<LeasesIngester ('{self.file}' at {self.offset})>"
+
+    def _save_state(self) -> None:
+        with open(f"{self.state_file}.tmp", "w") as fp:
+            json.dump({"inode": self.inode, "offset": self.offset}, fp)
+        os.replace(f"{self.state_file}.tmp", self.state_file)
+
+    def read(self) -> tuple[list[Lease], int, int, bool]:
+        """Read and parse the leases appended since the last read.
+
+        The position reached is neither kept nor saved (see
+        :meth:`ingest`): reading again reads the same leases.
+
+        Returns:
+            The new leases, the inode of the file and the byte offset
+            reached in it, and whether the file was read from its
+            beginning.
+        """
+        with open(self.file, "rb") as fp:
+            stat = os.fstat(fp.fileno())
+            offset = self.offset
+            restarted = (stat.st_ino != self.inode
+                         or stat.st_size < offset)
+            if restarted:
+                # New or rewritten file: read it all
+                offset = 0
+            fp.seek(offset)
+            data = fp.read()
+        leases, consumed = parse_leases(data)
+        return leases, stat.st_ino, offset + consumed, restarted
+
+    def ingest(self) -> IngestResult:
+        """Read the new leases and update the devices concerned.
+
+        The position reached is only kept and saved once the devices are
+        updated: if it fails, the same leases are read again next time.
+
+        Returns:
+            The ingestion result.
+        """
+        leases, inode, offset, restarted = self.read()
+        consumed = offset - (0 if restarted else self.offset)
+        latest = {lease.mac: lease for lease in leases if lease.mac}
+        online = 0
+        devices = {}
+        if latest:
+            devices = dict(
+                db.session.query(Device.mac_address, Device.id)
+                .filter(Device.mac_address.in_(list(latest)))
+            )
+        if devices:
+            table = Device.__table__
+            statement = (
+                sa.update(table)
+                .where(table.c.id == sa.bindparam("_id"))
+                .values(online_until=sa.bindparam("_until"))
+            )
+            params = []
+            for mac, device_id in devices.items():
+                lease = latest[mac]
+                seen = lease.cltt or lease.starts
+                if seen:
+                    last_seen_buffer.record(device_id, seen)
+                if lease.is_active:
+                    online += 1
+                    until = lease.ends or NEVER
+                else:
+                    until = None
+                params.append({"_id": device_id, "_until": until})
+            with db.engine.begin() as connection:
+                connection.execute(statement, params)
+            last_seen_buffer.flush()
+        self.inode, self.offset = inode, offset
+        self._save_state()
+        return IngestResult(consumed, len(leases), len(devices), online,
+                            restarted)
+
+
+def get_ingester() -> LeasesIngester:
+    """The ingester of the configured leases file.
+
+    Uses ``DHCP_LEASES_FILE`` and ``LEASES_STATE_FILE`` application config
+    values.
+    """
+    config = flask.current_app.config
+    return LeasesIngester(config["DHCP_LEASES_FILE"],
+                          config["LEASES_STATE_FILE"])
@@ -1,50 +1,396 @@
 """Intranet de la Rez - Custom Flask Loggers"""
 
+import atexit
+import copy
 import os
 import logging
-from logging import StreamHandler
+from logging.handlers import QueueHandler, QueueListener
 from logging.handlers import TimedRotatingFileHandler
+import queue
 import threading
+import time
 
 import flask
-from discord_webhook import DiscordWebhook
 import requests
 
 from app import IntraRezApp
-from app.tools import typing
+from app.tools import access_log
 
 
-def _execute_webhook(app: IntraRezApp,
-                     webhook: DiscordWebhook) -> None:
-    # To be called in a separate tread
-    with app.app_context():
-        response = webhook.execute()        # type: ignore
-        if not response:
-            app.logger.error(
-                f"ATTENTION : Échec lors de l'envoi du webhook {webhook.url} "
-                f"({webhook.content}): {response.code} {response.text}"
-            )
+# Discord limits message contents to 2000 characters
+DISCORD_MAX_LENGTH = 2000
 
 
-class DiscordHandler(StreamHandler):
-    """Logging handler using a webhook to send log to a Discord server
+def _request_origin() -> str:
+    # Remote IP and rezident name of the current request, if applicable
+    if not flask.has_app_context():
+        return "<unknown IP>"
+    try:
+        remote_ip = flask.g.remote_ip or "<missing header>"
+    except AttributeError:
+        return "<unknown IP>"
+    try:
+        if flask.g.logged_in:
+            remote_ip += f" / {flask.g.rezident.full_name[:25]}"
+    except AttributeError:
+        pass
+    return remote_ip
+
+
+def _request_user() -> str:
+    # Logged-in rezident and doaser names, if applicable
+    if not flask.has_app_context():
+        return "(before context)"
+    try:
+        if flask.g.logged_in:
+            user = flask.g.logged_in_user.username
+            if flask.g.doas:
+                user += f" AS {flask.g.rezident.username}"
+        else:
+            user = "(anonymous)"
+    except AttributeError:
+        user = "(before context)"
+    return user
+
+
+class _LogListener(QueueListener):
+    # The process log listener: records queued by BackgroundHandlers are
+    # passed to the handlers of the BackgroundHandler which queued them
+    def __init__(self) -> None:
+        super().__init__(queue.SimpleQueue(), respect_handler_level=True)
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def ensure_started(self) -> bool:
+        # Start the thread if not running (first record / after fork);
+        # returns False once stopped (at exit)
+        if self._stopped:
+            return False
+        if not (self._thread and self._thread.is_alive()):
+            with self._lock:
+                if not (self._thread and self._thread.is_alive()):
+                    self.start()
+        return True
+
+    def handle(self, record: logging.LogRecord) -> None:
+        for handler in record.__dict__.pop("_handlers"):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def stop(self) -> None:
+        # Process records queued, then stop the thread
+        self._stopped = True
+        if self._thread and self._thread.is_alive():
+            super().stop()
+
+
+_listener = _LogListener()
+atexit.register(_listener.stop)
+
+# Formats exceptions tracebacks of queued records
+_exc_formatter = logging.Formatter()
+
+
+class BackgroundHandler(QueueHandler):
+    """Logging handler passing records to other handlers in a thread.
+
+    Records are queued to a single listener thread per process (a
+    :class:`logging.handlers.QueueListener`, started on first record, so
+    after workers fork), which calls the handlers: disk writes, files
+    rotation or webhooks requests are not done by the thread logging.
+    Queued records are processed at exit.
+
+    Records are prepared in the logging thread: message and exception
+    traceback are formatted, and the current request origin and user
+    are stored (``request_origin`` and ``request_user`` attributes, used
+    by Discord formatters).
+
+    Args:
+        *handlers: The handlers to call in the listener thread.
+    """
+    def __init__(self, *handlers: logging.Handler) -> None:
+        """Initializes self."""
+        super().__init__(_listener.queue)
+        self.handlers = list(handlers)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Method called to prepare a record for queuing."""
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exc_formatter.formatException(
+                    record.exc_info
+                )
+            record.exc_info = None
+        record.request_origin = _request_origin()
+        record.request_user = _request_user()
+        record._handlers = self.handlers
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Method called to queue a record."""
+        if _listener.ensure_started():
+            super().enqueue(record)
+        else:       # Logged after listener stop (at exit): handle now
+            _listener.handle(record)
+
+
+def queue_handlers(logger: logging.Logger) -> None:
+    """Move the handlers of a logger behind a :class:`BackgroundHandler`.
+
+    Handlers already called in the background are left untouched.
+
+    Args:
+        logger: The logger to modify.
+    """
+    handlers = [handler for handler in logger.handlers
+                if not isinstance(handler, BackgroundHandler)]
+    if not handlers:
+        return
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(BackgroundHandler(*handlers))
+
+
+class _FlushMarker(logging.Handler):
+    # Handler of a marker record, signaling it was reached
+    def __init__(self) -> None:
+        super().__init__()
+        self.reached = threading.Event()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.reached.set()
+
+
+def flush_background(timeout: float | None = None) -> bool:
+    """Wait for records queued by :class:`BackgroundHandler` to be handled.
+
+    Args:
+        timeout: The maximal waiting time, in seconds (default: no limit).
+
+    Returns:
+        Whether all records queued were handled.
+    """
+    if not _listener.ensure_started():
+        return True             # Stopped: records handled directly
+    marker = _FlushMarker()
+    record = logging.LogRecord("flush", logging.INFO, "", 0, "", None, None)
+    record._handlers = [marker]
+    _listener.queue.put_nowait(record)
+    return marker.reached.wait(timeout)
+
+
+class DiscordHandler(logging.Handler):
+    """Logging handler using a webhook to send log to a Discord server.
+
+    Records are formatted when emitted (formatters use the request
+    context), then put in a bounded queue: when it is full, records are
+    dropped (and counted) instead of slowing down requests. A single
+    background thread ships them, gathering the records queued within
+    ``flush_delay`` seconds in multi-line messages (up to the 2000
+    characters Discord limit), and honours Discord rate limits
+    (``X-RateLimit-*`` headers, ``429`` replies ``Retry-After``). The
+    number of records lost is reported in the next message sent.
+
+    The thread is started on first record (so after workers fork).
+    :meth:`flush` (called with :meth:`close` by :func:`logging.shutdown`
+    at exit) waits for queued records to be sent.
 
     Args:
         webhook: Webhook URL to use
             (``"https://discord.com/api/webhooks/<server>/<id>"``)
+        queue_size: The maximal number of records waiting to be sent.
+        flush_delay: The delay during which records following a record
+            are gathered in the same message, in seconds.
+        drain_timeout: The maximal duration of :meth:`flush`, in seconds.
+        logger: The logger to which report delivery failures (these
+            records are never sent to Discord). Default: the root logger.
+
+    Attrs:
+        emitted (int): Number of records emitted.
+        dropped (int): Number of records dropped (queue full).
+        failed (int): Number of records that could not be delivered.
+        messages (int): Number of Discord messages sent.
+        rate_limited (int): Number of requests rejected by Discord rate
+            limits (``429``), then retried.
     """
-    def __init__(self, webhook: str) -> None:
+    max_attempts = 5
+    request_timeout = 10.0
+
+    def __init__(self, webhook: str, queue_size: int = 1000,
+                 flush_delay: float = 1.0, drain_timeout: float = 10.0,
+                 logger: logging.Logger | None = None) -> None:
         """Initializes self."""
         super().__init__()
         self.webhook = webhook
+        self.flush_delay = flush_delay
+        self.drain_timeout = drain_timeout
+        self.logger = logger or logging.getLogger()
+        self.emitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.messages = 0
+        self.rate_limited = 0
+        self._queue: queue.Queue[str] = queue.Queue(queue_size)
+        self._thread: threading.Thread | None = None
+        self._flushing = threading.Event()
+        self._carry: str | None = None
+        self._reported = 0
+        self._blocked_until = 0.0
+        self._session = requests.Session()
 
-    def emit(self, record: logging.LogRecord) -> requests.Response:
+    def __repr__(self) -> str:
+        """Returns repr(self)."""
+        return (f"<DiscordHandler ({self._queue.qsize()} queued, "
+                f"{self.messages} messages, {self.dropped} dropped, "
+                f"{self.failed} failed)>")
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        """Method called to make this handler process a record.
+
+        Ignores records of delivery failures.
+        """
+        if getattr(record, "discord_failure", False):
+            return False
+        return super().handle(record)
+
+    def emit(self, record: logging.LogRecord) -> None:
         """Method called to make this handler send a record."""
-        content = self.format(record)
-        webhook = DiscordWebhook(url=self.webhook, content=content)
-        # Send in a separate thread
-        app = typing.cast(IntraRezApp, flask.current_app._get_current_object())
-        threading.Thread(target=_execute_webhook, args=(app, webhook)).start()
+        try:
+            content = self.format(record)[:DISCORD_MAX_LENGTH]
+        except Exception:
+            self.handleError(record)
+            return
+        self.emitted += 1       # Serialized by Handler.handle lock
+        if not (self._thread and self._thread.is_alive()):
+            # First record / after fork
+            self._thread = threading.Thread(target=self._ship,
+                                            name="discord-shipper",
+                                            daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(content)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float | None = None) -> None:
+        """Wait for queued records to be sent.
+
+        Args:
+            timeout: The maximal waiting time, in seconds (default:
+                ``drain_timeout``).
+        """
+        if not (self._thread and self._thread.is_alive()):
+            return
+        if timeout is None:
+            timeout = self.drain_timeout
+        self._flushing.set()        # Do not wait for following records
+        try:
+            with self._queue.all_tasks_done:
+                self._queue.all_tasks_done.wait_for(
+                    lambda: not self._queue.unfinished_tasks, timeout
+                )
+        finally:
+            self._flushing.clear()
+
+    def close(self) -> None:
+        """Send queued records (see :meth:`flush`) and close the handler."""
+        self.flush()
+        super().close()
+
+    def _next_batch(self) -> list[str]:
+        # Wait for a record, then gather the records following it (while
+        # the message fits in Discord limit)
+        if self._carry is None:
+            batch = [self._queue.get()]
+        else:
+            batch, self._carry = [self._carry], None
+        length = len(batch[0])
+        deadline = time.monotonic() + self.flush_delay
+        while True:
+            if self._flushing.is_set():
+                timeout = 0.0
+            else:
+                timeout = deadline - time.monotonic()
+            try:
+                content = self._queue.get(timeout=max(timeout, 0.0))
+            except queue.Empty:
+                return batch
+            if length + 1 + len(content) > DISCORD_MAX_LENGTH:
+                self._carry = content       # First of next message
+                return batch
+            batch.append(content)
+            length += 1 + len(content)
+
+    def _wait_rate_limit(self) -> None:
+        # Sleep until Discord rate limit is reset, if exhausted
+        delay = self._blocked_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _update_rate_limit(self, response: requests.Response) -> None:
+        # Read Discord rate limit headers (in seconds)
+        try:
+            if response.status_code == 429:
+                self.rate_limited += 1
+                delay = float(response.headers.get("Retry-After")
+                              or response.json()["retry_after"])
+            elif response.headers.get("X-RateLimit-Remaining") == "0":
+                delay = float(response.headers["X-RateLimit-Reset-After"])
+            else:
+                return
+        except (KeyError, ValueError):
+            delay = 1.0
+        self._blocked_until = time.monotonic() + delay
+
+    def _post(self, content: str) -> str | None:
+        # Send a message to the webhook; returns the error if it failed
+        error = None
+        for attempt in range(self.max_attempts):
+            self._wait_rate_limit()
+            try:
+                response = self._session.post(
+                    self.webhook, json={"content": content},
+                    timeout=self.request_timeout,
+                )
+            except requests.RequestException as exc:
+                error = str(exc)
+            else:
+                self._update_rate_limit(response)
+                if response.ok:
+                    return None
+                error = f"{response.status_code} {response.text}"
+                if response.status_code == 429:
+                    continue            # Retry when allowed
+                if response.status_code < 500:
+                    return error        # Permanent error (bad request...)
+            time.sleep(2 ** attempt)
+        return error
+
+    def _ship(self) -> None:
+        # Background thread: send queued records forever
+        while True:
+            batch = self._next_batch()
+            content = "\n".join(batch)
+            lost = self.dropped + self.failed - self._reported
+            notice = f"*[{lost} messages de log perdus]*\n"
+            if lost and len(notice) + len(content) <= DISCORD_MAX_LENGTH:
+                content = notice + content
+                self._reported += lost
+            error = self._post(content)
+            if error:
+                self.failed += len(batch)
+                self.logger.error(
+                    f"ATTENTION : Échec lors de l'envoi du webhook "
+                    f"{self.webhook} ({len(batch)} messages) : {error}",
+                    extra={"discord_failure": True},
+                )
+            else:
+                self.messages += 1
+            for _ in batch:
+                self._queue.task_done()
 
 
 class InfoErrorFormatter(logging.Formatter):
@@ -104,17 +450,9 @@ class DiscordErrorFormatter(DiscordFormatter):
         Retrieves request IP and logged-in rezident name if applicable.
         """
         msg = super().format(record)
-        try:
-            remote_ip = flask.g.remote_ip or "<missing header>"
-        except AttributeError:
-            remote_ip = "<unknown IP>"
-        else:
-            try:
-                if flask.g.logged_in:
-                    remote_ip += f" / {flask.g.rezident.full_name[:25]}"
-            except AttributeError:
-                pass
-
+        remote_ip = getattr(record, "request_origin", None)
+        if remote_ip is None:       # Not prepared by BackgroundHandler
+            remote_ip = _request_origin()
         return (f"{self.role_mention}ALED ça a planté ! (chez {remote_ip})\n"
                 f"```{msg}```")
 
@@ -128,15 +466,9 @@ class DiscordLoggingFormatter(DiscordFormatter):
         Retrieves logged-in rezident and doaser names if applicable.
         """
         msg = super().format(record)
-        try:
-            if flask.g.logged_in:
-                user = flask.g.logged_in_user.username
-                if flask.g.doas:
-                    user += f" AS {flask.g.rezident.username}"
-            else:
-                user = "(anonymous)"
-        except AttributeError:
-            user = "(before context)"
+        user = getattr(record, "request_user", None)
+        if user is None:            # Not prepared by BackgroundHandler
+            user = _request_user()
         if record.levelno > logging.INFO:
             return f"`{user}: {record.levelname}: {msg}` ({self.role_mention})"
         else:
@@ -149,11 +481,24 @@ def configure_logging(app: IntraRezApp) -> None:
     Setup :attr:`app.logger <flask.Flask.logger>` to log errors to
     ``app.config["ERROR_WEBHOOK"]`` Discord webhook and everything to a
     journalized file, and adds a child logger  ``app.actions_logger``
-    ("app.actions") logging actions to ``app.config["LOGGING_WEBHOOK"]``.
+    ("app.actions") logging actions to ``app.config["LOGGING_WEBHOOK"]``,
+    and a child logger ``app.access_logger`` ("app.access") logging
+    requests served (JSON entries, see :mod:`.access_log`) to another
+    journalized file only.
+
+    Discord handlers (see :class:`.DiscordHandler`) use
+    ``app.config["DISCORD_QUEUE_SIZE"]`` and
+    ``app.config["DISCORD_FLUSH_DELAY"]``. All handlers are called in
+    the background (see :func:`queue_handlers`).
     """
     if app.config["ERROR_WEBHOOK"] and not (app.debug or app.testing):
         # Alert messages for errors
-        discord_errors_handler = DiscordHandler(app.config["ERROR_WEBHOOK"])
+        discord_errors_handler = DiscordHandler(
+            app.config["ERROR_WEBHOOK"],
+            queue_size=app.config["DISCORD_QUEUE_SIZE"],
+            flush_delay=app.config["DISCORD_FLUSH_DELAY"],
+            logger=app.logger,
+        )
         discord_errors_handler.setLevel(logging.ERROR)
         discord_errors_handler.setFormatter(DiscordErrorFormatter(
             app.config.get("GRI_ROLE_ID")
@@ -162,7 +507,12 @@ def configure_logging(app: IntraRezApp) -> None:
 
     if app.config["LOGGING_WEBHOOK"]:
         # Logging messages for actions
-        discord_actions_handler = DiscordHandler(app.config["LOGGING_WEBHOOK"])
+        discord_actions_handler = DiscordHandler(
+            app.config["LOGGING_WEBHOOK"],
+            queue_size=app.config["DISCORD_QUEUE_SIZE"],
+            flush_delay=app.config["DISCORD_FLUSH_DELAY"],
+            logger=app.logger,
+        )
         discord_actions_handler.setLevel(logging.DEBUG if app.debug
                                          else logging.INFO)
         discord_actions_handler.setFormatter(DiscordLoggingFormatter(
@@ -182,6 +532,19 @@ def configure_logging(app: IntraRezApp) -> None:
     file_handler.setLevel(logging.INFO)
     app.logger.addHandler(file_handler)
 
+    # Access logging
+    access_handler = TimedRotatingFileHandler(access_log.ACCESS_LOG_FILE,
+                                              when="D")
+    access_handler.setFormatter(logging.Formatter("{message}", style="{"))
+    app.access_logger.addHandler(access_handler)
+    app.access_logger.propagate = False
+
+    # Do not write / send logs in requests threads
+    queue_handlers(app.logger)
+    queue_handlers(app.actions_logger)
+    queue_handlers(app.access_logger)
+
     # Start logs
     app.logger.setLevel(logging.INFO)
     app.actions_logger.setLevel(logging.INFO)
+    app.access_logger.setLevel(logging.INFO)
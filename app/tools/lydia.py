@@ -10,6 +10,7 @@ import requests
 from app import db
 from app.enums import PaymentStatus
 from app.models import Rezident, Payment, Offer
+from app.tools import access_log
 
 
 def get_payment_url(rezident: Rezident, offer: Offer,
@@ -69,34 +70,36 @@ def create_payment(rezident: Rezident, offer: Offer, phone: str | None) -> str:
     db.session.add(payment)
     db.session.commit()
 
-    rep = requests.post(
-        flask.current_app.config["LYDIA_BASE_URL"] + "/api/request/do.json",
-        data={
-            "vendor_token": flask.current_app.config["LYDIA_VENDOR_TOKEN"],
-            "amount": format(float(offer.price), ".2f"),
-            "currency": "EUR",
-            "recipient": (phone or rezident.email
-                          or f"{rezident.username}@no-email.org"),
-            "type": "phone" if phone else "email",
-            "payment_method": "lydia" if phone else "cb",
-            "order_ref": payment.id,
-            "message": _("Offre Internet à la Rez :") + f" {offer.name}",
-            "notify_collector": "no",
-            "confirm_url": flask.url_for("payments.lydia_callback_confirm",
-                                         _external=True),
-            "cancel_url": flask.url_for("payments.lydia_callback_cancel",
-                                        _external=True),
-            "display_confirmation": "no",
-            "expire_url": flask.url_for("payments.lydia_callback_cancel",
-                                        _external=True),
-            "end_mobile_url": flask.url_for("payments.lydia_success",
+    with access_log.phase("http"):
+        rep = requests.post(
+            flask.current_app.config["LYDIA_BASE_URL"]
+            + "/api/request/do.json",
+            data={
+                "vendor_token": flask.current_app.config["LYDIA_VENDOR_TOKEN"],
+                "amount": format(float(offer.price), ".2f"),
+                "currency": "EUR",
+                "recipient": (phone or rezident.email
+                              or f"{rezident.username}@no-email.org"),
+                "type": "phone" if phone else "email",
+                "payment_method": "lydia" if phone else "cb",
+                "order_ref": payment.id,
+                "message": _("Offre Internet à la Rez :") + f" {offer.name}",
+                "notify_collector": "no",
+                "confirm_url": flask.url_for("payments.lydia_callback_confirm",
+                                             _external=True),
+                "cancel_url": flask.url_for("payments.lydia_callback_cancel",
                                             _external=True),
-            "browser_success_url": flask.url_for("payments.lydia_success",
-                                                 _external=True),
-            "browser_fail_url": flask.url_for("payments.lydia_fail",
-                                              _external=True),
-        },
-    )
+                "display_confirmation": "no",
+                "expire_url": flask.url_for("payments.lydia_callback_cancel",
+                                            _external=True),
+                "end_mobile_url": flask.url_for("payments.lydia_success",
+                                                _external=True),
+                "browser_success_url": flask.url_for("payments.lydia_success",
+                                                     _external=True),
+                "browser_fail_url": flask.url_for("payments.lydia_fail",
+                                                  _external=True),
+            },
+        )
 
     if rep and rep.json().get("error") == "0":
         # Payment request created
@@ -122,13 +125,15 @@ def update_payment(payment: Payment) -> None:
     Args:
         payment: The payment to update status of. ``lydia_uuid`` must be set.
     """
-    rep = requests.post(
-        flask.current_app.config["LYDIA_BASE_URL"] + "/api/request/state.json",
-        data={
-            "request_uuid": payment.lydia_uuid,
-            "vendor_token": flask.current_app.config["LYDIA_VENDOR_TOKEN"],
-        },
-    )
+    with access_log.phase("http"):
+        rep = requests.post(
+            flask.current_app.config["LYDIA_BASE_URL"]
+            + "/api/request/state.json",
+            data={
+                "request_uuid": payment.lydia_uuid,
+                "vendor_token": flask.current_app.config["LYDIA_VENDOR_TOKEN"],
+            },
+        )
     if not rep or "error" in rep.json():
         raise RuntimeError(
             f"Lydia Request Check Failed: {rep.request.body} >>> {rep.text}"
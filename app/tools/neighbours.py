@@ -0,0 +1,492 @@
+"""Intranet de la Rez - Neighbour (ARP) Table Resolution"""
+
+from __future__ import annotations
+
+import collections
+import errno
+import logging
+import socket
+import struct
+import threading
+import time
+
+import flask
+
+from app.tools import typing
+
+
+class ArpCache:
+    """In-process cache of the kernel ARP table, mapping IPs to MACs.
+
+    The table is read directly from ``/proc/net/arp`` (no subprocess),
+    and refreshed when older than ``ttl`` seconds or when an unknown IP
+    is looked up (at most once every ``miss_refresh_delay`` seconds, so
+    external requests cannot make us re-read the table each time).
+
+    Args:
+        path: The ARP table file to read.
+        ttl: Maximal age of the cached table, in seconds.
+        miss_refresh_delay: Minimal delay between two refreshes
+            triggered by a lookup miss, in seconds.
+
+    Attrs:
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that found no MAC address.
+        refreshes (int): Number of times the table was (re)read.
+    """
+    def __init__(self, path: str = "/proc/net/arp", ttl: float = 30.0,
+                 miss_refresh_delay: float = 1.0) -> None:
+        """Initializes self."""
+        self.path = path
+        self.ttl = ttl
+        self.miss_refresh_delay = miss_refresh_delay
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._table: dict[str, str] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        """Returns repr(self)."""
+        return (f"<ArpCache '{self.path}' ({len(self._table)} entries, "
+                f"{self.hits} hits / {self.misses} misses)>")
+
+    @staticmethod
+    def parse(content: str) -> dict[str, str]:
+        """Parse the content of a ``/proc/net/arp``-like file.
+
+        Incomplete entries (flags ``0x0`` / null MAC address) are ignored.
+
+        Args:
+            content: The file content, header line included.
+
+        Returns:
+            The IP -> MAC address (lowercase) mapping.
+        """
+        table = {}
+        for line in content.splitlines()[1:]:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            ip, _hw_type, flags, mac = fields[:4]
+            if flags == "0x0" or mac == "00:00:00:00:00:00":
+                continue
+            table[ip] = mac.lower()
+        return table
+
+    def refresh(self) -> None:
+        """(Re)load the ARP table from :attr:`path`."""
+        with self._lock:
+            try:
+                with open(self.path, "r") as fp:
+                    content = fp.read()
+            except OSError:
+                content = ""
+            self._table = self.parse(content)
+            self._loaded_at = time.monotonic()
+            self.refreshes += 1
+
+    def get(self, ip: str) -> str | None:
+        """Get the MAC address associated to an IP address.
+
+        Args:
+            ip: The IP address to look for.
+
+        Returns:
+            The corresponding MAC address, or ``None`` if not in the table.
+        """
+        if time.monotonic() - self._loaded_at > self.ttl:
+            self.refresh()
+        mac = self._table.get(ip)
+        if (mac is None
+            and time.monotonic() - self._loaded_at > self.miss_refresh_delay):
+            # Unknown IP may be a new neighbour: reload table
+            self.refresh()
+            mac = self._table.get(ip)
+        if mac is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return mac
+
+    def stats(self) -> dict[str, typing.Any]:
+        """Counters describing the cache usage since its creation."""
+        return {
+            "entries": len(self._table),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+        }
+
+
+class NeighbourEvent(typing.NamedTuple):
+    """A change in the kernel neighbour table.
+
+    Attrs:
+        kind: ``"new"`` if the entry was added / updated, ``"del"`` if it
+            was removed or is no longer valid.
+        ip: The neighbour IP address.
+        mac: The neighbour MAC address (lowercase), or ``None`` if unknown.
+    """
+    kind: typing.Literal["new", "del"]
+    ip: str
+    mac: str | None
+
+
+# rtnetlink constants (see linux/rtnetlink.h and linux/neighbour.h)
+RTMGRP_NEIGH = 0x4
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+NDA_DST = 1
+NDA_LLADDR = 2
+NUD_INCOMPLETE = 0x01
+NUD_FAILED = 0x20
+
+_NLMSGHDR = struct.Struct("=IHHII")         # len, type, flags, seq, pid
+_NDMSG = struct.Struct("=BBHiHBB")          # family, pads, ifindex, state...
+_RTATTR = struct.Struct("=HH")              # len, type
+
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def decode_neighbour_messages(data: bytes) -> list[NeighbourEvent]:
+    """Decode rtnetlink neighbour messages.
+
+    Messages other than IPv4 ``RTM_NEWNEIGH`` / ``RTM_DELNEIGH`` are
+    ignored. New entries in an incomplete or failed state are reported
+    as deletions, as they do not give a usable MAC address.
+
+    Args:
+        data: The raw data received on a ``NETLINK_ROUTE`` socket,
+            possibly containing several messages.
+
+    Returns:
+        The neighbour events described by the messages.
+    """
+    events = []
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        msg_len, msg_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+        if msg_len < _NLMSGHDR.size:
+            break
+        end = offset + msg_len
+        body = offset + _NLMSGHDR.size
+        if (msg_type in (RTM_NEWNEIGH, RTM_DELNEIGH)
+            and body + _NDMSG.size <= end):
+            family, _, _, _, state, _, _ = _NDMSG.unpack_from(data, body)
+            ip = mac = None
+            attr = body + _NDMSG.size
+            while attr + _RTATTR.size <= end:
+                attr_len, attr_type = _RTATTR.unpack_from(data, attr)
+                if attr_len < _RTATTR.size:
+                    break
+                value = data[attr + _RTATTR.size:attr + attr_len]
+                if attr_type == NDA_DST and len(value) == 4:
+                    ip = socket.inet_ntoa(value)
+                elif attr_type == NDA_LLADDR and len(value) == 6:
+                    mac = ":".join(f"{byte:02x}" for byte in value)
+                attr += _align(attr_len)
+            if family == socket.AF_INET and ip:
+                if (msg_type == RTM_DELNEIGH or not mac
+                    or state & (NUD_INCOMPLETE | NUD_FAILED)):
+                    events.append(NeighbourEvent("del", ip, mac))
+                else:
+                    events.append(NeighbourEvent("new", ip, mac))
+        offset += _align(msg_len)
+    return events
+
+
+def encode_neighbour_message(event: NeighbourEvent) -> bytes:
+    """Build the rtnetlink message the kernel would send for an event.
+
+    Inverse of :func:`.decode_neighbour_messages`, used to replay events.
+
+    Args:
+        event: The neighbour event to encode.
+
+    Returns:
+        The raw netlink message.
+    """
+    attrs = b""
+    for attr_type, value in (
+        (NDA_DST, socket.inet_aton(event.ip)),
+        (NDA_LLADDR, bytes.fromhex(event.mac.replace(":", ""))
+                     if event.mac else b""),
+    ):
+        if not value:
+            continue
+        attr_len = _RTATTR.size + len(value)
+        attrs += _RTATTR.pack(attr_len, attr_type) + value
+        attrs += b"\0" * (_align(attr_len) - attr_len)
+    msg_type = RTM_NEWNEIGH if event.kind == "new" else RTM_DELNEIGH
+    state = 0x02 if event.kind == "new" else NUD_FAILED     # REACHABLE
+    body = _NDMSG.pack(socket.AF_INET, 0, 0, 0, state, 0, 0) + attrs
+    return _NLMSGHDR.pack(_NLMSGHDR.size + len(body), msg_type, 0, 0, 0) + body
+
+
+class NetlinkNeighbourSource:
+    """Source of neighbour events, subscribed to the kernel rtnetlink
+    ``RTMGRP_NEIGH`` multicast group.
+
+    Iterating over it blocks until events are received, until
+    :meth:`close` is called.
+    """
+    close_check_interval = 0.5
+
+    def __init__(self) -> None:
+        """Initializes self (opens and binds the netlink socket)."""
+        self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                     socket.NETLINK_ROUTE)
+        self._socket.bind((0, RTMGRP_NEIGH))
+        # Closing the socket does not interrupt a blocking recv
+        self._socket.settimeout(self.close_check_interval)
+        self._closed = False
+
+    def __iter__(self) -> typing.Iterator[NeighbourEvent]:
+        """Yield neighbour events as they are received.
+
+        Raises:
+            OSError: If receiving failed, e.g. ``ENOBUFS`` if events were
+                lost (receive buffer overrun during a burst): the socket
+                can then be iterated again.
+        """
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except socket.timeout:
+                if self._closed:
+                    return
+                continue
+            except OSError:
+                if self._closed:
+                    return
+                raise
+            if not data:
+                return
+            yield from decode_neighbour_messages(data)
+
+    def close(self) -> None:
+        """Stop listening to events."""
+        self._closed = True
+        self._socket.close()
+
+
+class ReplayNeighbourSource:
+    """Fake neighbour events source, replaying a predefined sequence.
+
+    Events are encoded as netlink messages and decoded back when iterated,
+    so replaying them exercises the same path as real kernel messages.
+    Exceptions in the sequence are raised instead (e.g. an ``ENOBUFS``
+    :class:`OSError`, like a receive buffer overrun); as with the netlink
+    source, iterating again resumes after them.
+
+    Args:
+        events: The events (or exceptions) to replay, in order.
+        delay: Time to wait before each event, in seconds.
+    """
+    def __init__(self, events: typing.Iterable[NeighbourEvent | OSError],
+                 delay: float = 0.0) -> None:
+        """Initializes self."""
+        self.messages = collections.deque(
+            event if isinstance(event, OSError)
+            else encode_neighbour_message(event) for event in events
+        )
+        self.delay = delay
+        self._closed = threading.Event()
+
+    @classmethod
+    def from_file(cls, path: str, delay: float = 0.0) -> ReplayNeighbourSource:
+        """Build a source replaying events described in a text file.
+
+        Each non-empty line must be of form ``<new|del> <ip> [<mac>]``
+        (e.g. ``new 10.0.1.1 01:23:45:67:89:ab``); ``#`` begins a comment.
+
+        Args:
+            path: The file to read events from.
+            delay: Passed to the constructor.
+        """
+        events = []
+        with open(path, "r") as fp:
+            for line in fp:
+                fields = line.split("#")[0].split()
+                if not fields:
+                    continue
+                kind, ip, *mac = fields
+                events.append(NeighbourEvent(kind, ip, mac[0] if mac else None))
+        return cls(events, delay=delay)
+
+    def __iter__(self) -> typing.Iterator[NeighbourEvent]:
+        """Yield replayed events, until exhausted or :meth:`close` called."""
+        while self.messages:
+            if self._closed.wait(self.delay):
+                return
+            message = self.messages.popleft()
+            if isinstance(message, OSError):
+                raise message
+            yield from decode_neighbour_messages(message)
+
+    def close(self) -> None:
+        """Stop replaying events."""
+        self._closed.set()
+
+
+class NeighbourTable:
+    """Live copy of the kernel neighbour table, kept up to date by a
+    background thread consuming neighbour events.
+
+    Lookups are plain dictionary accesses: the kernel table is never
+    read on the hot path. The table is primed from the ARP table file
+    once the events source is opened, so existing neighbours are known,
+    and primed again if events were lost (``ENOBUFS``). If the source
+    fails otherwise, lookups fall back to an :class:`.ArpCache`.
+
+    Args:
+        source: The neighbour events source to consume.
+        arp_file: The ARP table file to prime the table from, or ``None``
+            to start empty.
+        logger: The logger to which report source errors. Default: the
+            root logger.
+
+    Attrs:
+        hits (int): Number of lookups that found a MAC address.
+        misses (int): Number of lookups that found no MAC address.
+        events (collections.Counter): Number of events processed, by kind.
+        resyncs (int): Number of times the table was primed again after
+            events were lost.
+        fallback (ArpCache | None): The cache answering lookups since the
+            source failed, if it did.
+    """
+    def __init__(self, source: NetlinkNeighbourSource | ReplayNeighbourSource,
+                 arp_file: str | None = "/proc/net/arp",
+                 logger: logging.Logger | None = None) -> None:
+        """Initializes self."""
+        self.source = source
+        self.arp_file = arp_file
+        self.logger = logger or logging.getLogger()
+        self.hits = 0
+        self.misses = 0
+        self.events = collections.Counter()
+        self.resyncs = 0
+        self.fallback: ArpCache | None = None
+        self._table: dict[str, str] = {}
+        self._thread: threading.Thread | None = None
+
+    def __repr__(self) -> str:
+        """Returns repr(self)."""
+        return (f"<NeighbourTable ({len(self._table)} entries, "
+                f"{self.hits} hits / {self.misses} misses)>")
+
+    def prime(self) -> None:
+        """Replace the table content with the ARP table file one."""
+        if self.arp_file:
+            try:
+                with open(self.arp_file, "r") as fp:
+                    self._table = ArpCache.parse(fp.read())
+            except OSError:
+                pass
+
+    def start(self) -> None:
+        """Prime the table and start consuming events in a daemon thread."""
+        self.prime()
+        self._thread = threading.Thread(target=self.run, daemon=True,
+                                        name="neighbour-table")
+        self._thread.start()
+
+    def run(self) -> None:
+        """Consume events from :attr:`source` until it is exhausted."""
+        while True:
+            try:
+                for event in self.source:
+                    self.apply(event)
+                return
+            except OSError as exc:
+                if exc.errno != errno.ENOBUFS:
+                    self.logger.error(f"Neighbour events source failed, "
+                                      f"falling back to ARP cache: {exc}")
+                    self.fallback = ArpCache(self.arp_file or "/proc/net/arp")
+                    return
+            # Events lost (burst): table may be stale
+            self.resyncs += 1
+            self.prime()
+
+    def apply(self, event: NeighbourEvent) -> None:
+        """Update the table according to a neighbour event.
+
+        Args:
+            event: The event to apply.
+        """
+        self.events[event.kind] += 1
+        if event.kind == "new" and event.mac:
+            self._table[event.ip] = event.mac
+        elif not event.mac or self._table.get(event.ip) == event.mac:
+            self._table.pop(event.ip, None)
+
+    def stop(self) -> None:
+        """Stop consuming events and wait for the thread to terminate."""
+        self.source.close()
+        if self._thread:
+            self._thread.join(timeout=1)
+
+    def get(self, ip: str) -> str | None:
+        """Get the MAC address associated to an IP address.
+
+        Args:
+            ip: The IP address to look for.
+
+        Returns:
+            The corresponding MAC address, or ``None`` if not in the table.
+        """
+        if self.fallback:
+            mac = self.fallback.get(ip)
+        else:
+            mac = self._table.get(ip)
+        if mac is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return mac
+
+    def stats(self) -> dict[str, typing.Any]:
+        """Counters describing the table usage since its creation."""
+        return {
+            "entries": len(self._table),
+            "hits": self.hits,
+            "misses": self.misses,
+            "new_events": self.events["new"],
+            "del_events": self.events["del"],
+            "resyncs": self.resyncs,
+            "fallback": self.fallback is not None,
+        }
+
+
+_resolver: ArpCache | NeighbourTable | None = None
+_resolver_lock = threading.Lock()
+
+
+def resolver() -> ArpCache | NeighbourTable:
+    """Get the process-wide MAC addresses resolver, creating it if necessary.
+
+    Depending on the ``NEIGHBOUR_SOURCE`` application config value, this
+    is either an :class:`.ArpCache` (``"arp"``) or a :class:`NeighbourTable`
+    listening to rtnetlink events (``"netlink"``). Uses ``ARP_TABLE_FILE``
+    and ``ARP_CACHE_TTL`` config values.
+    """
+    global _resolver
+    if _resolver is not None:
+        return _resolver
+    with _resolver_lock:
+        if _resolver is None:       # Not created by another thread meanwhile
+            config = flask.current_app.config
+            if config["NEIGHBOUR_SOURCE"] == "netlink":
+                table = NeighbourTable(NetlinkNeighbourSource(),
+                                       arp_file=config["ARP_TABLE_FILE"],
+                                       logger=flask.current_app.logger)
+                table.start()
+                _resolver = table
+            else:
+                _resolver = ArpCache(config["ARP_TABLE_FILE"],
+                                     ttl=config["ARP_CACHE_TTL"])
+    return _resolver
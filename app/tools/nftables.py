@@ -0,0 +1,257 @@
+"""Intranet de la Rez - Bans Enforcement through nftables
+
+The MAC addresses of the devices of banned rezidents are kept in an
+nftables set (``NFT_SET``, in table ``NFT_TABLE``), updated atomically
+through ``nft -f``: a ban takes effect immediately, without changing the
+DHCP rules (so without restarting the DHCP server).
+
+The gateway ruleset must use this set, e.g.::
+
+    table inet intrarez {
+        set banned_macs { type ether_addr; }
+        chain forward {
+            type filter hook forward priority 0;
+            ether saddr @banned_macs tcp dport { 80, 443 } redirect ...
+            ether saddr @banned_macs drop
+        }
+    }
+
+Each synchronisation compares the banned MAC addresses with the live
+set content (``nft -j list set``), so only the elements that changed are
+added / deleted. As sets are not persistent (reboot, firewall reload,
+manual flush...), the table and set are always created if needed, and
+the whole set is rewritten if an incremental update fails. The content
+applied last is also stored in ``NFT_STATE_FILE``, used when the live
+set can not be read (``--output`` without root privileges, ``nft``
+unavailable...); synchronisations are serialized by a lock on this file.
+It is done after each DHCP regeneration job (see :mod:`.tools.dhcp`),
+and should also be done periodically to lift ended bans (``flask bans
+sync`` in a cron job, e.g. every minute: nothing is applied if the live
+set is up to date).
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import subprocess
+
+import flask
+
+from app import db
+from app.models import Device, Rezident
+from app.tools import typing
+
+
+class SyncResult(typing.NamedTuple):
+    """Result of a bans synchronisation (see :func:`sync`).
+
+    Attrs:
+        script: The ``nft`` script (empty if nothing to do).
+        added: The MAC addresses added to the set.
+        removed: The MAC addresses removed from the set.
+        full: Whether the set was entirely rewritten (unknown state).
+    """
+    script: str
+    added: set[str]
+    removed: set[str]
+    full: bool
+
+
+def normalize_mac(mac: str) -> str:
+    """Normalize a MAC address in nftables ``ether_addr`` format.
+
+    Args:
+        mac: The MAC address (``xx:xx:xx:xx:xx:xx``, ``xx-xx-...`` or
+            ``xxxxxxxxxxxx``, any case).
+
+    Returns:
+        The MAC address as ``xx:xx:xx:xx:xx:xx`` (lower case).
+    """
+    digits = mac.lower().replace(":", "").replace("-", "")
+    return ":".join(digits[i:i+2] for i in range(0, len(digits), 2))
+
+
+def banned_macs() -> set[str]:
+    """The MAC addresses of the devices of currently banned rezidents."""
+    query = (db.session.query(Device.mac_address)
+             .join(Device.rezident).filter(Rezident.is_banned))
+    return {normalize_mac(mac) for (mac,) in query}
+
+
+def _elements(macs: set[str]) -> str:
+    return "{ " + ", ".join(sorted(macs)) + " }"
+
+
+def render_script(added: set[str], removed: set[str], *,
+                  full: bool = False) -> str:
+    """Render the ``nft -f`` script updating the set.
+
+    The script is applied as a single transaction by nftables.
+
+    Args:
+        added: The MAC addresses to add to the set.
+        removed: The MAC addresses to remove from the set.
+        full: If ``True``, flush the set before adding elements
+            (``removed`` is ignored).
+
+    Returns:
+        The script (empty if nothing to do).
+    """
+    config = flask.current_app.config
+    target = f"{config['NFT_TABLE']} {config['NFT_SET']}"
+    lines = []
+    if full:
+        lines.append(f"flush set {target}")
+    elif removed:
+        lines.append(f"delete element {target} {_elements(removed)}")
+    if added:
+        lines.append(f"add element {target} {_elements(added)}")
+    if not lines:
+        return ""
+    # Table and set lost since last sync (no-ops if they exist)
+    return (f"add table {config['NFT_TABLE']}\n"
+            f"add set {target} {{ type ether_addr; }}\n"
+            + "".join(f"{line}\n" for line in lines))
+
+
+def live_set() -> set[str] | None:
+    """The MAC addresses currently in the kernel set (``nft -j list set``).
+
+    Returns:
+        The set content (empty if the table or set does not exist), or
+        ``None`` if it could not be read (``nft`` unavailable, not
+        permitted, unexpected output...).
+    """
+    config = flask.current_app.config
+    try:
+        process = subprocess.run(
+            [config["NFT_COMMAND"], "-j", "list", "set",
+             *config["NFT_TABLE"].split(), config["NFT_SET"]],
+            text=True, capture_output=True,
+        )
+    except OSError:
+        return None
+    if process.returncode:
+        if "No such file or directory" in process.stderr:
+            return set()        # Table / set lost (created by next script)
+        return None
+    try:
+        for item in json.loads(process.stdout)["nftables"]:
+            if "set" in item:
+                return {normalize_mac(elem) for elem
+                        in item["set"].get("elem", [])}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+    return None
+
+
+def _load_state(file: str) -> set[str] | None:
+    # Set content applied last, if known
+    try:
+        with open(file) as fp:
+            return set(json.load(fp))
+    except (OSError, ValueError):
+        return None
+
+
+def _save_state(file: str, macs: set[str]) -> None:
+    with open(f"{file}.tmp", "w") as fp:
+        json.dump(sorted(macs), fp)
+    os.replace(f"{file}.tmp", file)
+
+
+@contextlib.contextmanager
+def _locked(file: str) -> typing.Iterator[None]:
+    # Exclusive lock on the set synchronisation (between processes)
+    with open(f"{file}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def sync(*, dry_run: bool = False, output: str | None = None,
+         full: bool = False) -> SyncResult:
+    """Synchronize the nftables set with the ``Ban`` table.
+
+    Changes are computed against the live set (see :func:`live_set`),
+    or the state saved by the last synchronisation if it can not be
+    read (always the case with ``output``).
+
+    Args:
+        dry_run: If ``True``, only compute the script (nothing applied,
+            state not saved).
+        output: If set, write the script to this file instead of
+            applying it with ``nft`` (the state is saved, as if the file
+            was then applied: the caller is responsible for it). Allows
+            to use this without root privileges.
+        full: If ``True``, rewrite the whole set even if its content is
+            known (it is always the case if it is not, or if applying
+            the changes only fails).
+
+    Returns:
+        The synchronisation result.
+
+    Raises:
+        subprocess.CalledProcessError: If ``nft`` fails to rewrite the
+            whole set (state not saved).
+    """
+    config = flask.current_app.config
+    state_file = config["NFT_STATE_FILE"]
+    with _locked(state_file):
+        current = banned_macs()
+        previous = None
+        if not full:
+            saved = _load_state(state_file)
+            previous = None if output else live_set()
+            if previous is None:
+                previous = saved
+            elif saved is not None and previous != saved:
+                flask.current_app.logger.warning(
+                    "nftables: set out of sync with the last applied "
+                    "state (reboot, firewall reload...), resynchronizing"
+                )
+        if previous is None:
+            added, removed, full = current, set(), True
+        else:
+            added, removed = current - previous, previous - current
+        script = render_script(added, removed, full=full)
+        result = SyncResult(script, added, removed, full)
+        if dry_run:
+            return result
+        if not script:
+            _save_state(state_file, current)
+            return result
+
+        if output:
+            with open(output, "w") as fp:
+                fp.write(script)
+        else:
+            try:
+                _apply(script)
+            except subprocess.CalledProcessError as exc:
+                if full:
+                    raise
+                # Set changed meanwhile (manual update...): rewrite it
+                flask.current_app.logger.warning(
+                    f"nftables: incremental update failed "
+                    f"({exc.stderr.strip()}), rewriting the whole set"
+                )
+                script = render_script(current, set(), full=True)
+                result = SyncResult(script, current, set(), True)
+                _apply(script)
+        _save_state(state_file, current)
+    return result
+
+
+def _apply(script: str) -> None:
+    # Apply a script with nft (single transaction)
+    subprocess.run([flask.current_app.config["NFT_COMMAND"], "-f", "-"],
+                   input=script, text=True, check=True, capture_output=True)
+
+
+def enabled() -> bool:
+    """Whether bans are enforced through nftables (``BAN_BACKEND``)."""
+    return flask.current_app.config["BAN_BACKEND"] == "nftables"
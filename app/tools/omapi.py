@@ -0,0 +1,419 @@
+"""Intranet de la Rez - Minimal OMAPI Client (ISC DHCP live host updates)
+
+OMAPI is the ISC DHCP server (``dhcpd``) control protocol: it allows to
+create and delete ``host`` objects on the running server, without
+restarting it. Only what the IntraRez needs is implemented: connection
+startup, HMAC-MD5 authentication, host creation, lookup and deletion.
+
+:class:`FakeServer` is a minimal in-process OMAPI server, keeping hosts in
+memory, used to test the client (and the DHCP backend) offline.
+
+Wire format (all integers are big-endian ``uint32`` unless stated):
+
+    * Startup: both sides send ``protocol version (100), header size (24)``;
+    * Message: ``authid, authlen, opcode, handle, tid, rid``, then message
+      and object dictionaries (entries ``uint16 key length, key, value
+      length, value``, terminated by a ``uint16`` 0), then the signature
+      (``authlen`` bytes, HMAC-MD5 of the message without ``authid``).
+"""
+
+import hashlib
+import hmac
+import random
+import socket
+import socketserver
+import struct
+import threading
+
+from app.tools import typing
+
+
+PROTOCOL_VERSION = 100
+HEADER_SIZE = 24
+HMAC_MD5 = b"hmac-md5.SIG-ALG.REG.INT."
+
+OP_OPEN = 1
+OP_REFRESH = 2
+OP_UPDATE = 3
+OP_NOTIFY = 4
+OP_STATUS = 5
+OP_DELETE = 6
+
+
+class OmapiError(RuntimeError):
+    """An OMAPI request failed (connection error or error status)."""
+    pass
+
+
+def _int(value: int) -> bytes:
+    return struct.pack("!I", value)
+
+
+class Message(typing.NamedTuple):
+    """An OMAPI message.
+
+    Attrs:
+        opcode: The operation (``OP_*`` constants).
+        handle: The handle of the object concerned (``0`` if none).
+        tid: The transaction ID.
+        rid: The ID of the transaction this message answers (``0`` if
+            it is not an answer).
+        message: The message dictionary (raw values).
+        obj: The object dictionary (raw values).
+        authid: The authenticator handle (``0`` if not signed).
+        signature: The signature (empty if not signed).
+    """
+    opcode: int
+    handle: int = 0
+    tid: int = 0
+    rid: int = 0
+    message: dict[bytes, bytes] = {}
+    obj: dict[bytes, bytes] = {}
+    authid: int = 0
+    signature: bytes = b""
+
+    @staticmethod
+    def _dict(values: dict[bytes, bytes]) -> bytes:
+        data = b"".join(struct.pack("!H", len(key)) + key
+                        + _int(len(value)) + value
+                        for key, value in values.items())
+        return data + struct.pack("!H", 0)
+
+    def signed_part(self, authlen: int) -> bytes:
+        """The part of the serialized message covered by the signature."""
+        return (_int(authlen) + _int(self.opcode) + _int(self.handle)
+                + _int(self.tid) + _int(self.rid)
+                + self._dict(self.message) + self._dict(self.obj))
+
+    def sign(self, authid: int, key: bytes) -> "Message":
+        """Return a copy of this message signed with a HMAC-MD5 key."""
+        signature = hmac.new(key, self.signed_part(16), hashlib.md5).digest()
+        return self._replace(authid=authid, signature=signature)
+
+    def check_signature(self, key: bytes) -> bool:
+        """Whether this message is correctly signed with a HMAC-MD5 key."""
+        expected = hmac.new(key, self.signed_part(len(self.signature)),
+                            hashlib.md5).digest()
+        return hmac.compare_digest(expected, self.signature)
+
+    def serialize(self) -> bytes:
+        """The message, as sent on the wire."""
+        return (_int(self.authid) + self.signed_part(len(self.signature))
+                + self.signature)
+
+    @classmethod
+    def receive(cls, sock: socket.socket) -> "Message":
+        """Read a message from a socket.
+
+        Raises:
+            OmapiError: If the connection was closed.
+        """
+        authid, authlen, opcode, handle, tid, rid = struct.unpack(
+            "!6I", _recv_exactly(sock, HEADER_SIZE)
+        )
+        message = _recv_dict(sock)
+        obj = _recv_dict(sock)
+        signature = _recv_exactly(sock, authlen)
+        return cls(opcode, handle, tid, rid, message, obj, authid, signature)
+
+    def error(self) -> str | None:
+        """The error described by this message, if it is an error status."""
+        if self.opcode != OP_STATUS:
+            return None
+        result = struct.unpack("!I", self.message.get(b"result",
+                                                      _int(0)))[0]
+        if not result:
+            return None
+        text = self.message.get(b"message", b"").decode(errors="replace")
+        return f"{text or 'error'} (result {result})"
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise OmapiError("Connection closed by peer")
+        data += chunk
+    return data
+
+
+def _recv_dict(sock: socket.socket) -> dict[bytes, bytes]:
+    values = {}
+    while True:
+        (key_length,) = struct.unpack("!H", _recv_exactly(sock, 2))
+        if not key_length:
+            return values
+        key = _recv_exactly(sock, key_length)
+        (value_length,) = struct.unpack("!I", _recv_exactly(sock, 4))
+        values[key] = _recv_exactly(sock, value_length)
+
+
+def _mac_bytes(mac: str) -> bytes:
+    return bytes.fromhex(mac.replace(":", "").replace("-", ""))
+
+
+class Client:
+    """A connection to an OMAPI server.
+
+    Usable as a context manager (connects and closes the connection).
+
+    Args:
+        host: The server host.
+        port: The server OMAPI port (``omapi-port`` in ``dhcpd.conf``).
+        key_name: The name of the OMAPI key (``omapi-key``), if any.
+        key: The secret of this key (raw bytes, i.e. base64-decoded).
+        timeout: Sockets timeout, in seconds.
+    """
+    def __init__(self, host: str, port: int, key_name: str | None = None,
+                 key: bytes | None = None, timeout: float = 5.0) -> None:
+        """Initializes self."""
+        self.host = host
+        self.port = port
+        self.key_name = key_name
+        self.key = key
+        self.timeout = timeout
+        self._sock: socket.socket | None = None
+        self._authid = 0
+
+    def __enter__(self) -> "Client":
+        """Connect to the server."""
+        self.connect()
+        return self
+
+    def __exit__(self, *_exc_info) -> None:
+        """Close the connection."""
+        self.close()
+
+    def connect(self) -> None:
+        """Connect to the server (startup and authentication).
+
+        Raises:
+            OmapiError: If the connection or authentication failed.
+        """
+        try:
+            self._sock = socket.create_connection((self.host, self.port),
+                                                  timeout=self.timeout)
+            self._sock.sendall(_int(PROTOCOL_VERSION) + _int(HEADER_SIZE))
+            version, header_size = struct.unpack(
+                "!2I", _recv_exactly(self._sock, 8)
+            )
+        except OSError as exc:
+            raise OmapiError(f"Could not connect to {self.host}:{self.port}: "
+                             f"{exc}") from exc
+        if (version, header_size) != (PROTOCOL_VERSION, HEADER_SIZE):
+            raise OmapiError(f"Unsupported OMAPI protocol ({version}, "
+                             f"header size {header_size})")
+        if self.key_name and self.key:
+            response = self._query(Message(
+                OP_OPEN, message={b"type": b"authenticator"},
+                obj={b"name": self.key_name.encode(), b"algorithm": HMAC_MD5},
+            ))
+            if response.opcode != OP_UPDATE:
+                raise OmapiError(f"Authentication failed: {response.error()}")
+            self._authid = response.handle
+
+    def close(self) -> None:
+        """Close the connection."""
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+            self._authid = 0
+
+    def _query(self, message: Message) -> Message:
+        # Send a message and return the answer to it
+        if not self._sock:
+            raise OmapiError("Not connected")
+        message = message._replace(tid=random.getrandbits(32))
+        if self._authid:
+            message = message.sign(self._authid, self.key)
+        try:
+            self._sock.sendall(message.serialize())
+            while True:
+                response = Message.receive(self._sock)
+                if response.rid == message.tid:
+                    break
+        except OSError as exc:
+            raise OmapiError(f"Connection error: {exc}") from exc
+        if self._authid and not response.check_signature(self.key):
+            raise OmapiError("Invalid response signature")
+        return response
+
+    def add_host(self, name: str, mac: str, ip: str) -> None:
+        """Create a host object on the server.
+
+        Args:
+            name: The host name (must not already exist).
+            mac: The host MAC address.
+            ip: The fixed address to give this host.
+
+        Raises:
+            OmapiError: If the host could not be created.
+        """
+        response = self._query(Message(
+            OP_OPEN,
+            message={b"type": b"host", b"create": _int(1),
+                     b"exclusive": _int(1)},
+            obj={b"name": name.encode(), b"hardware-address": _mac_bytes(mac),
+                 b"hardware-type": _int(1), b"ip-address": socket.inet_aton(ip)},
+        ))
+        if response.opcode != OP_UPDATE:
+            raise OmapiError(f"Could not add host {name}: {response.error()}")
+
+    def lookup_host(self, name: str) -> int | None:
+        """Look for a host object on the server.
+
+        Args:
+            name: The host name.
+
+        Returns:
+            The host handle, or ``None`` if it does not exist.
+        """
+        response = self._query(Message(
+            OP_OPEN, message={b"type": b"host"}, obj={b"name": name.encode()},
+        ))
+        if response.opcode != OP_UPDATE:
+            return None
+        return response.handle
+
+    def delete_host(self, name: str) -> bool:
+        """Delete a host object from the server.
+
+        Args:
+            name: The host name.
+
+        Returns:
+            Whether the host existed.
+
+        Raises:
+            OmapiError: If the host could not be deleted.
+        """
+        handle = self.lookup_host(name)
+        if handle is None:
+            return False
+        response = self._query(Message(OP_DELETE, handle=handle))
+        if response.opcode != OP_STATUS or response.error():
+            raise OmapiError(f"Could not delete host {name}: "
+                             f"{response.error()}")
+        return True
+
+
+class FakeServer(socketserver.ThreadingTCPServer):
+    """A minimal in-process OMAPI server, for offline tests.
+
+    Hosts are kept in :attr:`hosts`; requests are served by a background
+    thread, started by :meth:`start`. Usable as a context manager.
+
+    Args:
+        key_name, key: The key clients must authenticate with, if any.
+        port: The port to listen to on ``127.0.0.1`` (``0``: random).
+
+    Attrs:
+        hosts (dict[str, tuple[str, str]]): MAC addresses and IPs of
+            hosts, mapped to their names.
+        requests (int): Number of messages received.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, key_name: str | None = None, key: bytes | None = None,
+                 port: int = 0) -> None:
+        """Initializes self."""
+        super().__init__(("127.0.0.1", port), _FakeServerHandler)
+        self.key_name = key_name
+        self.key = key
+        self.hosts: dict[str, tuple[str, str]] = {}
+        self.requests = 0
+        self._handles: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def port(self) -> int:
+        """The port the server listens to."""
+        return self.server_address[1]
+
+    def start(self) -> None:
+        """Serve requests in a background thread."""
+        threading.Thread(target=self.serve_forever, name="fake-omapi",
+                         daemon=True).start()
+
+    def __enter__(self) -> "FakeServer":
+        """Start serving."""
+        self.start()
+        return self
+
+    def __exit__(self, *_exc_info) -> None:
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
+
+    def answer(self, request: Message, authid: int) -> Message:
+        """Process a request and build the answer (without signature)."""
+        with self._lock:
+            self.requests += 1
+            if self.key and request.authid != authid:
+                return _status(request, 1, "not authenticated")
+            if request.opcode == OP_DELETE:
+                name = self._handles.pop(request.handle, None)
+                if name is None or name not in self.hosts:
+                    return _status(request, 2, "not found")
+                del self.hosts[name]
+                return _status(request, 0)
+            if request.opcode != OP_OPEN:
+                return _status(request, 3, "not implemented")
+            if request.message.get(b"type") != b"host":
+                return _status(request, 3, "not implemented")
+            name = request.obj.get(b"name", b"").decode()
+            if request.message.get(b"create") == _int(1):
+                if name in self.hosts:
+                    return _status(request, 4, "already exists")
+                mac = request.obj[b"hardware-address"].hex(":")
+                ip = socket.inet_ntoa(request.obj[b"ip-address"])
+                self.hosts[name] = (mac, ip)
+            elif name not in self.hosts:
+                return _status(request, 2, "not found")
+            handle = random.getrandbits(31) + 1
+            self._handles[handle] = name
+            return Message(OP_UPDATE, handle=handle, tid=request.tid ^ 1,
+                           rid=request.tid, obj={b"name": name.encode()})
+
+
+def _status(request: Message, result: int, text: str = "") -> Message:
+    return Message(OP_STATUS, tid=request.tid ^ 1, rid=request.tid,
+                   message={b"result": _int(result),
+                            b"message": text.encode()})
+
+
+class _FakeServerHandler(socketserver.BaseRequestHandler):
+    # One client connection to FakeServer
+    server: FakeServer
+
+    def handle(self) -> None:
+        sock = self.request
+        try:
+            _recv_exactly(sock, 8)
+            sock.sendall(_int(PROTOCOL_VERSION) + _int(HEADER_SIZE))
+            authid = 0
+            while True:
+                request = Message.receive(sock)
+                if request.message.get(b"type") == b"authenticator":
+                    ok = (request.obj.get(b"name", b"").decode()
+                          == self.server.key_name
+                          and request.obj.get(b"algorithm") == HMAC_MD5)
+                    if ok:
+                        authid = random.getrandbits(31) + 1
+                        answer = Message(OP_UPDATE, handle=authid,
+                                         tid=request.tid ^ 1, rid=request.tid)
+                    else:
+                        answer = _status(request, 5, "bad key")
+                    sock.sendall(answer.serialize())
+                    continue
+                if authid and not request.check_signature(self.server.key):
+                    answer = _status(request, 6, "bad signature")
+                else:
+                    answer = self.server.answer(request, authid)
+                if authid:
+                    answer = answer.sign(authid, self.server.key)
+                sock.sendall(answer.serialize())
+        except (OmapiError, OSError):
+            return
@@ -0,0 +1,345 @@
+"""Intranet de la Rez - Subscription State Transitions Scheduler
+
+Subscription states only change at known days (see
+:meth:`.models.Rezident.compute_sub_state`), computed from the end of
+each rezident latest subscription:
+
+  * ``trial``: the subscription end (subscribed -> trial);
+  * ``reminder``: a week before the cut day (reminder mail);
+  * ``cut``: the cut day (trial -> outlaw, ban).
+
+:data:`scheduler` keeps these upcoming transitions in a priority queue
+(heap), and at each transition time (at midnight) only updates the
+rezidents concerned, through :func:`.tools.sub_states.update`: states
+no longer lag until the daily ``update_sub_states`` run.
+
+The queue is saved in ``SUB_SCHEDULER_STATE_FILE`` after each change, so
+it survives restarts (rebuilt from the database if missing). A single
+process runs the scheduler (exclusive lock on ``<state file>.lock``;
+other processes wait in the background to take over). Subscriptions
+changes are detected at commit in any process, and the rezidents
+concerned written to ``<state file>.pending``, read by the scheduler to
+reschedule their transitions.
+
+Enabled by ``SUB_SCHEDULER``; the daily ``update_sub_states`` cron job
+should then be removed (reminders would be sent twice).
+"""
+
+import contextlib
+import datetime
+import fcntl
+import heapq
+import json
+import os
+import threading
+import time
+
+import flask
+import sqlalchemy as sa
+
+from app import IntraRezApp, db
+from app.models import Subscription
+from app.tools import sub_states, typing
+
+
+Event = tuple[float, int, str]      # (timestamp, rezident ID, kind)
+
+_PENDING_KEY = "sub_scheduler_rezidents"
+
+
+def _midnight(day: datetime.date) -> float:
+    # Timestamp of the beginning of a (local) day
+    return datetime.datetime.combine(day, datetime.time.min).timestamp()
+
+
+def events_for(rezident_id: int, end: datetime.date,
+               now: float | None = None) -> list[Event]:
+    """The upcoming transitions of a rezident.
+
+    Args:
+        rezident_id: The ID of the rezident.
+        end: The end of the rezident latest subscription.
+        now: The current timestamp (default: now).
+
+    Returns:
+        The transitions after ``now``.
+    """
+    now = time.time() if now is None else now
+    cut_day = Subscription.cut_day_for(end)
+    events = [
+        (_midnight(end), rezident_id, "trial"),
+        (_midnight(cut_day - datetime.timedelta(days=7)), rezident_id,
+         "reminder"),
+        (_midnight(cut_day), rezident_id, "cut"),
+    ]
+    return [event for event in events if event[0] > now]
+
+
+class TransitionScheduler:
+    """Priority queue of upcoming subscription state transitions.
+
+    Args:
+        state_file: The file in which the queue is saved.
+        poll_interval: The maximal delay between two checks of the
+            pending notifications, in seconds.
+
+    Attrs:
+        fired (int): Number of transitions fired.
+        updates (int): Number of updates done (transitions due at the
+            same time are processed together).
+    """
+    def __init__(self, state_file: str = "",
+                 poll_interval: float = 60.0) -> None:
+        """Initializes self."""
+        self.state_file = state_file
+        self.poll_interval = poll_interval
+        self.fired = 0
+        self.updates = 0
+        self.app: IntraRezApp | None = None
+        self._heap: list[Event] = []
+        self._thread: threading.Thread | None = None
+
+    def __repr__(self) -> str:
+        """Returns repr(self)."""
+        return f"<TransitionScheduler ({len(self._heap)} scheduled)>"
+
+    @property
+    def events(self) -> list[Event]:
+        """The scheduled transitions, in chronological order."""
+        return sorted(self._heap)
+
+    def load(self) -> bool:
+        """Load the saved queue.
+
+        Returns:
+            Whether the queue was loaded (else, it should be rebuilt).
+        """
+        try:
+            with open(self.state_file) as fp:
+                self._heap = [tuple(event) for event in json.load(fp)]
+        except (OSError, ValueError):
+            return False
+        heapq.heapify(self._heap)
+        return True
+
+    def save(self) -> None:
+        """Save the queue (atomically)."""
+        with open(f"{self.state_file}.tmp", "w") as fp:
+            json.dump(self.events, fp)
+        os.replace(f"{self.state_file}.tmp", self.state_file)
+
+    def _latest_ends(self, rezident_ids: typing.Iterable[int] | None = None
+                     ) -> list[tuple[int, datetime.date]]:
+        # End of the latest subscription of (some) rezidents
+        latest = sub_states.latest_subscriptions()
+        query = sa.select(latest.c.rezident_id, latest.c.end)
+        if rezident_ids is not None:
+            query = query.where(latest.c.rezident_id.in_(list(rezident_ids)))
+        return list(db.session.execute(query))
+
+    def _compute(self, rezident_ids: set[int] | None = None) -> list[Event]:
+        # Upcoming transitions of (some) rezidents, and catch-up events
+        # (now) for those whose state is not up to date
+        now = time.time()
+        events = [
+            event for rezident_id, end in self._latest_ends(rezident_ids)
+            for event in events_for(rezident_id, end, now)
+        ]
+        events.extend(
+            (now, transition.rezident_id, "catch-up")
+            for transition in sub_states.pending_transitions(
+                rezident_ids=rezident_ids
+            )
+        )
+        return events
+
+    def rebuild(self) -> None:
+        """Rebuild the whole queue from the database.
+
+        Rezidents whose state is not up to date are scheduled now.
+        """
+        self._heap = self._compute()
+        heapq.heapify(self._heap)
+        self.save()
+
+    def reschedule(self, rezident_ids: typing.Iterable[int]) -> None:
+        """Recompute the transitions of some rezidents.
+
+        Args:
+            rezident_ids: The IDs of the rezidents whose subscriptions
+                changed.
+        """
+        ids = set(rezident_ids)
+        self._heap = [event for event in self._heap if event[1] not in ids]
+        self._heap.extend(self._compute(ids))
+        heapq.heapify(self._heap)
+        self.save()
+
+    def pop_due(self, now: float | None = None) -> list[Event]:
+        """Remove and return the transitions due.
+
+        Args:
+            now: The current timestamp (default: now).
+        """
+        now = time.time() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap))
+        return due
+
+    def run_once(self, now: float | None = None) -> list[Event]:
+        """Process pending notifications and fire due transitions.
+
+        Must be called in an application context.
+
+        Args:
+            now: The current timestamp (default: now).
+
+        Returns:
+            The transitions fired.
+        """
+        notified = _read_pending(self.state_file)
+        if notified:
+            self.reschedule(notified)
+        due = self.pop_due(now)
+        if not due:
+            return []
+        ids = {rezident_id for _, rezident_id, _ in due}
+        result = sub_states.update(rezident_ids=ids)
+        self.fired += len(due)
+        self.updates += 1
+        flask.current_app.logger.info(
+            f"Sub scheduler: {len(due)} transitions fired, "
+            f"{len(result.transitions)} states changed, "
+            f"{len(result.reminded)} reminders"
+        )
+        # Next transitions of these rezidents (cut after trial...)
+        self.reschedule(ids)
+        return due
+
+    def next_delay(self) -> float:
+        """Delay before the next transition or notifications check."""
+        if not self._heap:
+            return self.poll_interval
+        delay = self._heap[0][0] - time.time()
+        return max(0.0, min(self.poll_interval, delay))
+
+    def _run(self) -> None:
+        # Background thread: wait for the lock, then schedule forever
+        with open(f"{self.state_file}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)    # Until process exit
+            with self.app.app_context():
+                try:
+                    if not self.load():
+                        self.rebuild()
+                finally:
+                    db.session.remove()
+            self.app.logger.info(f"Sub scheduler started ({self!r})")
+            while True:
+                with self.app.app_context():
+                    try:
+                        self.run_once()
+                    except Exception as exc:
+                        self.app.logger.error("Sub scheduler run failed",
+                                              exc_info=exc)
+                    finally:
+                        db.session.remove()
+                time.sleep(self.next_delay() + 0.5)
+
+    def start(self) -> None:
+        """Start the scheduler thread, if not started yet.
+
+        Only one process runs the scheduler at a time; in other
+        processes, the thread waits to take over.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run,
+                                        name="sub-scheduler", daemon=True)
+        self._thread.start()
+
+scheduler = TransitionScheduler()
+
+
+@contextlib.contextmanager
+def _pending_locked(state_file: str) -> typing.Iterator[str]:
+    # Exclusive lock on the pending notifications file
+    file = f"{state_file}.pending"
+    with open(f"{file}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield file
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def notify(rezident_ids: typing.Iterable[int]) -> None:
+    """Tell the scheduler the subscriptions of some rezidents changed.
+
+    Can be called from any process (the IDs are written in
+    ``<state file>.pending``). Does nothing if the scheduler is disabled.
+
+    Args:
+        rezident_ids: The IDs of the rezidents concerned.
+    """
+    config = flask.current_app.config
+    if not config["SUB_SCHEDULER"]:
+        return
+    with _pending_locked(config["SUB_SCHEDULER_STATE_FILE"]) as file:
+        with open(file, "a") as fp:
+            fp.writelines(f"{id}\n" for id in rezident_ids)
+
+
+def _read_pending(state_file: str) -> set[int]:
+    # Read and clear the pending notifications
+    with _pending_locked(state_file) as file:
+        try:
+            with open(file) as fp:
+                ids = {int(line) for line in fp if line.strip()}
+        except OSError:
+            return set()
+        os.remove(file)
+    return ids
+
+
+def _collect(session: sa.orm.Session, _context: typing.Any) -> None:
+    # After flush: rezidents whose subscriptions were added / modified
+    ids = session.info.setdefault(_PENDING_KEY, set())
+    for obj in [*session.new, *session.dirty, *session.deleted]:
+        if isinstance(obj, Subscription) and obj._rezident_id:
+            ids.add(obj._rezident_id)
+
+
+def _notify_committed(session: sa.orm.Session) -> None:
+    # After commit: notify the scheduler
+    ids = session.info.pop(_PENDING_KEY, None)
+    if ids and flask.has_app_context():
+        notify(ids)
+
+
+def _discard(session: sa.orm.Session, _previous: typing.Any) -> None:
+    # After rollback: changes cancelled
+    session.info.pop(_PENDING_KEY, None)
+
+
+sa.event.listen(sa.orm.Session, "after_flush", _collect)
+sa.event.listen(sa.orm.Session, "after_commit", _notify_committed)
+sa.event.listen(sa.orm.Session, "after_soft_rollback", _discard)
+
+
+def init_app(app: IntraRezApp) -> None:
+    """Configure :data:`.scheduler` for an app.
+
+    Uses ``SUB_SCHEDULER``, ``SUB_SCHEDULER_STATE_FILE`` and
+    ``SUB_SCHEDULER_POLL_INTERVAL`` application config values. The
+    scheduler is started at the first request served (so not in CLI
+    commands).
+    """
+    scheduler.app = app
+    scheduler.state_file = app.config["SUB_SCHEDULER_STATE_FILE"]
+    scheduler.poll_interval = app.config["SUB_SCHEDULER_POLL_INTERVAL"]
+
+    @app.before_first_request
+    def _start_scheduler() -> None:
+        if app.config["SUB_SCHEDULER"] and flask.has_request_context():
+            scheduler.start()
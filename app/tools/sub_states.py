@@ -0,0 +1,278 @@
+"""Intranet de la Rez - Set-based Subscription States Update
+
+Expected subscription states (see :meth:`.models.Rezident.compute_sub_state`)
+are computed for all rezidents in SQL, from each rezident latest
+subscription: only rezidents whose state changes (and those to remind
+that their access will be cut) are then loaded.
+
+Transitions are applied in a single transaction, with one bulk
+``UPDATE`` per new state and a bulk ``INSERT`` of the bans of rezidents
+becoming outlaws. Mails are sent afterwards, in bulk (see
+:func:`.email.send_bulk`), to changed rezidents only.
+"""
+
+import datetime
+
+import flask
+import flask_babel
+from flask_babel import _
+import sqlalchemy as sa
+
+from app import db
+from app.enums import SubState
+from app.models import Ban, Rezident, Subscription
+from app.payments import email
+from app.tools import dhcp, nftables, typing, utils
+
+
+class Transition(typing.NamedTuple):
+    """A subscription state change of a rezident.
+
+    Attrs:
+        rezident_id: The ID of the rezident.
+        old: The rezident current state (in database).
+        new: The rezident expected state.
+    """
+    rezident_id: int
+    old: SubState
+    new: SubState
+
+
+class UpdateResult(typing.NamedTuple):
+    """Result of a subscription states update (see :func:`update`).
+
+    Attrs:
+        transitions: The state changes applied.
+        banned: The IDs of the rezidents banned.
+        reminded: The IDs of the rezidents reminded of their cut day.
+    """
+    transitions: list[Transition]
+    banned: list[int]
+    reminded: list[int]
+
+
+def latest_subscriptions() -> sa.sql.Subquery:
+    """Subquery of the latest subscription of each rezident.
+
+    The latest subscription is the one starting last (i.e.
+    :attr:`.models.Rezident.current_subscription`).
+
+    Returns:
+        A subquery with columns ``rezident_id`` and ``end``.
+    """
+    ranked = sa.select(
+        Subscription._rezident_id.label("rezident_id"),
+        Subscription.end.label("end"),
+        sa.func.row_number().over(
+            partition_by=Subscription._rezident_id,
+            order_by=(Subscription.start.desc(), Subscription.id.desc()),
+        ).label("rank"),
+    ).subquery()
+    return (sa.select(ranked.c.rezident_id, ranked.c.end)
+            .where(ranked.c.rank == 1).subquery("latest_subscription"))
+
+
+def expected_state(end: sa.sql.ColumnElement,
+                   today: datetime.date) -> sa.sql.ColumnElement:
+    """SQL expression of the subscription state expected on a given day.
+
+    Same logic as :meth:`.models.Rezident.compute_sub_state`.
+
+    Args:
+        end: The latest subscription end (``NULL`` if no subscription).
+        today: The day to compute the state for.
+    """
+    sub_state_type = Rezident.sub_state.type
+    return sa.case(
+        (end.is_(None), sa.literal(SubState.trial, sub_state_type)),
+        (end < Subscription.first_active_end(today),
+         sa.literal(SubState.outlaw, sub_state_type)),
+        (end <= today, sa.literal(SubState.trial, sub_state_type)),
+        else_=sa.literal(SubState.subscribed, sub_state_type),
+    )
+
+
+def pending_transitions(today: datetime.date | None = None,
+                        rezident_ids: typing.Iterable[int] | None = None
+                        ) -> list[Transition]:
+    """Compute the subscription state changes to apply, in one query.
+
+    Args:
+        today: The day to compute states for (default: today).
+        rezident_ids: If set, only consider these rezidents.
+
+    Returns:
+        The transitions of rezidents whose state is not up to date.
+    """
+    today = today or datetime.date.today()
+    latest = latest_subscriptions()
+    expected = expected_state(latest.c.end, today).label("expected")
+    query = (
+        sa.select(Rezident.id, Rezident.sub_state, expected)
+        .outerjoin(latest, latest.c.rezident_id == Rezident.id)
+        .where(Rezident.sub_state != expected)
+        .order_by(Rezident.id)
+    )
+    if rezident_ids is not None:
+        query = query.where(Rezident.id.in_(list(rezident_ids)))
+    return [Transition(*row) for row in db.session.execute(query)]
+
+
+def reminder_rezident_ids(today: datetime.date | None = None,
+                          rezident_ids: typing.Iterable[int] | None = None
+                          ) -> list[int]:
+    """IDs of rezidents in trial whose access will be cut in a week.
+
+    Only rezidents having a room are considered.
+
+    Args:
+        today: The current day (default: today).
+        rezident_ids: If set, only consider these rezidents.
+    """
+    today = today or datetime.date.today()
+    cut_day = today + datetime.timedelta(days=7)
+    # cut_day_for(end) == cut_day  <=>  first_active_end(cut_day - 1 day)
+    #                                   <= end < first_active_end(cut_day)
+    latest = latest_subscriptions()
+    query = (
+        sa.select(Rezident.id)
+        .join(latest, latest.c.rezident_id == Rezident.id)
+        .where(Rezident.sub_state == SubState.trial)
+        .where(latest.c.end >= Subscription.first_active_end(
+            cut_day - datetime.timedelta(days=1)
+        ))
+        .where(latest.c.end < Subscription.first_active_end(cut_day))
+        .where(Rezident.has_a_room)
+        .order_by(Rezident.id)
+    )
+    if rezident_ids is not None:
+        query = query.where(Rezident.id.in_(list(rezident_ids)))
+    return list(db.session.execute(query).scalars())
+
+
+def _ban_texts(locale: str) -> tuple[str, str]:
+    # Reason and message of a subscription ban, in a given language
+    with flask_babel.force_locale(locale):
+        return (
+            _("Pas d'abonnement actif"),
+            _("Afin de retrouver l'accès à Internet, connectez-vous à votre "
+              "compte et prenez un abonnement à Internet."),
+        )
+
+
+def apply_transitions(transitions: list[Transition]) -> list[int]:
+    """Apply subscription state changes in a single transaction.
+
+    Rezidents becoming outlaws are banned (open-ended ban), unless they
+    already are.
+
+    Args:
+        transitions: The changes to apply (see :func:`pending_transitions`).
+
+    Returns:
+        The IDs of the rezidents banned.
+    """
+    if not transitions:
+        return []
+    table = Rezident.__table__
+    by_state: dict[SubState, list[int]] = {}
+    for transition in transitions:
+        by_state.setdefault(transition.new, []).append(transition.rezident_id)
+    for state, ids in by_state.items():
+        db.session.execute(sa.update(table).where(table.c.id.in_(ids))
+                           .values(sub_state=state))
+
+    outlaws = by_state.get(SubState.outlaw, [])
+    banned = []
+    if outlaws:
+        query = (sa.select(Rezident.id, Rezident.locale)
+                 .where(Rezident.id.in_(outlaws))
+                 .where(sa.not_(Rezident.is_banned)))
+        now = datetime.datetime.utcnow()
+        texts = {}
+        rows = []
+        for rezident_id, locale in db.session.execute(query):
+            locale = locale or "en"
+            if locale not in texts:
+                texts[locale] = _ban_texts(locale)
+            reason, message = texts[locale]
+            rows.append({"_rezident_id": rezident_id, "start": now,
+                         "end": None, "reason": reason, "message": message})
+            banned.append(rezident_id)
+        if rows:
+            db.session.execute(sa.insert(Ban.__table__), rows)
+    db.session.commit()
+    # Objects possibly loaded in session are now outdated
+    db.session.expire_all()
+
+    for transition in transitions:
+        utils.log_action(f"Sub state of <Rezident #{transition.rezident_id}> "
+                         f"changed to {transition.new}")
+    for rezident_id in banned:
+        utils.log_action(f"Subscription of <Rezident #{rezident_id}> "
+                         "expired, banned")
+    return banned
+
+
+def _load_rezidents(ids: list[int]) -> list[Rezident]:
+    # Load rezidents with what mail rendering needs, in bulk
+    if not ids:
+        return []
+    return (Rezident.query.filter(Rezident.id.in_(ids))
+            .options(sa.orm.selectinload(Rezident.subscriptions),
+                     sa.orm.selectinload(Rezident.rentals))
+            .order_by(Rezident.id).all())
+
+
+def update(today: datetime.date | None = None,
+           rezident_ids: typing.Iterable[int] | None = None, *,
+           send_mails: bool = True) -> UpdateResult:
+    """Update subscription states, and notify rezidents concerned.
+
+    Rezidents whose state changed and having a room receive a state
+    change mail; rezidents in trial whose access will be cut in a week
+    receive a reminder. DHCP rules of banned rezidents are refreshed (and
+    the nftables bans set synchronised, if used).
+
+    Args:
+        today: The day to compute states for (default: today).
+        rezident_ids: If set, only update these rezidents.
+        send_mails: Whether to send state change and reminder mails.
+
+    Returns:
+        The update result.
+    """
+    today = today or datetime.date.today()
+    if rezident_ids is not None:
+        rezident_ids = list(rezident_ids)
+    transitions = pending_transitions(today, rezident_ids)
+    reminded = reminder_rezident_ids(today, rezident_ids)
+    changed_ids = {transition.rezident_id for transition in transitions}
+    reminded = [id for id in reminded if id not in changed_ids]
+    banned = apply_transitions(transitions)
+
+    if send_mails:
+        to_notify = list(db.session.execute(
+            sa.select(Rezident.id).where(Rezident.id.in_(changed_ids))
+            .where(Rezident.has_a_room)
+        ).scalars()) if changed_ids else []
+        by_state: dict[SubState, list[Rezident]] = {}
+        for rezident in _load_rezidents(to_notify):
+            by_state.setdefault(rezident.sub_state, []).append(rezident)
+        for state, rezidents in by_state.items():
+            email.send_state_change_emails(rezidents, state)
+        if reminded:
+            email.send_reminder_emails(_load_rezidents(reminded))
+
+    if banned:
+        # Update DHCP rules / bans set of banned rezidents
+        try:
+            dhcp.refresh_rezidents(*banned)
+            if nftables.enabled():
+                nftables.sync()
+        except Exception as exc:
+            flask.current_app.logger.error(
+                "DHCP / bans update after sub states update failed",
+                exc_info=exc
+            )
+    return UpdateResult(transitions, banned, reminded)
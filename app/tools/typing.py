@@ -1,7 +1,8 @@
 """IntraRez typing utilities."""
 
 from typing import (Any, Literal, Generic, Callable, TypeVar, ParamSpec,
-                    overload, cast)
+                    NamedTuple, TypedDict, Iterable, Iterator, Sized,
+                    overload, cast, TYPE_CHECKING)
 
 from flask import typing as flask_typing
 import flask_babel
@@ -6,7 +6,7 @@ import flask
 import wtforms
 from flask_babel import lazy_gettext as _l
 
-from app.models import Rezident, Room, Ban
+from app.models import Rezident, Room, Ban, OutboxMail
 from app.tools.typing import JinjaStr
 
 
@@ -112,6 +112,14 @@ class ValidBanID(CustomValidator):
                 and bool(Ban.query.get(int(field.data))))
 
 
+class ValidOutboxMailID(CustomValidator):
+    message = _l("ID de mail invalide.")
+
+    def validate(self, form: wtforms.Form, field: wtforms.Field) -> bool:
+        return (field.data.isdigit()
+                and bool(OutboxMail.query.get(int(field.data))))
+
+
 class PastDate(CustomValidator):
     message = _l("Cette date doit être dans le passé !")
 
@@ -45,6 +45,22 @@ class Config():
     MAIL_USE_TLS = os.environ.get("MAIL_USE_TLS") is not None
     MAIL_USERNAME = os.environ.get("MAIL_USERNAME")
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
+    MAIL_WORKERS = int(os.environ.get("MAIL_WORKERS") or 2)
+    MAIL_QUEUE_SIZE = int(os.environ.get("MAIL_QUEUE_SIZE") or 200)
+    MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE") or 50)
+    MAIL_FLUSH_TIMEOUT = float(os.environ.get("MAIL_FLUSH_TIMEOUT") or 30)
+    MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS") or 8)
+    MAIL_RETRY_DELAY = float(os.environ.get("MAIL_RETRY_DELAY") or 60)
+    MAIL_RETRY_MAX_DELAY = float(os.environ.get("MAIL_RETRY_MAX_DELAY")
+                                 or 21600)
+    MAIL_SEND_TIMEOUT = float(os.environ.get("MAIL_SEND_TIMEOUT") or 600)
+    MAIL_OUTBOX_POLL_INTERVAL = float(
+        os.environ.get("MAIL_OUTBOX_POLL_INTERVAL") or 30
+    )
+    MAIL_OUTBOX_RETENTION = int(os.environ.get("MAIL_OUTBOX_RETENTION") or 30)
+    MAIL_INLINE_CACHE_SIZE = int(os.environ.get("MAIL_INLINE_CACHE_SIZE")
+                                 or 256)
+    MAIL_BULK_RATE = float(os.environ.get("MAIL_BULK_RATE") or 10)
     ADMINS = os.environ.get("ADMINS", "").split(";")
 
     ERROR_WEBHOOK = os.environ.get("ERROR_WEBHOOK")
@@ -52,6 +68,8 @@ class Config():
     MESSAGE_WEBHOOK = os.environ.get("MESSAGE_WEBHOOK")
     MAIL_WEBHOOK = os.environ.get("MAIL_WEBHOOK")
     GRI_ROLE_ID = os.environ.get("GRI_ROLE_ID")
+    DISCORD_QUEUE_SIZE = int(os.environ.get("DISCORD_QUEUE_SIZE") or 1000)
+    DISCORD_FLUSH_DELAY = float(os.environ.get("DISCORD_FLUSH_DELAY") or 1)
 
     LYDIA_BASE_URL = os.environ.get("LYDIA_BASE_URL")
     LYDIA_VENDOR_TOKEN = os.environ.get("LYDIA_VENDOR_TOKEN")
@@ -66,6 +84,48 @@ class Config():
     FORCE_IP = os.environ.get("FORCE_IP")
     FORCE_MAC = os.environ.get("FORCE_MAC")
 
+    NEIGHBOUR_SOURCE = os.environ.get("NEIGHBOUR_SOURCE") or "arp"
+    ARP_TABLE_FILE = os.environ.get("ARP_TABLE_FILE") or "/proc/net/arp"
+    ARP_CACHE_TTL = float(os.environ.get("ARP_CACHE_TTL") or 30)
+
+    DHCP_HOSTS_FILE = os.environ.get("DHCP_HOSTS_FILE")
+    DHCP_COALESCE_DELAY = float(os.environ.get("DHCP_COALESCE_DELAY") or 1)
+    DHCP_JOBS_DIR = (os.environ.get("DHCP_JOBS_DIR")
+                     or os.path.join("logs", "dhcp_jobs"))
+    DHCP_FORMAT = os.environ.get("DHCP_FORMAT") or "isc"
+    DHCP_BACKEND = os.environ.get("DHCP_BACKEND") or "restart"
+    OMAPI_HOST = os.environ.get("OMAPI_HOST") or "127.0.0.1"
+    OMAPI_PORT = int(os.environ.get("OMAPI_PORT") or 7911)
+    OMAPI_KEY_NAME = os.environ.get("OMAPI_KEY_NAME")
+    OMAPI_KEY = os.environ.get("OMAPI_KEY")
+    KEA_CONTROL_SOCKET = (os.environ.get("KEA_CONTROL_SOCKET")
+                          or "/run/kea/kea4-ctrl-socket")
+
+    BAN_BACKEND = os.environ.get("BAN_BACKEND") or "dhcp"
+    NFT_COMMAND = os.environ.get("NFT_COMMAND") or "nft"
+    NFT_TABLE = os.environ.get("NFT_TABLE") or "inet intrarez"
+    NFT_SET = os.environ.get("NFT_SET") or "banned_macs"
+    NFT_STATE_FILE = (os.environ.get("NFT_STATE_FILE")
+                      or os.path.join("logs", "nft_banned_macs.json"))
+
+    DHCP_LEASES_FILE = (os.environ.get("DHCP_LEASES_FILE")
+                        or "/var/lib/dhcp/dhcpd.leases")
+    LEASES_STATE_FILE = (os.environ.get("LEASES_STATE_FILE")
+                         or os.path.join("logs", "leases_state.json"))
+    LEASES_POLL_INTERVAL = float(os.environ.get("LEASES_POLL_INTERVAL") or 5)
+
+    SUB_SCHEDULER = bool(os.environ.get("SUB_SCHEDULER"))
+    SUB_SCHEDULER_STATE_FILE = (os.environ.get("SUB_SCHEDULER_STATE_FILE")
+                                or os.path.join("logs", "sub_scheduler.json"))
+    SUB_SCHEDULER_POLL_INTERVAL = float(
+        os.environ.get("SUB_SCHEDULER_POLL_INTERVAL") or 60
+    )
+
+    LAST_SEEN_PRECISION = float(os.environ.get("LAST_SEEN_PRECISION") or 60)
+    LAST_SEEN_FLUSH_INTERVAL = float(
+        os.environ.get("LAST_SEEN_FLUSH_INTERVAL") or 30
+    )
+
     NETLOCS = os.environ.get("NETLOCS")
     if NETLOCS is not None:
         NETLOCS = NETLOCS.split(";")
@@ -0,0 +1,47 @@
+"""IntraRez - Vérification des IPs attribuées
+
+Recherche dans la table `allocation` les adresses IP attribuées plusieurs
+fois (collisions, dues à l'ancien compteur qui bouclait après 256
+attributions dans une même chambre) et celles n'appartenant pas à la plage
+de leur chambre. Ne modifie rien : supprimer les attributions fautives
+(sauf la plus ancienne) puis régénérer avec `flask script gen_dhcp.py`.
+
+Ce script peut uniquement être appelé depuis Flask :
+  * Soit depuis l'interface en ligne (menu GRI) ;
+  * Soit par ligne de commande :
+    cd /home/intrarez/intrarez; ./env/bin/flask script check_ips.py
+
+10/2026
+"""
+
+import sys
+
+try:
+    from app.tools import ip_pool
+except ImportError:
+    sys.stderr.write(
+        "ERREUR - Ce script peut uniquement être appelé depuis Flask :\n"
+        "  * Soit depuis l'interface en ligne (menu GRI) ;\n"
+        "  * Soit par ligne de commande :\n"
+        "    cd /home/intrarez/intrarez; "
+        "    ./env/bin/flask script check_ips.py\n"
+    )
+    sys.exit(1)
+
+
+def main() -> None:
+    collisions, malformed = ip_pool.check_allocations()
+
+    print(f"{len(collisions)} IP(s) attribuée(s) plusieurs fois")
+    for collision in collisions:
+        print(f"  {collision.ip} :")
+        for alloc in collision.allocations:
+            print(f"    - {alloc} (chambre {alloc.room.num})")
+
+    print(f"{len(malformed)} IP(s) hors de la plage de leur chambre")
+    for alloc in malformed:
+        print(f"  - {alloc} (chambre {alloc.room.num}, "
+              f"base {alloc.room.base_ip})")
+
+    if not collisions and not malformed:
+        print("Tout est cohérent !")
@@ -4,6 +4,10 @@ Pour toutes les chambres, attribue une adresse IP aux appareils de
 l'occupant actuel. L'attribution d'IP elle-même (y compris en cas de
 bannissement est gérée par `Device.allocate_ip_for`).
 
+Les routes modifiant des appareils, locations ou bans ne régénèrent que
+les règles des Rezidents concernés (voir `app/tools/dhcp.py`) ; ce script
+reconstruit entièrement le fichier (et son index).
+
 Ce script peut uniquement être appelé depuis Flask :
   * Soit depuis l'interface en ligne (menu GRI) ;
   * Soit par ligne de commande :
@@ -12,13 +16,10 @@ Ce script peut uniquement être appelé depuis Flask :
 10/2021 Loïc 137
 """
 
-import os
 import sys
 
-import flask
-
 try:
-    from app.models import Room
+    from app.tools import dhcp, nftables
 except ImportError:
     sys.stderr.write(
         "ERREUR - Ce script peut uniquement être appelé depuis Flask :\n"
@@ -31,47 +32,15 @@ except ImportError:
 
 
 def main() -> None:
-    rules = ""
-
-    rooms = Room.query.order_by(Room.num).all()
-    for room in rooms:
-        if not room.current_rental:
-            print(f"Chambre {room.num} non occupée, on passe")
-            continue
-
-        rezident = room.current_rental.rezident
-        print(f"Chambre {room.num} occupée par {rezident.full_name}")
-        if rezident.is_banned:
-            print(f"    -- BANNI : {rezident.current_ban} --")
-
-        for device in rezident.devices:
-            ip = device.allocate_ip_for(room)
-            print(f"    Appareil #{device.id} : {device.mac_address} -> {ip}")
-            rules += (
-                f"host {rezident.username}-{room.num}-{device.id} {{\n"
-                f"\thardware ethernet {device.mac_address};\n"
-                f"\tfixed-address {ip};\n"
-                "}\n"
-            )
-
-    # Écriture dans le fichier
-    file = os.getenv("DHCP_HOSTS_FILE") or ""
-    if not os.path.isfile(file):
-        raise FileNotFoundError(f"Le ficher d'hôtes DHCP '{file}' n'existe "
-                                "pas (variable d'environment DHCP_HOSTS_FILE)")
-
-    with open(file, "w") as fp:
-        fp.write(
-            "# Ce fichier est généré automatiquement par gen_dhcp.py\n"
-            f"# ({__file__}).\n"
-            "# Ne PAS le modifier à la main, ce serait écrasé !\n#\n"
-            "#   * Pour ajouter un appareil à un Rezident,\n"
-            "#       - utiliser l'interface en ligne \n"
-            f"#         ({flask.url_for('gris.rezidents')})\n"
-            "#       - OU utiliser `flask shell` pour l'ajouter en base,\n"
-            "#         puis régénérer avec `flask script gen_dhcp.py`\n"
-            "#         (flask = /home/intrarez/intrarez/env/bin/flask)\n#\n"
-            "#   * Pour ajouter toute autre règle, modifier directement\n"
-            "#     /env/dhcp/dhcpd.conv\n#\n"
-        )
-        fp.write(rules)
+    # Régénération complète (les routes ne régénèrent que les règles
+    # des Rezidents concernés, voir app/tools/dhcp.py)
+    if dhcp.rebuild():
+        print(f"Fichier {dhcp.hosts_file()} mis à jour.")
+    else:
+        print(f"Fichier {dhcp.hosts_file()} inchangé.")
+
+    # Bans appliqués par nftables (BAN_BACKEND="nftables")
+    if nftables.enabled():
+        result = nftables.sync()
+        print(f"Bannissements (nftables) : {len(result.added)} ajouté(s), "
+              f"{len(result.removed)} retiré(s).")
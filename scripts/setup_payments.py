@@ -20,13 +20,10 @@ Ce script peut uniquement être appelé depuis Flask :
 
 import sys
 
-import flask
-import flask_babel
-from flask_babel import _
-
 try:
-    from app.email import send_email
     from app.models import Rezident
+    from app.payments.email import send_on_setup_emails
+    from app.tools.utils import print_progressbar
 except ImportError:
     sys.stderr.write(
         "ERREUR - Ce script peut uniquement être appelé depuis Flask :\n"
@@ -38,28 +35,10 @@ except ImportError:
     sys.exit(1)
 
 
-def send_on_setup_email(rezident: Rezident) -> None:
-    with flask_babel.force_locale(rezident.locale or "fr"):
-        # Render mail content, in rezident language
-        subject = _("IMPORTANT - Paiement d'Internet")
-        html_body = flask.render_template(
-            "payments/mails/on_setup.html",
-            rezident=rezident,
-            sub=rezident.current_subscription,
-        )
-
-    # Send email
-    send_email(
-        "payments/on_setup",
-        subject=f"[IntraRez] {subject}",
-        recipients={rezident.email: rezident.full_name},
-        html_body=html_body,
-    )
-
-
 def main() -> None:
     rezidents = Rezident.query.all()
     n_rez = len(rezidents)
+    to_notify = []
 
     for i_rez, rezident in enumerate(rezidents):
         print(f"[{i_rez + 1}/{n_rez}] {rezident.full_name} : ", end="")
@@ -76,7 +55,17 @@ def main() -> None:
         print("Ajout de l'abonnement... ", end="")
         sys.stdout.flush()
         rezident.add_first_subscription()
-        print("Envoi du mail... ", end="")
-        sys.stdout.flush()
-        send_on_setup_email(rezident)
+        to_notify.append(rezident)
         print("Fait !")
+
+    if not to_notify:
+        return
+    print(f"Envoi de {len(to_notify)} mail(s)...")
+    result = send_on_setup_emails(
+        to_notify, wait=60,
+        progress=lambda done, total: print_progressbar(done, total,
+                                                       length=50),
+    )
+    print(f"{result.queued} mail(s) en file, dont {result.sent} envoyé(s) "
+          f"et {result.failed} en échec ({result.duration:.1f} s) ; "
+          f"{result.skipped} sans adresse, {result.errors} erreur(s).")
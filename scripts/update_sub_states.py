@@ -6,6 +6,15 @@ paiement nécessaire) correspond bien à leurs abonnements en cours.
 Conçu pour être appelé tous les jours à minuit. Envoie également un mail
 au Rezident l'informant du changement d'état.
 
+Les états attendus sont calculés pour tous les Rezidents en quelques
+requêtes SQL, et les changements appliqués en une seule transaction
+(voir app/tools/sub_states.py).
+
+Si le planificateur de transitions est activé (variable d'environnement
+SUB_SCHEDULER, voir app/tools/scheduler.py), les états sont mis à jour au
+moment exact du changement : ce script n'a alors plus à être lancé tous
+les jours (les rappels seraient envoyés deux fois).
+
 Ce script peut uniquement être appelé depuis Flask :
   * Soit depuis l'interface en ligne (menu GRI) ;
   * Soit par ligne de commande :
@@ -14,17 +23,10 @@ Ce script peut uniquement être appelé depuis Flask :
 12/2021 Loïc 137
 """
 
-import datetime
 import sys
 
-import flask_babel
-from flask_babel import _
-
 try:
-    from app import db
-    from app.models import Rezident, Ban, SubState
-    from app.payments import email
-    from app.tools import utils
+    from app.tools import sub_states
 except ImportError:
     sys.stderr.write(
         "ERREUR - Ce script peut uniquement être appelé depuis Flask :\n"
@@ -37,50 +39,17 @@ except ImportError:
 
 
 def main() -> None:
-    rezidents = Rezident.query.all()
-    in_a_week = datetime.date.today() + datetime.timedelta(days=7)
-
-    for rezident in rezidents:
-        print(f"{rezident.full_name} : ", end="")
-
-        sub_state = rezident.compute_sub_state()
-        if rezident.sub_state == sub_state:
-            if (sub_state == SubState.trial
-                and rezident.current_subscription
-                and rezident.current_subscription.cut_day == in_a_week
-                and rezident.has_a_room):
-                # Coupure dans une semaine : mail de rappel
-                print("coupure dans une semaine, rappel")
-                email.send_reminder_email(rezident)
-            else:
-                # État à jour
-                print(f"à jour ({rezident.sub_state.name})")
-        else:
-            # État pas à jour : changer et envoyer un mail
-            print(f"{rezident.sub_state.name} -> {sub_state}")
-
-            if sub_state == SubState.outlaw:
-                # Expiration mois gratuit : BANNEZ-MOI ÇA LES MODOS
-                with flask_babel.force_locale(rezident.locale or "en"):
-                    ban = Ban(
-                        rezident=rezident,
-                        start=datetime.datetime.now(datetime.timezone.utc),
-                        end=None,
-                        reason=_("Pas d'abonnement actif"),
-                        message=_("Afin de retrouver l'accès à Internet, "
-                                  "connectez-vous à votre compte et prenez "
-                                  "un abonnement à Internet.")
-                    )
-                    db.session.add(ban)
-                    utils.log_action(
-                        f"Subscription of {rezident} expired, added {ban}"
-                    )
-                    db.session.commit()
-
-            rezident.sub_state = sub_state
-            db.session.commit()     # On commit à chaque fois, au cas où
-            utils.log_action(
-                f"Sub state of {rezident} changed to {sub_state}"
-            )
-            if rezident.has_a_room:
-                email.send_state_change_email(rezident, rezident.sub_state)
+    # Calcul des états attendus en SQL : seuls les Rezidents dont l'état
+    # change (ou à qui envoyer un rappel) sont chargés
+    result = sub_states.update()
+
+    for transition in result.transitions:
+        print(f"Rezident #{transition.rezident_id} : "
+              f"{transition.old.name} -> {transition.new.name}")
+    for rezident_id in result.banned:
+        print(f"Rezident #{rezident_id} : banni (abonnement expiré)")
+    for rezident_id in result.reminded:
+        print(f"Rezident #{rezident_id} : coupure dans une semaine, rappel")
+    print(f"{len(result.transitions)} changement(s) d'état, "
+          f"{len(result.banned)} bannissement(s), "
+          f"{len(result.reminded)} rappel(s).")
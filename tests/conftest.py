@@ -0,0 +1,60 @@
+"""Intranet de la Rez - Tests configuration"""
+
+import logging
+import os
+
+import pytest
+import sqlalchemy as sa
+
+
+# Importing the app requires a configured database (see config.py), and
+# the logs directory (app.email opens logs/mails.log)
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite://")
+os.makedirs("logs", exist_ok=True)
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An application backed by a fresh SQLite database, in app context.
+
+    Like the app, must be run from the repository root.
+    """
+    # ! Keep imports here: config has to be set up before !
+    from app import create_app, db
+    from app.tools import loggers
+    from config import Config
+
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'app.db'}"
+        SERVER_NAME = "localhost"
+        APPLICATION_ROOT = "/"
+        PREFERRED_URL_SCHEME = "http"
+        SECRET_KEY = "test"
+        DHCP_JOBS_DIR = str(tmp_path / "dhcp_jobs")
+        DHCP_HOSTS_FILE = str(tmp_path / "dhcp_hosts")
+
+    open(TestConfig.DHCP_HOSTS_FILE, "w").close()
+
+    # App loggers are process-wide: restore their handlers afterwards
+    names = ("app", "app.actions", "app.access")
+    handlers = {name: logging.getLogger(name).handlers[:] for name in names}
+    app = create_app(TestConfig)
+    with app.app_context():
+        metadata = sa.MetaData()
+        for table in db.metadata.sorted_tables:
+            copy = table.to_metadata(metadata)
+            for col in copy.columns:
+                # Models do not always reflect nullability (see migrations,
+                # not runnable on SQLite)
+                col.nullable = not col.primary_key
+        metadata.create_all(db.engine)
+        yield app
+        db.session.remove()
+    loggers.flush_background(timeout=5)
+    for name, previous in handlers.items():
+        logger = logging.getLogger(name)
+        for handler in logger.handlers[:]:
+            if handler not in previous:
+                logger.removeHandler(handler)
+                handler.close()
@@ -0,0 +1,27 @@
+"""Intranet de la Rez - Benchmarks tests"""
+
+import pytest
+import sqlalchemy as sa
+
+from app.tools.benchmarks import bench_indexes
+
+
+def test_bench_indexes():
+    report = list(bench_indexes("sqlite://", rezidents=20, number=1))
+    assert report[0] == "20 rezidents, 1 executions per query"
+    assert "  with indexes:" in "\n".join(report)
+
+
+def test_bench_indexes_refuses_non_empty_database(tmp_path):
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = sa.create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(sa.text("CREATE TABLE rezident (id INTEGER)"))
+        connection.execute(sa.text("INSERT INTO rezident VALUES (1)"))
+    with pytest.raises(ValueError):
+        list(bench_indexes(url, rezidents=20, number=1))
+    assert sa.inspect(engine).get_table_names() == ["rezident"]
+    with engine.connect() as connection:
+        assert connection.execute(
+            sa.text("SELECT COUNT(*) FROM rezident")
+        ).scalar() == 1
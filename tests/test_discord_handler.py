@@ -0,0 +1,50 @@
+"""Intranet de la Rez - Discord logging handler tests"""
+
+import logging
+
+from app.tools.benchmarks import WebhookStub
+from app.tools.loggers import DiscordHandler
+
+
+def _logger(handler: DiscordHandler) -> logging.Logger:
+    # A standalone logger sending records to handler
+    logger = logging.Logger("test-discord")
+    logger.addHandler(handler)
+    return logger
+
+
+def test_retry_after_rate_limit():
+    with WebhookStub(limit=1, window=0.5) as stub:
+        stub.accept("Previous message")     # Exhaust the current window
+        handler = DiscordHandler(stub.url, flush_delay=0)
+        _logger(handler).info("Hello")
+        handler.flush(timeout=10)
+    assert stub.rate_limited == 1
+    assert handler.rate_limited == 1
+    assert stub.contents == ["Previous message", "Hello"]
+    assert (handler.messages, handler.failed) == (1, 0)
+
+
+def test_records_gathered_in_messages():
+    with WebhookStub(limit=5, window=1.0) as stub:
+        handler = DiscordHandler(stub.url, flush_delay=0.5)
+        logger = _logger(handler)
+        for i in range(20):
+            logger.info(f"Record {i}")
+        handler.flush(timeout=10)
+    assert "\n".join(stub.contents).split("\n") == [f"Record {i}"
+                                                    for i in range(20)]
+    assert handler.messages == len(stub.contents) < 20
+    assert stub.rate_limited == 0
+
+
+def test_dropped_records_reported():
+    with WebhookStub(limit=5, window=1.0) as stub:
+        handler = DiscordHandler(stub.url, queue_size=1, flush_delay=0.5)
+        logger = _logger(handler)
+        for i in range(5):
+            logger.info(f"Record {i}")
+        handler.flush(timeout=10)
+    assert handler.dropped > 0
+    notice = f"*[{handler.dropped} messages de log perdus]*\n"
+    assert sum(content.startswith(notice) for content in stub.contents) == 1
@@ -0,0 +1,131 @@
+"""Intranet de la Rez - Rooms IP addresses pools tests"""
+
+import datetime
+
+import pytest
+import sqlalchemy as sa
+
+from app import db
+from app.models import Allocation, Device, Rental, Rezident, Room
+from app.tools import typing
+from app.tools.ip_pool import POOL_SIZE, IPPoolExhausted, RoomPool, slot_of
+
+
+DAY = datetime.timedelta(days=1)
+
+
+def test_slot_of():
+    assert slot_of("10.42.1.1") == 42
+    assert slot_of("10.256.1.1") is None
+    assert slot_of("garbage") is None
+
+
+def test_take_lowest_free_slot():
+    pool = RoomPool(Room(num=101, base_ip="1.1"),
+                    [(0, 1, False), (1, 2, False), (3, 3, False)])
+    assert pool.take() == (2, None)
+    assert pool.take() == (4, None)
+    assert pool.ip(4) == "10.4.1.1"
+
+
+def test_exhaust_pool():
+    pool = RoomPool(Room(num=101, base_ip="1.1"))
+    assert [pool.take()[0] for _ in range(POOL_SIZE)] == list(range(POOL_SIZE))
+    with pytest.raises(IPPoolExhausted):
+        pool.take()
+
+
+def test_reuse_stale_slots_oldest_first():
+    used = [(slot, 1000 - slot, slot in (7, 9)) for slot in range(POOL_SIZE)]
+    pool = RoomPool(Room(num=101, base_ip="1.1"), used)
+    # Allocation 991 (slot 9) is older than 993 (slot 7)
+    assert pool.take() == (9, 991)
+    assert pool.take() == (7, 993)
+    with pytest.raises(IPPoolExhausted):
+        pool.take()
+
+
+def _rezident(name: str, room: Room, left: bool = False) -> Rezident:
+    # A rezident renting room (or who left it), with one device
+    today = datetime.date.today()
+    rezident = Rezident(username=name)
+    rezident.rentals.append(Rental(room=room, start=today - 100 * DAY,
+                                   end=today - DAY if left else None))
+    rezident.devices.append(Device(mac_address=f"00:00:00:00:00:{name}",
+                                   registered=datetime.datetime.utcnow()))
+    db.session.add(rezident)
+    return rezident
+
+
+def _fill(room: Room, owner: typing.Callable[[int], Rezident]) -> None:
+    # Allocate all slots of room, to a device of owner(slot)
+    now = datetime.datetime.utcnow()
+    db.session.execute(sa.insert(Device.__table__), [
+        {"id": 1000 + slot, "_rezident_id": owner(slot).id,
+         "mac_address": f"02:00:00:00:00:{slot:02x}", "registered": now}
+        for slot in range(POOL_SIZE)
+    ])
+    db.session.execute(sa.insert(Allocation.__table__), [
+        {"_device_id": 1000 + slot, "_room_num": room.num,
+         "ip": f"10.{slot}.1.1"}
+        for slot in range(POOL_SIZE)
+    ])
+    db.session.commit()
+
+
+def test_allocate_ip_for(app):
+    room = Room(num=101, base_ip="1.1", ips_allocated=0)
+    first = _rezident("01", room)
+    second = _rezident("02", room)
+    db.session.commit()
+    assert first.devices[0].allocate_ip_for(room) == "10.0.1.1"
+    assert second.devices[0].allocate_ip_for(room) == "10.1.1.1"
+    # Already allocated
+    assert first.devices[0].allocate_ip_for(room) == "10.0.1.1"
+
+
+def test_freed_address_reused(app):
+    room = Room(num=101, base_ip="1.1", ips_allocated=0)
+    first = _rezident("01", room)
+    second = _rezident("02", room)
+    db.session.commit()
+    first.devices[0].allocate_ip_for(room)
+    second.devices[0].allocate_ip_for(room)
+    # Device deleted: its allocation too
+    db.session.delete(Allocation.query.filter_by(device=first.devices[0])
+                      .one())
+    db.session.commit()
+    third = _rezident("03", room)
+    db.session.commit()
+    assert third.devices[0].allocate_ip_for(room) == "10.0.1.1"
+
+
+def test_stale_allocation_reused(app):
+    room = Room(num=101, base_ip="1.1", ips_allocated=0)
+    former = _rezident("01", room, left=True)
+    current = _rezident("02", room)
+    db.session.commit()
+    # Pool full: oldest slots allocated to former occupant devices
+    _fill(room, lambda slot: former if slot < 2 else current)
+    newcomer = _rezident("03", room)
+    db.session.commit()
+    stale = Allocation.query.filter_by(ip="10.0.1.1").one()
+
+    assert newcomer.devices[0].allocate_ip_for(room) == "10.0.1.1"
+    assert Allocation.query.get(stale.id) is None
+    assert Allocation.query.filter_by(ip="10.0.1.1").one().device \
+        == newcomer.devices[0]
+    assert db.session.execute(
+        sa.select(sa.func.count(Allocation.id))
+    ).scalar() == POOL_SIZE
+
+
+def test_pool_exhausted_in_database(app):
+    room = Room(num=101, base_ip="1.1", ips_allocated=0)
+    current = _rezident("01", room)
+    db.session.commit()
+    _fill(room, lambda slot: current)
+    newcomer = _rezident("02", room)
+    db.session.commit()
+    with pytest.raises(IPPoolExhausted):
+        newcomer.devices[0].allocate_ip_for(room)
@@ -0,0 +1,80 @@
+"""Intranet de la Rez - Kea control socket client and backend tests"""
+
+import json
+import os
+
+import flask
+import pytest
+
+from app.tools import dhcp
+from app.tools.kea import ControlClient, FakeControlSocket, KeaError
+
+
+ENTRIES = {"1": {"room": 101,
+                 "hosts": [["rez1-pc", "01:23:45:67:89:ab", "10.0.101.2"]],
+                 "rental_end": None, "ban_end": None}}
+
+
+@pytest.fixture
+def kea_app(tmp_path):
+    app = flask.Flask(__name__)
+    app.config.update(DHCP_BACKEND="kea", DHCP_FORMAT="kea",
+                      KEA_CONTROL_SOCKET=str(tmp_path / "kea.sock"))
+    with app.app_context():
+        yield app
+
+
+def test_config_reload(tmp_path):
+    reservations = tmp_path / "reservations.json"
+    reservations.write_text('[{"hw-address": "01:23:45:67:89:ab"}]')
+    with FakeControlSocket(str(tmp_path / "kea.sock"),
+                           str(reservations)) as server:
+        client = ControlClient(server.path)
+        assert client.config_reload()["result"] == 0
+        assert server.reservations == [{"hw-address": "01:23:45:67:89:ab"}]
+        with pytest.raises(KeaError):
+            client.command("shutdown")
+    assert [command["command"] for command in server.commands] == [
+        "config-reload", "shutdown"
+    ]
+
+
+def test_config_reload_failure(tmp_path):
+    reservations = tmp_path / "reservations.json"
+    reservations.write_text("{not json")
+    with FakeControlSocket(str(tmp_path / "kea.sock"), str(reservations)):
+        with pytest.raises(KeaError):
+            ControlClient(str(tmp_path / "kea.sock")).config_reload()
+
+
+def test_unreachable_socket(tmp_path):
+    with pytest.raises(KeaError):
+        ControlClient(str(tmp_path / "missing.sock"),
+                      timeout=1).config_reload()
+
+
+def test_backend_reload(kea_app, tmp_path):
+    file = str(tmp_path / "hosts.json")
+    with FakeControlSocket(kea_app.config["KEA_CONTROL_SOCKET"],
+                           file) as server:
+        assert dhcp._write(file, ENTRIES, None)
+        assert len(server.reservations) == 1
+    # Reloaded: the watcher should not restart the server
+    with open(f"{file}.index.json") as fp:
+        content_hash = json.load(fp)["hash"]
+    with open(f"{file}.applied") as fp:
+        assert fp.read() == content_hash
+
+
+def test_backend_reload_failure_falls_back_to_restart(kea_app, tmp_path):
+    file = str(tmp_path / "hosts.json")
+    invalid = tmp_path / "invalid.json"
+    invalid.write_text("{not json")
+    with FakeControlSocket(kea_app.config["KEA_CONTROL_SOCKET"],
+                           str(invalid)) as server:
+        assert dhcp._write(file, ENTRIES, None)
+        assert server.commands == [{"command": "config-reload"}]
+    # Reload failed: the watcher should restart the server
+    assert not os.path.exists(f"{file}.applied")
+    with open(file) as fp:
+        assert "01:23:45:67:89:ab" in fp.read()
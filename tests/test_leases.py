@@ -0,0 +1,223 @@
+"""Intranet de la Rez - DHCP leases ingestion tests"""
+
+import datetime
+import os
+
+from app import db
+from app.models import Device, Rezident
+from app.tools.leases import NEVER, LeasesIngester, parse_leases
+
+
+HEADER = (b"# The format of this file is documented in the dhcpd.leases(5)\n"
+          b"# This lease file was written by isc-dhcp-4.4.1\n"
+          b"\n"
+          b"authoring-byte-order little-endian;\n"
+          b"\n")
+
+
+def _lease(ip: str, mac: str, state: str = "active",
+           ends: str = "4 2099/01/01 00:00:00") -> bytes:
+    # A lease block, as written by dhcpd
+    return (f"lease {ip} {{\n"
+            f"  starts 4 2022/01/06 10:00:00;\n"
+            f"  ends {ends};\n"
+            f"  cltt 4 2022/01/06 10:00:00;\n"
+            f"  binding state {state};\n"
+            f"  next binding state free;\n"
+            f"  rewind binding state free;\n"
+            f"  hardware ethernet {mac};\n"
+            f"  uid \"\\001{mac}\";\n"
+            f"  client-hostname \"host\";\n"
+            f"}}\n").encode()
+
+
+def _append(path: os.PathLike, data: bytes) -> None:
+    # Append data to a file, as dhcpd does
+    with open(path, "ab") as fp:
+        fp.write(data)
+
+
+def _rewrite(path: os.PathLike, data: bytes) -> None:
+    # Replace a file by a new one, as dhcpd does when rewriting it
+    with open(f"{path}~", "wb") as fp:
+        fp.write(data)
+    os.replace(f"{path}~", path)
+
+
+def _ingester(tmp_path: os.PathLike) -> LeasesIngester:
+    # An ingester of tmp_path/dhcpd.leases
+    return LeasesIngester(str(tmp_path / "dhcpd.leases"),
+                          str(tmp_path / "leases.state"))
+
+
+def _commit(ingester: LeasesIngester, inode: int, offset: int) -> None:
+    # Keep the position reached, as ingest does
+    ingester.inode, ingester.offset = inode, offset
+
+
+def test_parse_leases():
+    data = (HEADER + _lease("10.0.1.1", "AA:00:00:00:00:01")
+            + _lease("10.1.1.1", "aa:00:00:00:00:02", state="free",
+                     ends="never"))
+    leases, consumed = parse_leases(data)
+    assert consumed == len(data)
+    assert [(lease.ip, lease.mac, lease.state) for lease in leases] == [
+        ("10.0.1.1", "aa:00:00:00:00:01", "active"),
+        ("10.1.1.1", "aa:00:00:00:00:02", "free"),
+    ]
+    assert leases[0].starts == datetime.datetime(2022, 1, 6, 10)
+    assert leases[0].cltt == datetime.datetime(2022, 1, 6, 10)
+    assert leases[0].ends == datetime.datetime(2099, 1, 1)
+    assert leases[0].is_active
+    assert leases[1].ends is None
+    assert not leases[1].is_active
+
+
+def test_parse_leases_epoch():
+    data = _lease("10.0.1.1", "aa:00:00:00:00:01", ends="epoch 1641463200")
+    leases, _ = parse_leases(data)
+    assert leases[0].ends == datetime.datetime(2022, 1, 6, 10)
+
+
+def test_parse_leases_half_written():
+    lease = _lease("10.0.1.1", "aa:00:00:00:00:01")
+    block = _lease("10.1.1.1", "aa:00:00:00:00:02")
+    for cut in (b"lease 10.1.1.1 {\n", block[:40], block[:-2], block[:-1]):
+        leases, consumed = parse_leases(HEADER + lease + cut)
+        assert [lease.ip for lease in leases] == ["10.0.1.1"]
+        assert consumed == len(HEADER + lease)
+
+
+def test_read_append(tmp_path):
+    path = tmp_path / "dhcpd.leases"
+    first = _lease("10.0.1.1", "aa:00:00:00:00:01")
+    _rewrite(path, HEADER + first)
+    ingester = _ingester(tmp_path)
+
+    leases, inode, offset, restarted = ingester.read()
+    assert [lease.ip for lease in leases] == ["10.0.1.1"]
+    assert inode == os.stat(path).st_ino
+    assert offset == len(HEADER + first)
+    assert restarted
+    # Position not kept by read: same leases read again
+    assert ingester.read() == (leases, inode, offset, restarted)
+    _commit(ingester, inode, offset)
+
+    # Nothing new
+    assert ingester.read() == ([], inode, offset, False)
+
+    # Blocks appended: only them read
+    second = (_lease("10.1.1.1", "aa:00:00:00:00:02")
+              + _lease("10.0.1.1", "aa:00:00:00:00:01", state="free"))
+    _append(path, second)
+    leases, inode, offset, restarted = ingester.read()
+    assert [(lease.ip, lease.state) for lease in leases] == [
+        ("10.1.1.1", "active"), ("10.0.1.1", "free")
+    ]
+    assert offset == len(HEADER + first + second)
+    assert not restarted
+
+
+def test_read_half_written_block(tmp_path):
+    path = tmp_path / "dhcpd.leases"
+    first = _lease("10.0.1.1", "aa:00:00:00:00:01")
+    block = _lease("10.1.1.1", "aa:00:00:00:00:02")
+    _rewrite(path, HEADER + first + b"lease 10.1.1.1 {\n")
+    ingester = _ingester(tmp_path)
+
+    # Block being written: left for next time
+    leases, inode, offset, _ = ingester.read()
+    assert [lease.ip for lease in leases] == ["10.0.1.1"]
+    assert offset == len(HEADER + first)
+    _commit(ingester, inode, offset)
+
+    _append(path, block[len(b"lease 10.1.1.1 {\n"):-2])
+    assert ingester.read() == ([], inode, offset, False)
+
+    # Block completed: read from its beginning
+    _append(path, block[-2:])
+    leases, inode, offset, restarted = ingester.read()
+    assert [(lease.ip, lease.mac) for lease in leases] == [
+        ("10.1.1.1", "aa:00:00:00:00:02")
+    ]
+    assert offset == len(HEADER + first + block)
+    assert not restarted
+
+
+def test_read_rotation(tmp_path):
+    path = tmp_path / "dhcpd.leases"
+    _rewrite(path, HEADER + _lease("10.0.1.1", "aa:00:00:00:00:01")
+             + _lease("10.1.1.1", "aa:00:00:00:00:02"))
+    ingester = _ingester(tmp_path)
+    _commit(ingester, *ingester.read()[1:3])
+
+    # File rewritten by dhcpd (new inode): read from its beginning, even
+    # if longer than the position reached
+    rewritten = (HEADER + _lease("10.1.1.1", "aa:00:00:00:00:02")
+                 + _lease("10.2.1.1", "aa:00:00:00:00:03")
+                 + _lease("10.3.1.1", "aa:00:00:00:00:04"))
+    old_inode = ingester.inode
+    _rewrite(path, rewritten)
+    leases, inode, offset, restarted = ingester.read()
+    assert inode != old_inode
+    assert [lease.ip for lease in leases] == ["10.1.1.1", "10.2.1.1",
+                                              "10.3.1.1"]
+    assert offset == len(rewritten)
+    assert restarted
+
+
+def test_read_truncated(tmp_path):
+    path = tmp_path / "dhcpd.leases"
+    _rewrite(path, HEADER + _lease("10.0.1.1", "aa:00:00:00:00:01")
+             + _lease("10.1.1.1", "aa:00:00:00:00:02"))
+    ingester = _ingester(tmp_path)
+    _commit(ingester, *ingester.read()[1:3])
+
+    # Truncated in place (same inode, shorter): read from its beginning
+    with open(path, "wb") as fp:
+        fp.write(HEADER + _lease("10.2.1.1", "aa:00:00:00:00:03"))
+    leases, inode, offset, restarted = ingester.read()
+    assert inode == ingester.inode
+    assert [lease.ip for lease in leases] == ["10.2.1.1"]
+    assert restarted
+
+
+def test_ingest(app, tmp_path):
+    path = tmp_path / "dhcpd.leases"
+    rezident = Rezident(username="test")
+    for num in range(1, 4):
+        rezident.devices.append(Device(
+            mac_address=f"aa:00:00:00:00:0{num}",
+            registered=datetime.datetime(2022, 1, 1),
+            online_until=datetime.datetime(2022, 1, 1),
+        ))
+    db.session.add(rezident)
+    db.session.commit()
+    _rewrite(path, HEADER
+             + _lease("10.0.1.1", "aa:00:00:00:00:01")
+             + _lease("10.1.1.1", "aa:00:00:00:00:02", ends="never")
+             + _lease("10.2.1.1", "aa:00:00:00:00:03")
+             + _lease("10.3.1.1", "aa:00:00:00:00:99")      # Unknown
+             + _lease("10.2.1.1", "aa:00:00:00:00:03", state="free"))
+
+    result = _ingester(tmp_path).ingest()
+    assert result.leases == 5
+    assert result.devices == 3
+    assert result.online == 2
+    assert result.restarted
+    db.session.expire_all()
+    online = {device.mac_address: device.online_until
+              for device in rezident.devices}
+    assert online == {
+        "aa:00:00:00:00:01": datetime.datetime(2099, 1, 1),
+        "aa:00:00:00:00:02": NEVER,
+        "aa:00:00:00:00:03": None,      # Latest lease freed
+    }
+    assert all(device.last_seen == datetime.datetime(2022, 1, 6, 10)
+               for device in rezident.devices)
+
+    # Position saved: a new ingester starts from it
+    _append(path, _lease("10.0.1.1", "aa:00:00:00:00:01", state="free"))
+    result = _ingester(tmp_path).ingest()
+    assert (result.leases, result.devices, result.online) == (1, 1, 0)
+    assert not result.restarted
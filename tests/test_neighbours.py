@@ -0,0 +1,110 @@
+"""Intranet de la Rez - Neighbour table resolution tests"""
+
+import errno
+
+import pytest
+
+from app.tools.neighbours import (NeighbourEvent, NeighbourTable,
+                                  NetlinkNeighbourSource,
+                                  ReplayNeighbourSource)
+
+
+ARP_HEADER = ("IP address       HW type     Flags       HW address            "
+              "Mask     Device\n")
+ARP_LINE = "{:<16} 0x1         0x2         {}     *        eth0\n"
+
+
+def test_replay_source_round_trip():
+    events = [
+        NeighbourEvent("new", "10.0.1.1", "01:23:45:67:89:ab"),
+        NeighbourEvent("del", "10.0.1.2", None),
+    ]
+    assert list(ReplayNeighbourSource(events)) == events
+
+
+def test_replay_source_from_file(tmp_path):
+    file = tmp_path / "events.txt"
+    file.write_text("# Replayed events\n"
+                    "new 10.0.1.1 01:23:45:67:89:ab\n"
+                    "\n"
+                    "del 10.0.1.1   # Entry expired\n")
+    assert list(ReplayNeighbourSource.from_file(str(file))) == [
+        NeighbourEvent("new", "10.0.1.1", "01:23:45:67:89:ab"),
+        NeighbourEvent("del", "10.0.1.1", None),
+    ]
+
+
+def test_table_applies_replayed_events(tmp_path):
+    arp_file = tmp_path / "arp"
+    arp_file.write_text(ARP_HEADER + ARP_LINE.format("10.0.2.1",
+                                                     "aa:bb:cc:dd:ee:ff"))
+    source = ReplayNeighbourSource([
+        NeighbourEvent("new", "10.0.1.1", "01:23:45:67:89:ab"),
+        NeighbourEvent("new", "10.0.1.2", "01:23:45:67:89:cd"),
+        NeighbourEvent("del", "10.0.1.2", "01:23:45:67:89:cd"),
+    ])
+    table = NeighbourTable(source, arp_file=str(arp_file))
+    table.start()
+    table._thread.join(timeout=5)
+    assert table.get("10.0.2.1") == "aa:bb:cc:dd:ee:ff"
+    assert table.get("10.0.1.1") == "01:23:45:67:89:ab"
+    assert table.get("10.0.1.2") is None
+    assert table.stats() == {"entries": 2, "hits": 2, "misses": 1,
+                             "new_events": 2, "del_events": 1,
+                             "resyncs": 0, "fallback": False}
+
+
+def test_table_resynced_after_lost_events(tmp_path):
+    arp_file = tmp_path / "arp"
+    arp_file.write_text(ARP_HEADER)
+    lost = OSError(errno.ENOBUFS, "No buffer space available")
+    source = ReplayNeighbourSource([
+        NeighbourEvent("new", "10.0.1.1", "01:23:45:67:89:ab"),
+        lost,
+        NeighbourEvent("new", "10.0.1.3", "01:23:45:67:89:ef"),
+    ])
+    table = NeighbourTable(source, arp_file=str(arp_file))
+    table.prime()
+    # Events lost during the burst: 10.0.1.1 left, 10.0.1.2 arrived
+    arp_file.write_text(ARP_HEADER + ARP_LINE.format("10.0.1.2",
+                                                     "01:23:45:67:89:cd"))
+    table.run()
+    assert table.get("10.0.1.1") is None
+    assert table.get("10.0.1.2") == "01:23:45:67:89:cd"
+    assert table.get("10.0.1.3") == "01:23:45:67:89:ef"    # Still updated
+    assert table.resyncs == 1
+    assert table.fallback is None
+
+
+def test_table_falls_back_to_arp_cache(tmp_path):
+    arp_file = tmp_path / "arp"
+    arp_file.write_text(ARP_HEADER + ARP_LINE.format("10.0.1.2",
+                                                     "01:23:45:67:89:cd"))
+    source = ReplayNeighbourSource([OSError(errno.EIO, "I/O error")])
+    table = NeighbourTable(source, arp_file=str(arp_file))
+    table.run()
+    assert table.fallback is not None
+    assert table.get("10.0.1.2") == "01:23:45:67:89:cd"
+
+
+def test_replay_stops_when_closed():
+    source = ReplayNeighbourSource(
+        [NeighbourEvent("new", "10.0.1.1", "01:23:45:67:89:ab")], delay=10.0
+    )
+    table = NeighbourTable(source, arp_file=None)
+    table.start()
+    table.stop()
+    assert not table._thread.is_alive()
+    assert table.stats()["new_events"] == 0
+
+
+def test_netlink_source_stops_when_closed():
+    try:
+        source = NetlinkNeighbourSource()
+    except OSError as exc:
+        pytest.skip(f"netlink unavailable: {exc}")
+    table = NeighbourTable(source, arp_file=None)
+    table.start()
+    table.stop()
+    assert not table._thread.is_alive()
+    assert table.fallback is None
@@ -0,0 +1,193 @@
+"""Intranet de la Rez - nftables bans set synchronisation tests"""
+
+import json
+import os
+import sys
+
+import flask
+import pytest
+
+from app.tools import nftables
+
+
+# Minimal nft stand-in: handles the commands used by tools.nftables,
+# keeps the ruleset in ruleset.json and logs calls in calls.log
+FAKE_NFT = """
+import json, os, sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+ruleset_file = os.path.join(here, "ruleset.json")
+with open(os.path.join(here, "calls.log"), "a") as fp:
+    fp.write(" ".join(sys.argv[1:]) + "\\n")
+try:
+    with open(ruleset_file) as fp:
+        ruleset = json.load(fp)
+except OSError:
+    ruleset = {"tables": [], "sets": {}}
+
+def fail(message):
+    sys.stderr.write(f"Error: {message}\\n")
+    sys.exit(1)
+
+if sys.argv[1:3] == ["-j", "list"]:
+    family, table, name = sys.argv[4:7]
+    elements = ruleset["sets"].get(f"{family} {table} {name}")
+    if elements is None:
+        fail("No such file or directory; did you mean table 'filter'?")
+    description = {"family": family, "name": name, "table": table,
+                   "type": "ether_addr", "handle": 1}
+    if elements:
+        description["elem"] = elements
+    print(json.dumps({"nftables": [{"metainfo": {}}, {"set": description}]}))
+    sys.exit(0)
+
+for line in sys.stdin.read().splitlines():
+    words = line.split("{")[0].split()
+    elements = set()
+    if "{" in line and words[1] == "element":
+        elements = {elem.strip() for elem
+                    in line.split("{")[1].rstrip(" }").split(",")}
+    if words[:2] == ["add", "table"]:
+        if " ".join(words[2:]) not in ruleset["tables"]:
+            ruleset["tables"].append(" ".join(words[2:]))
+        continue
+    target = " ".join(words[2:5])
+    if " ".join(words[2:4]) not in ruleset["tables"]:
+        fail("Could not process rule: No such file or directory")
+    if words[:2] == ["add", "set"]:
+        ruleset["sets"].setdefault(target, [])
+        continue
+    if target not in ruleset["sets"]:
+        fail("Could not process rule: No such file or directory")
+    content = set(ruleset["sets"][target])
+    if words[0] == "flush":
+        content = set()
+    elif words[0] == "delete":
+        if elements - content:
+            fail("Could not process rule: No such file or directory")
+        content -= elements
+    else:
+        content |= elements
+    ruleset["sets"][target] = sorted(content)
+
+with open(ruleset_file, "w") as fp:
+    json.dump(ruleset, fp)
+"""
+
+TARGET = "inet intrarez banned_macs"
+MAC_A = "01:23:45:67:89:aa"
+MAC_B = "01:23:45:67:89:bb"
+MAC_C = "01:23:45:67:89:cc"
+
+
+@pytest.fixture
+def nft(tmp_path, monkeypatch):
+    command = tmp_path / "nft"
+    command.write_text(f"#!{sys.executable}\n{FAKE_NFT}")
+    command.chmod(0o755)
+    app = flask.Flask(__name__)
+    app.config.update(NFT_COMMAND=str(command), NFT_TABLE="inet intrarez",
+                      NFT_SET="banned_macs",
+                      NFT_STATE_FILE=str(tmp_path / "state.json"))
+    banned = set()
+    monkeypatch.setattr(nftables, "banned_macs", lambda: set(banned))
+    with app.app_context():
+        yield banned
+
+
+def _kernel_set(tmp_path):
+    # Content of the set in the fake ruleset, or None if it does not exist
+    try:
+        with open(tmp_path / "ruleset.json") as fp:
+            return set(json.load(fp)["sets"][TARGET])
+    except (OSError, KeyError):
+        return None
+
+
+def _applied(tmp_path):
+    # Number of scripts applied by the fake nft
+    with open(tmp_path / "calls.log") as fp:
+        return sum(line.startswith("-f") for line in fp)
+
+
+def _state(tmp_path):
+    with open(tmp_path / "state.json") as fp:
+        return set(json.load(fp))
+
+
+def test_first_sync(nft, tmp_path):
+    nft.update({MAC_A, MAC_B})
+    result = nftables.sync()
+    assert result.added == {MAC_A, MAC_B}
+    assert _kernel_set(tmp_path) == {MAC_A, MAC_B}
+    assert _state(tmp_path) == {MAC_A, MAC_B}
+
+
+def test_incremental_sync(nft, tmp_path):
+    nft.update({MAC_A, MAC_B})
+    nftables.sync()
+    nft.discard(MAC_B)
+    nft.add(MAC_C)
+    result = nftables.sync()
+    assert (result.added, result.removed, result.full) == ({MAC_C}, {MAC_B},
+                                                           False)
+    assert _kernel_set(tmp_path) == {MAC_A, MAC_C}
+
+
+def test_nothing_changed(nft, tmp_path):
+    nft.add(MAC_A)
+    nftables.sync()
+    assert nftables.sync().script == ""
+    assert _applied(tmp_path) == 1
+
+
+def test_kernel_set_lost(nft, tmp_path):
+    # State file present, ruleset flushed (reboot, firewall reload...)
+    nft.update({MAC_A, MAC_B})
+    nftables.sync()
+    os.remove(tmp_path / "ruleset.json")
+    result = nftables.sync()
+    assert result.added == {MAC_A, MAC_B}
+    assert _kernel_set(tmp_path) == {MAC_A, MAC_B}
+
+
+def test_kernel_set_emptied(nft, tmp_path):
+    # State file present, set recreated empty
+    nft.update({MAC_A, MAC_B})
+    nftables.sync()
+    with open(tmp_path / "ruleset.json") as fp:
+        ruleset = json.load(fp)
+    ruleset["sets"][TARGET] = []
+    with open(tmp_path / "ruleset.json", "w") as fp:
+        json.dump(ruleset, fp)
+    nft.add(MAC_C)
+    nftables.sync()
+    assert _kernel_set(tmp_path) == {MAC_A, MAC_B, MAC_C}
+
+
+def test_incremental_failure_rewrites_set(nft, tmp_path, monkeypatch):
+    nft.update({MAC_A, MAC_B})
+    nftables.sync()
+    # Set changed between listing and update
+    monkeypatch.setattr(nftables, "live_set", lambda: {MAC_A, MAC_B, MAC_C})
+    result = nftables.sync()
+    assert result.full
+    assert _kernel_set(tmp_path) == {MAC_A, MAC_B}
+
+
+def test_output_uses_saved_state(nft, tmp_path):
+    nft.add(MAC_A)
+    nftables.sync(output=str(tmp_path / "full.nft"))
+    nft.add(MAC_B)
+    result = nftables.sync(output=str(tmp_path / "update.nft"))
+    assert (result.added, result.full) == ({MAC_B}, False)
+    assert not (tmp_path / "calls.log").exists()
+    assert _state(tmp_path) == {MAC_A, MAC_B}
+
+
+def test_dry_run(nft, tmp_path):
+    nft.add(MAC_A)
+    result = nftables.sync(dry_run=True)
+    assert result.added == {MAC_A}
+    assert _kernel_set(tmp_path) is None
+    assert not (tmp_path / "state.json").exists()
@@ -0,0 +1,42 @@
+"""Intranet de la Rez - OMAPI client tests"""
+
+import pytest
+
+from app.tools.omapi import Client, FakeServer, OmapiError
+
+
+def test_add_delete_host():
+    with FakeServer() as server:
+        with Client("127.0.0.1", server.port) as client:
+            client.add_host("rez1-pc", "01:23:45:67:89:ab", "10.0.1.2")
+            assert server.hosts == {
+                "rez1-pc": ("01:23:45:67:89:ab", "10.0.1.2")
+            }
+            assert client.lookup_host("rez1-pc") is not None
+            with pytest.raises(OmapiError):
+                client.add_host("rez1-pc", "01:23:45:67:89:cd", "10.0.1.3")
+            assert client.delete_host("rez1-pc")
+            assert server.hosts == {}
+            assert client.lookup_host("rez1-pc") is None
+            assert not client.delete_host("rez1-pc")
+
+
+def test_authenticated_round_trip():
+    with FakeServer("omapi_key", b"secret") as server:
+        with Client("127.0.0.1", server.port, "omapi_key",
+                    b"secret") as client:
+            client.add_host("rez1-pc", "01:23:45:67:89:ab", "10.0.1.2")
+            assert client.delete_host("rez1-pc")
+        assert server.hosts == {}
+
+
+def test_wrong_key_rejected():
+    with FakeServer("omapi_key", b"secret") as server:
+        with pytest.raises(OmapiError):
+            with Client("127.0.0.1", server.port, "other_key", b"secret"):
+                pass
+        with Client("127.0.0.1", server.port, "omapi_key",
+                    b"wrong") as client:
+            with pytest.raises(OmapiError):     # Bad signature
+                client.add_host("rez1-pc", "01:23:45:67:89:ab", "10.0.1.2")
+        assert server.hosts == {}
@@ -0,0 +1,175 @@
+"""Intranet de la Rez - Mails outbox tests"""
+
+import datetime
+import smtplib
+
+import flask
+import flask_mail
+import pytest
+
+from app import db, email
+from app.enums import MailStatus
+from app.models import OutboxMail
+
+
+def _msg() -> flask_mail.Message:
+    # A simple mail
+    return flask_mail.Message(subject="Test", sender="intrarez@localhost",
+                              recipients=["rezident@localhost"], body="Hi")
+
+
+def _expire(mail_id: int, seconds: float = 1) -> None:
+    # Move the next attempt of an outbox mail in the past
+    mail = OutboxMail.query.get(mail_id)
+    mail.next_attempt = (datetime.datetime.utcnow()
+                         - datetime.timedelta(seconds=seconds))
+    db.session.commit()
+
+
+def _mail(mail_id: int) -> OutboxMail:
+    # An outbox mail, as stored in the database
+    db.session.expire_all()
+    return OutboxMail.query.get(mail_id)
+
+
+def test_enqueue(app):
+    mail_id = email.enqueue("test", _msg())
+    mail = _mail(mail_id)
+    assert mail.status == MailStatus.sending
+    assert mail.attempts == 0
+    assert mail.recipients == ["rezident@localhost"]
+    # Claimed for send_timeout seconds by the enqueuing process
+    assert mail.next_attempt - mail.created == datetime.timedelta(
+        seconds=email.dispatcher.send_timeout
+    )
+
+
+def test_enqueue_dedup(app):
+    first = email.enqueue("test", _msg(), dedup_key="key")
+    assert first is not None
+    assert email.enqueue("test", _msg(), dedup_key="key") is None
+    assert email.enqueue("test", _msg(), dedup_key="other") is not None
+    # No key: never deduplicated
+    assert email.enqueue("test", _msg()) != email.enqueue("test", _msg())
+    assert OutboxMail.query.filter_by(dedup_key="key").count() == 1
+    assert OutboxMail.query.count() == 4
+
+
+def test_claim_due_lease_expiry(app):
+    mail_id = email.enqueue("test", _msg())
+    # Being sent by the enqueuing process: not claimable
+    assert email.claim_due(10) == []
+
+    # Lease expired (process stopped while sending): claimed again
+    _expire(mail_id)
+    jobs = email.claim_due(10)
+    assert [job.mail_id for job in jobs] == [mail_id]
+    assert jobs[0].msg.subject == "Test"
+    assert jobs[0].msg.recipients == ["rezident@localhost"]
+    mail = _mail(mail_id)
+    assert mail.status == MailStatus.sending
+    assert mail.next_attempt > datetime.datetime.utcnow()
+    # Claimed once only
+    assert email.claim_due(10) == []
+
+
+def test_claim_due_limit_and_order(app):
+    ids = [email.enqueue("test", _msg()) for _ in range(3)]
+    for seconds, mail_id in zip((10, 30, 20), ids):
+        _expire(mail_id, seconds)
+    assert email.claim_due(0) == []
+    assert [job.mail_id for job in email.claim_due(2)] == [ids[1], ids[2]]
+    assert [job.mail_id for job in email.claim_due(2)] == [ids[0]]
+
+
+def test_record_attempt_sent(app):
+    mail_id = email.enqueue("test", _msg())
+    email._record_attempt(mail_id, 1, None)
+    mail = _mail(mail_id)
+    assert mail.status == MailStatus.sent
+    assert mail.sent is not None
+    assert mail.attempts == 1
+
+
+def test_record_attempt_backoff(app, monkeypatch):
+    monkeypatch.setattr(email.dispatcher, "retry_delay", 60.0)
+    monkeypatch.setattr(email.dispatcher, "retry_max_delay", 300.0)
+    monkeypatch.setattr(email.dispatcher, "max_attempts", 10)
+    mail_id = email.enqueue("test", _msg())
+    exc = smtplib.SMTPServerDisconnected("Connection lost")
+    for attempts, delay in ((1, 60), (2, 120), (3, 240), (4, 300), (5, 300)):
+        before = datetime.datetime.utcnow()
+        email._record_attempt(mail_id, attempts, exc)
+        after = datetime.datetime.utcnow()
+        mail = _mail(mail_id)
+        assert mail.status == MailStatus.pending
+        assert mail.attempts == attempts
+        assert mail.last_error == "SMTPServerDisconnected: Connection lost"
+        assert (before + datetime.timedelta(seconds=delay)
+                <= mail.next_attempt
+                <= after + datetime.timedelta(seconds=delay))
+    # Not due yet
+    assert email.claim_due(10) == []
+
+
+def test_record_attempt_max_attempts(app, monkeypatch):
+    monkeypatch.setattr(email.dispatcher, "max_attempts", 3)
+    mail_id = email.enqueue("test", _msg())
+    exc = smtplib.SMTPServerDisconnected("Connection lost")
+    email._record_attempt(mail_id, 2, exc)
+    assert _mail(mail_id).status == MailStatus.pending
+    email._record_attempt(mail_id, 3, exc)
+    mail = _mail(mail_id)
+    assert mail.status == MailStatus.failed
+    assert mail.attempts == 3
+    # Failed mails are never claimed
+    _expire(mail_id)
+    assert email.claim_due(10) == []
+
+
+@pytest.mark.parametrize("exc", [
+    smtplib.SMTPRecipientsRefused({"rezident@localhost": (550, b"Unknown")}),
+    smtplib.SMTPDataError(554, "Rejected"),
+])
+def test_record_attempt_permanent_failure(app, exc):
+    mail_id = email.enqueue("test", _msg())
+    email._record_attempt(mail_id, 1, exc)
+    mail = _mail(mail_id)
+    assert mail.status == MailStatus.failed
+    assert mail.attempts == 1
+    assert mail.last_error.startswith(type(exc).__name__)
+
+    # Rescheduled by hand
+    assert email.retry(mail_id)
+    db.session.commit()
+    mail = _mail(mail_id)
+    assert mail.status == MailStatus.pending
+    assert mail.attempts == 0
+    assert [job.mail_id for job in email.claim_due(10)] == [mail_id]
+    # Only failed mails can be
+    assert not email.retry(mail_id)
+
+
+def test_record_attempt_temporary_smtp_error(app):
+    mail_id = email.enqueue("test", _msg())
+    email._record_attempt(mail_id, 1, smtplib.SMTPDataError(451, "Later"))
+    assert _mail(mail_id).status == MailStatus.pending
+
+
+def test_mails_page_mail_deleted(app, monkeypatch):
+    # Mail deleted between form validation and its loading (purge...)
+    from app.gris import routes
+    from app.tools import validators
+
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", False)
+    monkeypatch.setattr(validators.ValidOutboxMailID, "validate",
+                        lambda self, form, field: True)
+    with app.test_request_context("/gris/mails", method="POST",
+                                  data={"mail_id": "42", "retry": "1"}):
+        flask.g.logged_in = False       # Set by context.create_request_context
+        response = routes.mails.__wrapped__()
+        assert response.status_code == 302
+        assert response.location.endswith("/gris/mails")
+        assert flask.get_flashed_messages(with_categories=True) == [
+            ("danger", "Ce mail n'existe plus !")
+        ]
@@ -0,0 +1,13 @@
+"""Intranet de la Rez - Subscription state transitions scheduler tests"""
+
+import sqlalchemy as sa
+
+from app import db
+from app.tools import scheduler
+
+
+def test_rollback_discards_pending_changes(app):
+    db.session.execute(sa.text("SELECT 1"))
+    db.session.info[scheduler._PENDING_KEY] = {1}
+    db.session.rollback()
+    assert scheduler._PENDING_KEY not in db.session.info
@@ -0,0 +1,159 @@
+"""Intranet de la Rez - Set-based subscription states update tests
+
+The bulk engine (:mod:`app.tools.sub_states`) must give the same states
+as :meth:`.models.Rezident.compute_sub_state`, on all boundary dates.
+"""
+
+import datetime
+
+import sqlalchemy as sa
+
+from app import db
+from app.enums import SubState
+from app.models import Ban, Offer, Rental, Rezident, Room, Subscription
+from app.tools import sub_states
+
+
+DAY = datetime.timedelta(days=1)
+
+
+def _end_with_cut_day(cut_day: datetime.date) -> datetime.date:
+    # The subscription end whose cut day is cut_day
+    return Subscription.first_active_end(cut_day - DAY)
+
+
+def _populate(today: datetime.date) -> dict[str, Rezident]:
+    # One rezident per state / boundary, named after it
+    first_active_end = Subscription.first_active_end(today)
+    offer = Offer(slug="test", name_fr="Test", name_en="Test")
+    room = Room(num=101)
+    db.session.add_all([offer, room])
+    now = datetime.datetime.utcnow()
+
+    cases = {
+        # name: (initial state, [(start, end)...], has a room, ban end)
+        "no_subscription": (SubState.subscribed, [], True, None),
+        "no_subscription_trial": (SubState.trial, [], True, None),
+        "subscribed": (SubState.trial, [(today - 20 * DAY, today + DAY)],
+                       True, None),
+        "trial_start": (SubState.subscribed, [(today - 30 * DAY, today)],
+                        True, None),
+        "trial_yesterday": (SubState.subscribed,
+                            [(today - 30 * DAY, today - DAY)], True, None),
+        "trial_last_day": (SubState.subscribed,
+                           [(today - 60 * DAY, first_active_end)], True,
+                           None),
+        "cut_day": (SubState.trial,
+                    [(today - 60 * DAY, first_active_end - DAY)], True, None),
+        "cut_long_ago": (SubState.trial,
+                         [(today - 400 * DAY, today - 300 * DAY)], False,
+                         None),
+        "cut_already_outlaw": (SubState.outlaw,
+                               [(today - 400 * DAY, today - 300 * DAY)],
+                               True, None),
+        "cut_already_banned": (SubState.trial,
+                               [(today - 60 * DAY, first_active_end - DAY)],
+                               True, "open"),
+        "cut_ban_ended": (SubState.trial,
+                          [(today - 60 * DAY, first_active_end - DAY)], True,
+                          "ended"),
+        "renewed": (SubState.trial,
+                    [(today - 60 * DAY, first_active_end - DAY),
+                     (today - 2 * DAY, today + 30 * DAY)], True, None),
+        "latest_expired": (SubState.subscribed,
+                           [(today - 90 * DAY, today + 30 * DAY),
+                            (today - 80 * DAY, first_active_end - DAY)],
+                           True, None),
+        "reminder": (SubState.trial,
+                     [(today - 30 * DAY, _end_with_cut_day(today + 7 * DAY))],
+                     True, None),
+        "reminder_no_room": (SubState.trial,
+                             [(today - 30 * DAY,
+                               _end_with_cut_day(today + 7 * DAY))],
+                             False, None),
+        "reminder_day_before": (SubState.trial,
+                                [(today - 30 * DAY,
+                                  _end_with_cut_day(today + 6 * DAY))],
+                                True, None),
+        "reminder_day_after": (SubState.trial,
+                               [(today - 30 * DAY,
+                                 _end_with_cut_day(today + 8 * DAY))],
+                               True, None),
+    }
+    rezidents = {}
+    for name, (state, subscriptions, has_room, ban) in cases.items():
+        rezident = Rezident(username=name, sub_state=state, locale="fr")
+        for start, end in subscriptions:
+            rezident.subscriptions.append(
+                Subscription(offer=offer, start=start, end=end)
+            )
+        if has_room:
+            rezident.rentals.append(
+                Rental(room=room, start=today - 400 * DAY, end=None)
+            )
+        if ban:
+            rezident.bans.append(Ban(
+                start=now - datetime.timedelta(days=10),
+                end=None if ban == "open" else now - DAY,
+                reason="Test",
+            ))
+        db.session.add(rezident)
+        rezidents[name] = rezident
+    db.session.commit()
+    return rezidents
+
+
+def test_bulk_update_matches_compute_sub_state(app):
+    today = datetime.date.today()
+    rezidents = _populate(today)
+    expected = {name: rezident.compute_sub_state()
+                for name, rezident in rezidents.items()}
+    initial = {name: rezident.sub_state
+               for name, rezident in rezidents.items()}
+    expected_bans = {
+        name for name, state in expected.items()
+        if state == SubState.outlaw and initial[name] != SubState.outlaw
+        and not rezidents[name].is_banned
+    }
+    expected_reminders = {
+        name for name, rezident in rezidents.items()
+        if expected[name] == SubState.trial == initial[name]
+        and rezident.has_a_room and rezident.current_subscription
+        and rezident.current_subscription.cut_day == today + 7 * DAY
+    }
+    ids = {rezident.id: name for name, rezident in rezidents.items()}
+    bans_before = db.session.execute(
+        sa.select(sa.func.count(Ban.id))
+    ).scalar()
+
+    result = sub_states.update(today, send_mails=False)
+
+    assert {ids[transition.rezident_id]: transition.new
+            for transition in result.transitions} == {
+        name: state for name, state in expected.items()
+        if state != initial[name]
+    }
+    states = dict(db.session.execute(
+        sa.select(Rezident.username, Rezident.sub_state)
+    ).all())
+    assert states == expected
+    assert {ids[id] for id in result.banned} == expected_bans
+    assert {ids[id] for id in result.reminded} == expected_reminders
+    new_bans = db.session.execute(
+        sa.select(Rezident.username, Ban.end, Ban.reason)
+        .join(Ban.rezident).order_by(Ban.id).offset(bans_before)
+    ).all()
+    assert {username for username, _, _ in new_bans} == expected_bans
+    assert len(new_bans) == len(expected_bans)
+    assert all(end is None and reason for _, end, reason in new_bans)
+
+    # Up to date: nothing more to do
+    assert sub_states.pending_transitions(today) == []
+
+
+def test_boundaries_covered(app):
+    # The cases above hit each branch of compute_sub_state
+    today = datetime.date.today()
+    states = {rezident.compute_sub_state()
+              for rezident in _populate(today).values()}
+    assert states == {SubState.trial, SubState.subscribed, SubState.outlaw}
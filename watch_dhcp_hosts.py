@@ -4,11 +4,28 @@ Ce script est lancé en root au démarrage du système par une tâche supervisor
 (voir .conf_models/supervisor.conf).
 
 Il surveille le fichier contenant les règles DHCP (variable d'environment
-DHCP_HOSTS_FILE, voir .env) et relance le serveur DHCP dès qu'il est modifié.
+DHCP_HOSTS_FILE, voir .env) et relance le serveur DHCP quand il est modifié :
+  * Seules les écritures terminées sont prises en compte (fichier fermé
+    après écriture ou déplacé à sa place : IN_CLOSE_WRITE / IN_MOVED_TO,
+    on surveille donc le dossier) ;
+  * Le serveur n'est relancé qu'une fois le fichier stable depuis
+    DHCP_WATCH_QUIET_PERIOD secondes (une seule relance par rafale de
+    modifications, toujours avec la dernière version du fichier) ;
+  * La configuration est d'abord validée (`dhcpd -t`, ou la commande
+    DHCP_CHECK_COMMAND, par exemple `kea-dhcp4 -t <conf>` pour Kea) : si
+    elle est invalide, le serveur n'est pas relancé (il garde l'ancienne) ;
+  * Si les modifications ont déjà été appliquées en direct par l'IntraRez
+    (OMAPI ou rechargement Kea, DHCP_BACKEND="omapi" / "kea"), le fichier `<DHCP_HOSTS_FILE>.applied`
+    contient le hash du fichier : le serveur n'est alors pas relancé ;
+  * Les nombres et durées des relances sont enregistrés dans
+    `<DHCP_HOSTS_FILE>.watcher.json` (affichés dans la page de test GRI).
 """
 
+import hashlib
+import json
 import logging
 import os
+import shlex
 import subprocess
 import time
 
@@ -23,33 +40,146 @@ file = os.getenv("DHCP_HOSTS_FILE")
 if not file or not os.path.isfile(file):
     raise FileNotFoundError(f"Le ficher à surveiller '{file}' n'existe pas "
                             "(variable d'environment DHCP_HOSTS_FILE)")
+file = os.path.abspath(file)
+quiet_period = float(os.getenv("DHCP_WATCH_QUIET_PERIOD") or 2)
+dhcpd_command = os.getenv("DHCPD_COMMAND") or "dhcpd"
+dhcpd_conf = os.getenv("DHCPD_CONF") or "/etc/dhcp/dhcpd.conf"
+check_command = (shlex.split(os.getenv("DHCP_CHECK_COMMAND") or "")
+                 or [dhcpd_command, "-t", "-cf", dhcpd_conf])
+restart_command = shlex.split(os.getenv("DHCP_RESTART_COMMAND")
+                              or "systemctl restart isc-dhcp-server")
+stats_file = f"{file}.watcher.json"
+applied_file = f"{file}.applied"
 
-last_event = time.time()
+stats = {
+    "events": 0,                # Événements reçus
+    "bursts": 0,                # Rafales de modifications
+    "restarts": 0,              # Relances réussies
+    "failures": 0,              # Relances échouées
+    "invalid": 0,               # Configurations refusées par dhcpd -t
+    "live": 0,                  # Modifications déjà appliquées (OMAPI, Kea)
+    "last_restart": None,       # Date de la dernière relance (ISO)
+    "last_duration": None,      # Durée de la dernière relance (s)
+    "total_duration": 0.0,      # Durée cumulée des relances (s)
+    "max_duration": 0.0,        # Durée maximale d'une relance (s)
+}
+last_event: float | None = None     # Dernier événement non traité
 
 
-def restart_dhpc_server(_event) -> None:
-    # Fonction appelée à chaque modification détectée
+def save_stats() -> None:
+    # Écriture (atomique) des statistiques
+    try:
+        with open(f"{stats_file}.tmp", "w") as fp:
+            json.dump(stats, fp, indent=4)
+        os.replace(f"{stats_file}.tmp", stats_file)
+    except OSError as exc:
+        logging.error(f"ERROR - Could not save stats: {exc}")
+
+
+def on_event(event: pyinotify.Event) -> None:
+    # Fonction appelée à chaque écriture terminée dans le dossier
     global last_event
-    now = time.time()
-    if now - last_event < 1:
-        # Ignorer les doubles appels (trop rapprochés)
+    if event.pathname != file:
         return
-    last_event = now
-    logging.info("File modification detected, restarting DHCP server...")
+    stats["events"] += 1
+    last_event = time.monotonic()
+
+
+def config_is_valid() -> bool:
+    # Validation de la configuration complète (qui inclut le fichier)
     try:
-        retcode = subprocess.call(["systemctl", "restart", "isc-dhcp-server"])
-        if retcode < 0:
-            logging.error(f"ERROR - Restart terminated by signal {-retcode}")
-        elif retcode == 0:
-            logging.info("DHCP server restarted!")
-        else:
-            logging.error(f"ERROR - Restart order returned {retcode}")
+        result = subprocess.run(check_command, capture_output=True,
+                                text=True)
+    except OSError as exc:
+        logging.error(f"ERROR - Config check execution failed: {exc}")
+        return False
+    if result.returncode != 0:
+        logging.error("ERROR - Invalid DHCP configuration, server NOT "
+                      f"restarted:\n{result.stderr or result.stdout}")
+        return False
+    return True
+
+
+def already_applied() -> bool:
+    # Le contenu actuel du fichier a-t-il déjà été appliqué en direct ?
+    try:
+        with open(file, "rb") as fp:
+            content_hash = hashlib.sha256(fp.read()).hexdigest()
+        with open(applied_file) as fp:
+            return fp.read().strip() == content_hash
+    except OSError:
+        return False
+
+
+def restart_dhcp_server() -> None:
+    # Relance du serveur DHCP (fichier stable)
+    stats["bursts"] += 1
+    if already_applied():
+        logging.info("File modification already applied live, "
+                     "not restarting DHCP server.")
+        stats["live"] += 1
+        save_stats()
+        return
+    logging.info("File modification detected, checking configuration...")
+    if not config_is_valid():
+        stats["invalid"] += 1
+        save_stats()
+        return
+
+    logging.info("Restarting DHCP server...")
+    start = time.perf_counter()
+    try:
+        retcode = subprocess.call(restart_command)
     except OSError as exc:
         logging.error(f"ERROR - Restart order execution failed: {exc}")
+        retcode = None
+    duration = time.perf_counter() - start
+
+    if retcode == 0:
+        stats["restarts"] += 1
+        stats["last_restart"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        stats["last_duration"] = duration
+        stats["total_duration"] += duration
+        stats["max_duration"] = max(stats["max_duration"], duration)
+        logging.info(f"DHCP server restarted in {duration:.2f}s "
+                     f"({stats['restarts']} restarts, mean "
+                     f"{stats['total_duration'] / stats['restarts']:.2f}s)")
+    else:
+        stats["failures"] += 1
+        if retcode is not None and retcode < 0:
+            logging.error(f"ERROR - Restart terminated by signal {-retcode}")
+        elif retcode is not None:
+            logging.error(f"ERROR - Restart order returned {retcode}")
+    save_stats()
+
+
+def main() -> None:
+    global last_event
+    wm = pyinotify.WatchManager()
+    wm.add_watch(os.path.dirname(file),
+                 pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+    notifier = pyinotify.Notifier(wm, on_event)
+    save_stats()
+    logging.info(f"Started watching {file} (quiet period: {quiet_period}s)...")
+    try:
+        while True:
+            # Attente d'un événement, ou de la fin de la période de calme
+            if last_event is None:
+                timeout = None
+            else:
+                remaining = last_event + quiet_period - time.monotonic()
+                timeout = max(0, int(remaining * 1000))
+            if notifier.check_events(timeout):
+                notifier.read_events()
+                notifier.process_events()
+            if (last_event is not None
+                and time.monotonic() - last_event >= quiet_period):
+                last_event = None
+                restart_dhcp_server()
+    finally:
+        notifier.stop()
+        logging.info(f"Stopped watching {file}.")
 
 
-wm = pyinotify.WatchManager()
-wm.add_watch(file, pyinotify.IN_MODIFY, restart_dhpc_server)
-logging.info(f"Started watching {file}...")
-pyinotify.Notifier(wm).loop()
-logging.info(f"Sopped watching {file}.")
+if __name__ == "__main__":
+    main()